@@ -0,0 +1,90 @@
+"""Peak memory and time to first byte of the CSV export of a result.
+
+Run from api/: python -m benchmarks.csv_export
+"""
+import argparse
+import random
+import time
+import tracemalloc
+import uuid
+
+from src.geojson import csv_export
+from src.io import files
+
+
+def result(count: int, columns: int, seed: int = 0) -> dict:
+    # shaped like a whisp result: a row of stats per plot and a polygon
+    rng = random.Random(seed)
+    features = []
+    for i in range(count):
+        cx, cy = rng.uniform(-70, 40), rng.uniform(-20, 20)
+        ring = [[round(cx + rng.uniform(-0.01, 0.01), 6), round(cy + rng.uniform(-0.01, 0.01), 6)] for _ in range(20)]
+        ring.append(ring[0])
+        props = {"plotId": str(i + 1), "Country": "CIV", "Area": round(rng.uniform(0.5, 10), 3)}
+        props.update({f"Ind_{c:02d}": round(rng.random() * 100, 3) for c in range(columns)})
+        props["risk_pcrop"] = rng.choice(["low", "more_info_needed", "high"])
+        props["whisp_processing_metadata"] = {"whisp_version": "3.0", "analysed": "2026-10-18"}
+        features.append({"type": "Feature", "properties": props, "geometry": {"type": "Polygon", "coordinates": [ring]}})
+    return {"type": "FeatureCollection", "features": features}
+
+
+def buffered(token: str) -> bytes:
+    # the export before streaming: whole result parsed, whole CSV built as one string
+    geojson = files.read_json(files.result_path(token))
+    header = csv_export._column_order(list(geojson["features"][0]["properties"]))
+    lines = [",".join(header)]
+    lines.extend(csv_export._row(feature, header) for feature in geojson["features"])
+    return "\n".join(lines).encode("utf-8")
+
+
+def streamed(token: str):
+    csv, err = csv_export.open_csv(token)
+    assert err is None, err
+    return csv
+
+
+def _run(run, token: str) -> tuple[float, float]:
+    csv_export.result_csv_path(token).unlink(missing_ok=True)
+    started = time.perf_counter()
+    body = run(token)
+    chunks = iter([body]) if isinstance(body, bytes) else body
+    next(chunks)
+    first_byte = time.perf_counter() - started
+    for _ in chunks:
+        pass
+    return first_byte * 1000, (time.perf_counter() - started) * 1000
+
+
+def _measure(run, token: str) -> tuple[float, float, float]:
+    first_byte, total = _run(run, token)
+    # a second run for memory, as tracing slows it down
+    tracemalloc.start()
+    _run(run, token)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return first_byte, total, peak / 2**20
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--columns", type=int, default=60)
+    args = parser.parse_args()
+
+    token = f"bench-{uuid.uuid4().hex}"
+    try:
+        for count in (1_000, 10_000):
+            files.atomic_write_json(files.result_path(token), result(count, args.columns))
+            size = files.result_path(token).stat().st_size / 2**20
+            for name, run in (("buffered", buffered), ("streamed", streamed)):
+                first_byte, total, peak = _measure(run, token)
+                print(
+                    f"{count:>6} features ({size:6.1f} MB)  {name:<9} first byte {first_byte:8.1f} ms"
+                    f"  total {total:8.1f} ms  peak {peak:7.1f} MB"
+                )
+    finally:
+        files.result_path(token).unlink(missing_ok=True)
+        csv_export.result_csv_path(token).unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""End-to-end latency of single-polygon sync submissions against a running API.
+
+Run once with DIRECT_LANE_WORKERS=0 (worker queue) and once with the direct lane enabled,
+then compare the percentiles:
+
+    python -m benchmarks.direct_lane --url http://localhost:8000 --api-key KEY --label queue
+    python -m benchmarks.direct_lane --url http://localhost:8000 --api-key KEY --label direct
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import httpx
+
+from benchmarks.validation import feature_collection
+
+
+def _percentile(timings: list[float], q: float) -> float:
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+async def _submit(client: httpx.AsyncClient, api_key: str, seed: int) -> tuple[float, int]:
+    # a new polygon each time, so neither the result cache nor the feature cache answers
+    body = feature_collection(1, 12, seed=seed)
+    started = time.perf_counter()
+    response = await client.post("/api/submit/geojson", json=body, headers={"x-api-key": api_key})
+    return (time.perf_counter() - started) * 1000, response.status_code
+
+
+async def _run(args: argparse.Namespace) -> None:
+    seeds = random.Random(args.seed).sample(range(10**9), args.requests)
+    limit = asyncio.Semaphore(args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=120) as client:
+
+        async def one(seed: int) -> tuple[float, int]:
+            async with limit:
+                return await _submit(client, args.api_key, seed)
+
+        results = await asyncio.gather(*(one(seed) for seed in seeds))
+
+    timings = [ms for ms, code in results if code == 200]
+    failed = len(results) - len(timings)
+    if not timings:
+        print(f"{args.label}: all {failed} requests failed")
+        return
+    print(
+        f"{args.label:<8} n={len(timings):<5} failed={failed:<4} "
+        f"p50 {statistics.median(timings):8.1f} ms  p99 {_percentile(timings, 0.99):8.1f} ms  "
+        f"max {max(timings):8.1f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--api-key", required=True)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Size and load time of a result in each download format.
+
+Run from api/: python -m benchmarks.geo_export
+"""
+import argparse
+import csv
+import json
+import time
+import uuid
+
+import pyarrow.parquet as pq
+from pyogrio.raw import read_arrow
+
+from benchmarks.csv_export import result
+from src.geojson import csv_export, geo_export
+from src.io import files, result_table
+
+
+def _load_geojson(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _load_csv(path):
+    # geometries come as GeoJSON text, so a GIS client parses them too
+    with open(path, encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        return [json.loads(row["geo"]) for row in reader]
+
+
+def _load_geoparquet(path):
+    return pq.read_table(path)
+
+
+def _load_flatgeobuf(path):
+    return read_arrow(path)
+
+
+def _time(load, path, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        load(path)
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--columns", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    token = f"bench-{uuid.uuid4().hex}"
+    paths = []
+    try:
+        for count in (1_000, 10_000):
+            for path in (files.result_table_path(token), geo_export.flatgeobuf_path(token), csv_export.result_csv_path(token)):
+                path.unlink(missing_ok=True)
+            files.atomic_write_json(files.result_path(token), result(count, args.columns))
+            csv_body, err = csv_export.open_csv(token)
+            for _ in csv_body:
+                pass
+            started = time.perf_counter()
+            result_table.ensure(token)
+            build_parquet = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            geo_export.flatgeobuf(token)
+            build_fgb = (time.perf_counter() - started) * 1000
+            formats = (
+                ("geojson", files.result_path(token), _load_geojson, None),
+                ("csv", csv_export.result_csv_path(token), _load_csv, None),
+                ("geoparquet", files.result_table_path(token), _load_geoparquet, build_parquet),
+                ("flatgeobuf", geo_export.flatgeobuf_path(token), _load_flatgeobuf, build_fgb),
+            )
+            paths = [path for _, path, _, _ in formats]
+            for name, path, load, build in formats:
+                size = path.stat().st_size / 2**20
+                built = f"  built in {build:7.1f} ms" if build is not None else ""
+                print(
+                    f"{count:>6} features  {name:<11} {size:7.2f} MB"
+                    f"  load {_time(load, path, args.repeat):8.1f} ms{built}"
+                )
+    finally:
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Per-request overhead of the rate limiter for a hot key.
+
+Needs the Redis of REDIS_URL. Run from api/: python -m benchmarks.rate_limiter
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from src.auth import rate_limiter
+from src.redis import close_redis, init_redis
+
+
+async def _time(check, requests: int) -> list[float]:
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        await check()
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return timings
+
+
+async def _run(args: argparse.Namespace) -> None:
+    await init_redis()
+    # limits high enough that every request is allowed; a limit below the lease fraction
+    # gets no lease, so each request is a Redis round trip
+    window_ms = 60_000
+    candidates = {
+        "in-process (previous)": lambda key: _local(key, window_ms, 10**9),
+        "redis, no lease": lambda key: rate_limiter.check_rate_limit(key, window_ms, 9),
+        "redis, leased": lambda key: rate_limiter.check_rate_limit(key, window_ms, 10**6),
+    }
+    try:
+        for name, check in candidates.items():
+            key = f"benchmark-{uuid.uuid4()}"
+            if name == "redis, no lease":
+                # stays under 9 per minute by using a new key each time
+                timings = await _time(lambda: check(f"{key}-{uuid.uuid4()}"), args.requests)
+            else:
+                timings = await _time(lambda: check(key), args.requests)
+            ordered = sorted(timings)
+            print(
+                f"{name:<22} median {statistics.median(timings):8.1f} us  "
+                f"p99 {ordered[int(0.99 * (len(ordered) - 1))]:8.1f} us"
+            )
+    finally:
+        await close_redis()
+
+
+async def _local(key: str, window_ms: int, limit: int) -> rate_limiter.RateLimitResult:
+    return rate_limiter._check_local(key, window_ms, limit)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
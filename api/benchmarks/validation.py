@@ -0,0 +1,70 @@
+"""Latency of submission validation at the sync and async geometry limits.
+
+Run from api/: python -m benchmarks.validation
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from src.submit.geometry_arrays import GeometryArrays
+
+
+def _polygon(rng: random.Random, vertices: int) -> dict:
+    cx, cy = rng.uniform(-70, 40), rng.uniform(-20, 20)
+    ring = [[round(cx + rng.uniform(-0.01, 0.01), 6), round(cy + rng.uniform(-0.01, 0.01), 6)] for _ in range(vertices - 1)]
+    ring.append(ring[0])
+    return {"type": "Polygon", "coordinates": [ring]}
+
+
+def feature_collection(count: int, vertices: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "properties": {"plot": f"P{i}"}, "geometry": _polygon(rng, vertices)}
+            for i in range(count)
+        ],
+    }
+
+
+def validate(fc: dict) -> dict:
+    geometry = GeometryArrays()
+    geometry.add(fc)
+    return geometry.report().input_metrics
+
+
+def _time(fn, fc: dict, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        # each run gets a fresh copy, as a request body would
+        data = json.loads(json.dumps(fc))
+        started = time.perf_counter()
+        fn(data)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vertices", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--whisp", action="store_true", help="also time whisp.analyze_geojson")
+    args = parser.parse_args()
+
+    candidates = {"geometry_arrays": validate}
+    if args.whisp:
+        import openforis_whisp as whisp
+
+        candidates["whisp.analyze_geojson"] = whisp.analyze_geojson
+
+    for count in (500, 10_000):
+        fc = feature_collection(count, args.vertices)
+        for name, fn in candidates.items():
+            timings = _time(fn, fc, args.repeat)
+            print(f"{count:>6} geometries  {name:<24} median {statistics.median(timings):8.1f} ms  max {max(timings):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
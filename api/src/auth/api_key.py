@@ -3,9 +3,10 @@ from dataclasses import dataclass
 from fastapi import Header
 
 from src.app_logging import bind
+from src.auth import key_cache
 from src.auth.rate_limiter import check_rate_limit
 from src.codes import SystemCode
-from src.db.api_keys import ApiKeyRow, find_api_key
+from src.db.api_keys import ApiKeyRow
 from src.exceptions import AppError
 
 _DEFAULT_RATE_LIMIT_WINDOW_MS = 60_000
@@ -25,7 +26,7 @@ async def api_key_dependency(
     if not x_api_key:
         raise AppError(SystemCode.AUTH_MISSING_API_KEY)
 
-    row: ApiKeyRow | None = await find_api_key(x_api_key)
+    row: ApiKeyRow | None = await key_cache.resolve(x_api_key)
     if row is None:
         raise AppError(SystemCode.AUTH_INVALID_API_KEY)
 
@@ -34,7 +35,7 @@ async def api_key_dependency(
     window_ms = row.rate_limit_window_ms or _DEFAULT_RATE_LIMIT_WINDOW_MS
     limit = row.rate_limit_max_requests or _DEFAULT_RATE_LIMIT_MAX_REQUESTS
 
-    result = check_rate_limit(str(row.id), window_ms, limit)
+    result = await check_rate_limit(str(row.id), window_ms, limit)
     if not result.allowed:
         raise AppError(SystemCode.AUTH_RATE_LIMIT_EXCEEDED, [result.retry_after])
 
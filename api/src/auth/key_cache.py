@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import asyncpg
+
+from src.config import get_settings
+from src.db.api_keys import ApiKeyRow, find_api_key
+from src.db.pool import connection_params
+from src.metrics import API_KEY_LOOKUP_DURATION, API_KEY_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Per-process cache of find_api_key, including unknown keys for a shorter time. The
+# database announces changed keys on a channel (see the api_key_cache migration) that
+# every API process listens to; the TTL bounds staleness while that connection is down.
+# Entries are keyed by the SHA-256 of the key, which is what the channel carries.
+_CHANNEL = "api_key_changes"
+_ALL = "*"
+_RECONNECT_SECONDS = (1, 2, 5, 10, 30)
+
+_entries: OrderedDict[str, tuple[ApiKeyRow | None, float]] = OrderedDict()
+# bumped on every invalidation, so a lookup that raced one is not cached
+_generation = 0
+_listener: asyncio.Task | None = None
+
+
+def _ttl(row: ApiKeyRow | None) -> float:
+    settings = get_settings()
+    if row is None:
+        return settings.api_key_cache_negative_ttl_seconds
+    ttl = float(settings.api_key_cache_ttl_seconds)
+    if row.expires_at is not None:
+        ttl = min(ttl, (row.expires_at - datetime.now(timezone.utc)).total_seconds())
+    return ttl
+
+
+def _digest(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+async def resolve(api_key: str) -> ApiKeyRow | None:
+    started = time.perf_counter()
+    digest = _digest(api_key)
+    entry = _entries.get(digest)
+    if entry is not None and entry[1] > time.monotonic():
+        _entries.move_to_end(digest)
+        API_KEY_LOOKUPS.labels(result="hit" if entry[0] is not None else "negative_hit").inc()
+        API_KEY_LOOKUP_DURATION.labels(source="cache").observe(time.perf_counter() - started)
+        return entry[0]
+
+    generation = _generation
+    row = await find_api_key(api_key)
+    API_KEY_LOOKUPS.labels(result="miss").inc()
+    API_KEY_LOOKUP_DURATION.labels(source="db").observe(time.perf_counter() - started)
+
+    ttl = _ttl(row)
+    if ttl > 0 and get_settings().api_key_cache_ttl_seconds > 0 and generation == _generation:
+        _entries[digest] = (row, time.monotonic() + ttl)
+        _entries.move_to_end(digest)
+        while len(_entries) > get_settings().api_key_cache_max_entries:
+            _entries.popitem(last=False)
+    return row
+
+
+def invalidate(digest: str) -> None:
+    # `digest` is the SHA-256 of the changed key (hex), or _ALL
+    global _generation
+    _generation += 1
+    if digest == _ALL:
+        _entries.clear()
+    else:
+        _entries.pop(digest, None)
+
+
+def _on_notification(_conn, _pid, _channel, payload: str) -> None:
+    invalidate(payload)
+
+
+async def _listen() -> None:
+    attempt = 0
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(**connection_params())
+            closed = asyncio.Event()
+            conn.add_termination_listener(lambda _conn: closed.set())
+            await conn.add_listener(_CHANNEL, _on_notification)
+            # changes made while not listening were missed
+            invalidate(_ALL)
+            attempt = 0
+            logger.info("listening for API key changes")
+            await closed.wait()
+            logger.warning("API key change listener disconnected")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("API key change listener failed")
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        invalidate(_ALL)
+        await asyncio.sleep(_RECONNECT_SECONDS[min(attempt, len(_RECONNECT_SECONDS) - 1)])
+        attempt += 1
+
+
+def start_listener() -> None:
+    global _listener
+    if _listener is None and get_settings().api_key_cache_ttl_seconds > 0:
+        _listener = asyncio.create_task(_listen())
+
+
+async def stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
+    invalidate(_ALL)
@@ -1,8 +1,13 @@
+import logging
 import math
 import threading
 import time
 from dataclasses import dataclass
 
+from src.redis import client
+
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class RateLimitResult:
@@ -10,6 +15,36 @@ class RateLimitResult:
     retry_after: int
 
 
+# Shared limit across API replicas: GCRA in one Lua round trip. The key holds the
+# theoretical arrival time (TAT) in ms; `limit` requests fit in `window_ms` back to back and
+# then one per `window_ms / limit`. Redis time is used so replicas agree on "now".
+_GCRA = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local interval = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then tat = now end
+local granted = math.min(tonumber(ARGV[3]), math.floor((window - (tat - now)) / interval))
+if granted < 1 then
+  return {0, math.ceil(tat + interval - window - now)}
+end
+tat = tat + interval * granted
+redis.call('SET', KEYS[1], tat, 'PX', math.ceil(tat - now))
+return {granted, 0}
+"""
+
+# Hot keys take a few requests at once and spend them locally for a short while, so most
+# of their requests skip Redis. Unspent requests expire with the lease, which can only make
+# the limit stricter. A refusal is remembered locally until its retry time.
+_LEASE_TTL_MS = 1000
+_LEASE_FRACTION = 10
+_LEASE_MAX = 10
+_LOCAL_MAX_KEYS = 10_000
+
+# key -> (requests left in the lease, or -1 while refused; expiry in ms)
+_local: dict[str, tuple[int, int]] = {}
+
 _lock = threading.Lock()
 _store: dict[str, tuple[int, int]] = {}
 
@@ -18,19 +53,66 @@ def _now_ms() -> int:
     return int(time.time() * 1000)
 
 
-def check_rate_limit(key: str, window_ms: int, limit: int) -> RateLimitResult:
+def _retry_after(ms: int) -> int:
+    return max(1, math.ceil(ms / 1000))
+
+
+def _prune(entries: dict[str, tuple[int, int]], now: int) -> None:
+    if len(entries) < _LOCAL_MAX_KEYS:
+        return
+    for key in [k for k, (_, expires_at) in entries.items() if expires_at <= now]:
+        del entries[key]
+    if len(entries) >= _LOCAL_MAX_KEYS:
+        entries.clear()
+
+
+def _check_local(key: str, window_ms: int, limit: int) -> RateLimitResult:
+    # Per-process fixed window, used while Redis is unavailable.
     now = _now_ms()
     with _lock:
         entry = _store.get(key)
         if entry is None or entry[1] <= now:
+            _prune(_store, now)
             reset_at = now + window_ms
             _store[key] = (1, reset_at)
             return RateLimitResult(True, 0)
 
         count, reset_at = entry
         if count >= limit:
-            retry_after = max(1, math.ceil((reset_at - now) / 1000))
-            return RateLimitResult(False, retry_after)
+            return RateLimitResult(False, _retry_after(reset_at - now))
 
         _store[key] = (count + 1, reset_at)
         return RateLimitResult(True, 0)
+
+
+async def _take(key: str, window_ms: int, limit: int, wanted: int) -> tuple[int, int]:
+    # Returns how many requests were granted (up to `wanted`) and, when none, the retry delay in ms.
+    granted, retry_ms = await client().eval(_GCRA, 1, f"ratelimit:{key}", window_ms / limit, window_ms, wanted)
+    return int(granted), int(retry_ms)
+
+
+async def check_rate_limit(key: str, window_ms: int, limit: int) -> RateLimitResult:
+    now = _now_ms()
+    left, expires_at = _local.get(key, (0, 0))
+    if expires_at > now:
+        if left < 0:
+            return RateLimitResult(False, _retry_after(expires_at - now))
+        if left > 0:
+            _local[key] = (left - 1, expires_at)
+            return RateLimitResult(True, 0)
+
+    try:
+        granted, retry_ms = await _take(key, window_ms, limit, max(1, min(_LEASE_MAX, limit // _LEASE_FRACTION)))
+    except Exception:
+        logger.exception("rate limiter unavailable, limiting per process")
+        return _check_local(key, window_ms, limit)
+
+    _prune(_local, now)
+    if not granted:
+        _local[key] = (-1, now + retry_ms)
+        return RateLimitResult(False, _retry_after(retry_ms))
+    if granted > 1:
+        _local[key] = (granted - 1, now + _LEASE_TTL_MS)
+    else:
+        _local.pop(key, None)
+    return RateLimitResult(True, 0)
@@ -28,9 +28,14 @@ class SystemCode(str, Enum):
     VALIDATION_INVALID_EXTERNAL_ID_COLUMN = ("validation_invalid_external_id_column", 400, 'The external ID column "{0}" does not exist in your GeoJSON features. Available columns: {1}')
     VALIDATION_GEO_ID_NOT_FOUND = ("validation_geo_id_not_found", 400, "One or more Geo IDs were not found in GeoID.")
     VALIDATION_INVALID_GEO_ID = ("validation_invalid_geo_id", 400, 'Invalid Geo ID "{0}".')
+    VALIDATION_INVALID_IDEMPOTENCY_KEY = ("validation_invalid_idempotency_key", 400, "Invalid Idempotency-Key header. Use 1 to {0} printable ASCII characters.")
+    VALIDATION_IDEMPOTENCY_KEY_REUSED = ("validation_idempotency_key_reused", 422, "This Idempotency-Key was already used with a different request.")
+    VALIDATION_IDEMPOTENCY_KEY_IN_USE = ("validation_idempotency_key_in_use", 409, "A request with this Idempotency-Key is still being processed. Please retry shortly.")
+    VALIDATION_INVALID_RESULT_FIELD = ("validation_invalid_result_field", 400, 'Unknown result field "{0}". Available fields: {1}')
 
     SERVICE_GEOID_NOT_CONFIGURED = ("service_geoid_not_configured", 503, "GeoID service is not configured. Please contact the administrator.")
     SERVICE_GEOID_UNAVAILABLE = ("service_geoid_unavailable", 503, "GeoID service is currently unavailable. Please try again later.")
+    SERVICE_SUBMISSIONS_BUSY = ("service_submissions_busy", 503, "Too many submissions are being validated. Please retry in {0} seconds.")
 
     ANALYSIS_QUEUED = ("analysis_queued", 202, "Analysis queued, waiting for available worker...")
     ANALYSIS_PROCESSING = ("analysis_processing", 202, "Analysis in progress...")
@@ -48,6 +48,23 @@ class Settings(BaseSettings):
     geometry_limit_async: int = 10000
     analysis_timeout_sync_seconds: int = 60
     analysis_timeout_async_seconds: int = 1800
+    analysis_shard_features: int = 1000
+    # async runs above this many features are analysed in chunks that are checkpointed, so a
+    # redelivered task resumes after the last finished one; 0 disables
+    analysis_checkpoint_features: int = 250
+    analysis_max_shards: int = 8
+    # small sync jobs arriving within the window run as one whisp call; 0 disables batching
+    sync_batch_window_ms: int = 250
+    sync_batch_job_features: int = 5
+    sync_batch_max_jobs: int = 20
+    sync_batch_max_features: int = 100
+    # worker progress events are coalesced per job and published at most this often; 0 publishes each one
+    progress_publish_interval_ms: int = 250
+    # a cancelled task still running after this long is killed, which restarts its worker process
+    cancel_grace_seconds: int = 30
+    # API processes that analyse tiny sync submissions directly; 0 disables the lane
+    direct_lane_workers: int = 0
+    direct_lane_max_features: int = 1
 
     def analysis_timeout_seconds(self, *, async_mode: bool) -> int:
         return (
@@ -56,6 +73,23 @@ class Settings(BaseSettings):
             else self.analysis_timeout_sync_seconds
         )
 
+    validation_workers: int = 2
+    validation_queue_limit: int = 8
+    validation_inline_max_kb: int = 64
+    validation_retry_after_seconds: int = 5
+
+    result_cache_ttl_seconds: int = 86400
+    result_cache_max_entries: int = 5000
+    feature_cache_ttl_seconds: int = 604800
+    feature_cache_max_entries: int = 1000000
+
+    idempotency_ttl_seconds: int = 86400
+
+    # 0 disables the per-process API key cache
+    api_key_cache_ttl_seconds: int = 60
+    api_key_cache_negative_ttl_seconds: int = 5
+    api_key_cache_max_entries: int = 10000
+
     geoid_base_url: str = ""
     geoid_resolve_concurrency: int = 20
 
@@ -91,6 +125,10 @@ class Settings(BaseSettings):
             return None
         return self.max_request_body_size_kb * 1024
 
+    @property
+    def validation_inline_max_bytes(self) -> int:
+        return self.validation_inline_max_kb * 1024
+
     def public_config(self) -> dict[str, int | str | None]:
         return {
             "maxRequestBodySizeKb": self.max_request_body_size_kb,
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from datetime import datetime
 
 from src.db.pool import get_pool
 
@@ -10,12 +11,13 @@ class ApiKeyRow:
     rate_limit_window_ms: int | None
     rate_limit_max_requests: int | None
     max_concurrent_analyses: int | None
+    expires_at: datetime | None = None
 
 
 async def find_api_key(api_key: str) -> ApiKeyRow | None:
     pool = get_pool()
     row = await pool.fetchrow(
-        "SELECT id, user_id, rate_limit_window_ms, rate_limit_max_requests, max_concurrent_analyses "
+        "SELECT id, user_id, rate_limit_window_ms, rate_limit_max_requests, max_concurrent_analyses, expires_at "
         "FROM find_api_key($1)",
         api_key,
     )
@@ -27,4 +29,5 @@ async def find_api_key(api_key: str) -> ApiKeyRow | None:
         rate_limit_window_ms=row["rate_limit_window_ms"],
         rate_limit_max_requests=row["rate_limit_max_requests"],
         max_concurrent_analyses=row["max_concurrent_analyses"],
+        expires_at=row["expires_at"],
     )
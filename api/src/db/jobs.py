@@ -2,17 +2,13 @@ import json
 from datetime import datetime, timezone
 from typing import Any
 
-from src.codes import RUNNING_STATUSES, SystemCode
+from src.codes import RUNNING_STATUSES, TERMINAL_STATUSES, SystemCode
 from src.db.pool import acquire_pool
 from src.exceptions import AppError
 
 
-def _queued_condition(is_async: bool) -> str:
-    return (
-        "analysis_options->>'async' = 'true'"
-        if is_async
-        else "(analysis_options IS NULL OR analysis_options->>'async' IS DISTINCT FROM 'true')"
-    )
+# jobs attached to an identical run (see src.submit.inflight) do not hold a worker slot
+COALESCED = "coalesced"
 
 
 async def create_analysis_job(
@@ -28,23 +24,30 @@ async def create_analysis_job(
     analysis_options: dict | None,
     timeout_seconds: int | None = None,
     status: SystemCode,
-    is_async: bool = False,
     openforis_whisp_version: str | None = None,
     earthengine_api_version: str | None = None,
     max_concurrent_analyses: int | None = None,
     input_metrics: dict | None = None,
-) -> int:
+    result_source: str | None = None,
+    source_job_id: str | None = None,
+    started_at: datetime | None = None,
+    error_message: str | None = None,
+) -> None:
     pool = await acquire_pool()
     async with pool.acquire() as conn:
         async with conn.transaction():
             if user_id is not None and max_concurrent_analyses:
-                row = await conn.fetchrow(
-                    "SELECT COUNT(*)::int AS running FROM analysis_jobs "
-                    "WHERE user_id = $1 AND status = ANY($2::text[])",
+                # The counter is kept by a trigger on analysis_jobs (see the running_analyses
+                # migration). Locking its row until commit serialises a user's submissions, so
+                # the insert below is counted before the next one is admitted.
+                running = await conn.fetchval(
+                    """
+                    INSERT INTO user_running_analyses (user_id, running) VALUES ($1, 0)
+                    ON CONFLICT (user_id) DO UPDATE SET running = user_running_analyses.running
+                    RETURNING running
+                    """,
                     user_id,
-                    [s.value for s in RUNNING_STATUSES],
                 )
-                running = int(row["running"]) if row else 0
                 if running >= max_concurrent_analyses:
                     raise AppError(SystemCode.ANALYSIS_TOO_MANY_CONCURRENT)
 
@@ -53,8 +56,14 @@ async def create_analysis_job(
                 INSERT INTO analysis_jobs (
                     id, api_key_id, user_id, agent, ip_address, api_version, endpoint,
                     feature_count, analysis_options, timeout_seconds, status,
-                    openforis_whisp_version, earthengine_api_version, input_metrics, created_at
-                ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9::jsonb, $10, $11, $12, $13, $14::jsonb, now())
+                    openforis_whisp_version, earthengine_api_version, input_metrics,
+                    result_source, source_job_id, error_message, created_at, started_at, completed_at
+                ) VALUES (
+                    $1, $2, $3, $4, $5, $6, $7, $8, $9::jsonb, $10, $11, $12, $13, $14::jsonb, $15, $16, $19,
+                    COALESCE($18, now()),
+                    CASE WHEN $11 = ANY($17::text[]) THEN COALESCE($18, now()) END,
+                    CASE WHEN $11 = ANY($17::text[]) THEN now() END
+                )
                 """,
                 job_id,
                 api_key_id,
@@ -70,15 +79,13 @@ async def create_analysis_job(
                 openforis_whisp_version,
                 earthengine_api_version,
                 json.dumps(input_metrics) if input_metrics is not None else None,
+                result_source,
+                source_job_id,
+                [s.value for s in TERMINAL_STATUSES],
+                started_at,
+                error_message,
             )
 
-            row = await conn.fetchrow(
-                f"SELECT COUNT(*)::int AS pos FROM analysis_jobs "
-                f"WHERE status = $1 AND {_queued_condition(is_async)}",
-                SystemCode.ANALYSIS_QUEUED.value,
-            )
-            return row["pos"] if row else 1
-
 
 _FIELD_TO_COLUMN: dict[str, str] = {
     "status": "status",
@@ -118,21 +125,21 @@ async def update_analysis_job(job_id: str, **updates: Any) -> None:
     )
 
 
-async def list_queued_jobs(is_async: bool) -> list[dict]:
+async def add_analysis_metrics(job_id: str, metrics: dict) -> None:
+    # merged into the metrics recorded so far
     pool = await acquire_pool()
-    rows = await pool.fetch(
-        f"SELECT id, feature_count FROM analysis_jobs "
-        f"WHERE status = $1 AND {_queued_condition(is_async)} ORDER BY created_at ASC",
-        SystemCode.ANALYSIS_QUEUED.value,
+    await pool.execute(
+        "UPDATE analysis_jobs SET analysis_metrics = COALESCE(analysis_metrics, '{}'::jsonb) || $2::jsonb WHERE id = $1",
+        job_id,
+        json.dumps(metrics),
     )
-    return [dict(r) for r in rows]
 
 
 async def get_job(job_id: str) -> dict | None:
     pool = await acquire_pool()
     row = await pool.fetchrow(
-        "SELECT id, status, feature_count, error_message, timeout_seconds, analysis_options "
-        "FROM analysis_jobs WHERE id = $1",
+        "SELECT id, status, feature_count, error_message, timeout_seconds, analysis_options, "
+        "result_source, source_job_id FROM analysis_jobs WHERE id = $1",
         job_id,
     )
     if row is None:
@@ -140,5 +147,75 @@ async def get_job(job_id: str) -> dict | None:
     return dict(row)
 
 
+async def list_followers(job_id: str) -> list[str]:
+    pool = await acquire_pool()
+    rows = await pool.fetch(
+        "SELECT id FROM analysis_jobs "
+        "WHERE source_job_id = $1 AND result_source = $2 AND status = ANY($3::text[])",
+        job_id,
+        COALESCED,
+        [s.value for s in RUNNING_STATUSES],
+    )
+    return [str(r["id"]) for r in rows]
+
+
+async def start_followers(job_id: str) -> None:
+    pool = await acquire_pool()
+    await pool.execute(
+        "UPDATE analysis_jobs SET status = $3, started_at = now() "
+        "WHERE source_job_id = $1 AND result_source = $2 AND status = $4",
+        job_id,
+        COALESCED,
+        SystemCode.ANALYSIS_PROCESSING.value,
+        SystemCode.ANALYSIS_QUEUED.value,
+    )
+
+
+async def finish_followers(
+    job_id: str, follower_ids: list[str], status: SystemCode, error_message: str | None = None
+) -> list[str]:
+    # Only followers still waiting are updated, so cancelled ones keep their status.
+    pool = await acquire_pool()
+    rows = await pool.fetch(
+        "UPDATE analysis_jobs SET status = $4, error_message = $5, "
+        "started_at = COALESCE(started_at, now()), completed_at = now() "
+        "WHERE source_job_id = $1 AND id = ANY($2::uuid[]) AND result_source = $3 AND status = ANY($6::text[]) "
+        "RETURNING id",
+        job_id,
+        follower_ids,
+        COALESCED,
+        status.value,
+        error_message,
+        [s.value for s in RUNNING_STATUSES],
+    )
+    return [str(r["id"]) for r in rows]
+
+
+async def start_jobs(job_ids: list[str]) -> list[str]:
+    # Batched jobs still queued; cancelled ones are left out.
+    pool = await acquire_pool()
+    rows = await pool.fetch(
+        "UPDATE analysis_jobs SET status = $2, started_at = now() "
+        "WHERE id = ANY($1::uuid[]) AND status = $3 RETURNING id",
+        job_ids,
+        SystemCode.ANALYSIS_PROCESSING.value,
+        SystemCode.ANALYSIS_QUEUED.value,
+    )
+    return [str(r["id"]) for r in rows]
+
+
+async def finish_jobs(job_ids: list[str], status: SystemCode, error_message: str | None = None) -> list[str]:
+    pool = await acquire_pool()
+    rows = await pool.fetch(
+        "UPDATE analysis_jobs SET status = $2, error_message = $3, completed_at = now() "
+        "WHERE id = ANY($1::uuid[]) AND status = ANY($4::text[]) RETURNING id",
+        job_ids,
+        status.value,
+        error_message,
+        [s.value for s in RUNNING_STATUSES],
+    )
+    return [str(r["id"]) for r in rows]
+
+
 def utc_now() -> datetime:
     return datetime.now(timezone.utc)
@@ -11,18 +11,29 @@ logger = logging.getLogger(__name__)
 
 
 class AppError(Exception):
-    def __init__(self, code: SystemCode, args: list | None = None, cause: str | None = None):
+    def __init__(
+        self,
+        code: SystemCode,
+        args: list | None = None,
+        cause: str | None = None,
+        headers: dict[str, str] | None = None,
+    ):
         self.code = code
         self.format_args = args
         self.cause = cause
+        self.headers = headers
         super().__init__(code.format(args))
 
+    def __reduce__(self):
+        # raised in validation worker processes and re-raised in the API process
+        return type(self), (self.code, self.format_args, self.cause, self.headers)
+
 
 def register(app: FastAPI) -> None:
     @app.exception_handler(AppError)
     async def _app_error(_req: Request, exc: AppError):
         logger.warning("app_error code=%s cause=%s", exc.code.value, exc.cause or "")
-        return api_response(exc.code, args=exc.format_args, cause=exc.cause)
+        return api_response(exc.code, args=exc.format_args, cause=exc.cause, headers=exc.headers)
 
     @app.exception_handler(RequestValidationError)
     async def _validation_error(_req: Request, _exc: RequestValidationError):
@@ -1,10 +1,15 @@
 import json
+import uuid
+from collections.abc import Iterator
 from datetime import datetime
 from pathlib import Path
-from typing import Any
+from typing import Any, BinaryIO
 from urllib.parse import quote
 
 from src.io import files
+from src.io.json_stream import JsonStreamError, ObjectStreamParser
+
+_CHUNK_SIZE = 64 * 1024
 
 
 def valid_token(token: str) -> bool:
@@ -35,8 +40,7 @@ def _to_csv_value(value: Any) -> str:
     return str(value)
 
 
-def _column_order(properties: dict[str, Any]) -> list[str]:
-    keys = list(properties.keys())
+def _column_order(keys: list[str]) -> list[str]:
     try:
         whisp_idx = keys.index("whisp_processing_metadata")
         return keys[:whisp_idx] + ["geo"] + keys[whisp_idx:]
@@ -51,41 +55,71 @@ def _escape_csv(value: str) -> str:
     return value
 
 
-def geojson_to_csv_string(geojson: dict[str, Any]) -> str | None:
-    if geojson.get("type") != "FeatureCollection":
-        return None
-    features = geojson.get("features")
-    if not isinstance(features, list) or not features:
-        return None
+def _events(file: BinaryIO) -> Iterator[tuple[str, Any]]:
+    # the members of a result file, with its features one at a time
+    file.seek(0)
+    parser = ObjectStreamParser("features")
+    while chunk := file.read(_CHUNK_SIZE):
+        yield from parser.feed(chunk)
+    yield from parser.close()
 
-    first = features[0] if isinstance(features[0], dict) else {}
-    props = first.get("properties") if isinstance(first.get("properties"), dict) else {}
-    header = _column_order(props)
-    if not header:
-        return None
 
-    rows: list[list[str]] = []
-    for feature in features:
-        if not isinstance(feature, dict):
+def _properties(feature: dict) -> dict[str, Any]:
+    props = feature.get("properties")
+    return props if isinstance(props, dict) else {}
+
+
+def _columns(file: BinaryIO) -> list[str] | None:
+    # Union of the property names of all features, in the order they first appear. None when
+    # the file is not a FeatureCollection with features.
+    keys: dict[str, None] = {}
+    is_collection = False
+    count = 0
+    for kind, value in _events(file):
+        if kind == "member":
+            is_collection = is_collection or value == ("type", "FeatureCollection")
             continue
-        feature_props = feature.get("properties") if isinstance(feature.get("properties"), dict) else {}
-        row = []
-        for col in header:
-            if col == "geo":
-                row.append(_to_csv_value(feature.get("geometry")))
-            else:
-                row.append(_to_csv_value(feature_props.get(col)))
-        rows.append(row)
+        count += 1
+        if isinstance(value, dict):
+            keys.update(dict.fromkeys(_properties(value)))
+    if not is_collection or not count:
+        return None
+    return _column_order(list(keys))
+
+
+def _row(feature: dict, header: list[str]) -> str:
+    props = _properties(feature)
+    return ",".join(
+        _escape_csv(_to_csv_value(feature.get("geometry") if col == "geo" else props.get(col))) for col in header
+    )
+
 
-    lines = [",".join(header)]
-    lines.extend(",".join(_escape_csv(cell) for cell in row) for row in rows)
-    return "\n".join(lines)
+def _lines(file: BinaryIO, header: list[str]) -> Iterator[bytes]:
+    # rows joined by newlines, without a trailing one, in chunks of about _CHUNK_SIZE
+    parts = [",".join(header)]
+    size = 0
+    for kind, feature in _events(file):
+        if kind != "item" or not isinstance(feature, dict):
+            continue
+        row = _row(feature, header)
+        parts.append(row)
+        size += len(row)
+        if size >= _CHUNK_SIZE:
+            yield "\n".join(parts).encode("utf-8")
+            # the next chunk starts with the newline ending this one
+            parts = [""]
+            size = 0
+    yield "\n".join(parts).encode("utf-8")
 
 
 def csv_attachment_headers(filename: str) -> dict[str, str]:
+    return attachment_headers(filename, "text/csv; charset=utf-8")
+
+
+def attachment_headers(filename: str, media_type: str) -> dict[str, str]:
     encoded = quote(filename)
     return {
-        "Content-Type": "text/csv; charset=utf-8",
+        "Content-Type": media_type,
         "Content-Disposition": (
             f"attachment; filename*=UTF-8''{encoded}; filename=\"{filename}\""
         ),
@@ -93,29 +127,42 @@ def csv_attachment_headers(filename: str) -> dict[str, str]:
     }
 
 
-def load_or_build_csv(token: str) -> tuple[str | None, str | None]:
+def _stream(file: BinaryIO, header: list[str], csv_path: Path) -> Iterator[bytes]:
+    # Writes the cached copy while the rows are sent; a download cut short leaves none.
+    tmp = csv_path.with_name(f"{csv_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with file, open(tmp, "wb") as out:
+            for chunk in _lines(file, header):
+                out.write(chunk)
+                yield chunk
+        tmp.replace(csv_path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def open_csv(token: str) -> tuple[Path | Iterator[bytes] | None, str | None]:
+    # The cached CSV of the result, or an iterator building it (and the cache) row by row.
+    # Blocking: the column union reads the whole result once before the first row.
     csv_path = result_csv_path(token)
-    if csv_path.is_file():
-        cached = csv_path.read_text(encoding="utf-8")
-        if cached:
-            return cached, None
+    if csv_path.is_file() and csv_path.stat().st_size:
+        return csv_path, None
 
-    json_path = files.result_path(token)
-    if not json_path.is_file():
+    try:
+        file = open(files.result_path(token), "rb")
+    except FileNotFoundError:
         return None, "not_found"
 
     try:
-        geojson = files.read_json(json_path)
-    except Exception:
+        header = _columns(file)
+    except (JsonStreamError, UnicodeDecodeError):
+        file.close()
         return None, "invalid_json"
-
-    csv = geojson_to_csv_string(geojson)
-    if csv is None:
+    except BaseException:
+        file.close()
+        raise
+    if header is None:
+        file.close()
         return None, "no_features"
 
     csv_path.parent.mkdir(parents=True, exist_ok=True)
-    tmp = csv_path.with_suffix(csv_path.suffix + ".tmp")
-    tmp.write_text(csv, encoding="utf-8")
-    tmp.replace(csv_path)
-
-    return csv, None
+    return _stream(file, header, csv_path), None
@@ -0,0 +1,53 @@
+import os
+import uuid
+from pathlib import Path
+
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from src.io import files, result_table
+
+# GIS downloads of a result, built from its GeoParquet copy (src.io.result_table) and kept
+# next to it.
+GEOPARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+FLATGEOBUF_MEDIA_TYPE = "application/flatgeobuf"
+
+
+def flatgeobuf_path(token: str) -> Path:
+    return files.result_path(token).parent / f"{token}-result.fgb"
+
+
+def geoparquet(token: str) -> Path | None:
+    return result_table.ensure(token)
+
+
+def flatgeobuf(token: str) -> Path | None:
+    # Blocking. With a packed Hilbert R-tree, so readers can fetch features by bounding box.
+    from pyogrio.raw import write_arrow
+
+    path = flatgeobuf_path(token)
+    if path.exists():
+        return path
+    source = result_table.ensure(token)
+    if source is None:
+        return None
+    table = pq.read_table(source, memory_map=True)
+    # the index cannot hold features without a geometry, which the GeoJSON leaves out too
+    table = table.filter(pc.is_valid(table[result_table.GEOMETRY]))
+    types = result_table.geometry_types(table.schema)
+    # GDAL writes a directory of layers unless the name ends in .fgb
+    tmp = path.with_name(f"{path.stem}.{uuid.uuid4().hex}.tmp.fgb")
+    try:
+        write_arrow(
+            table,
+            tmp,
+            driver="FlatGeobuf",
+            geometry_name=result_table.GEOMETRY,
+            geometry_type=types[0] if len(types) == 1 else "Unknown",
+            crs="OGC:CRS84",
+            layer_options={"SPATIAL_INDEX": "YES"},
+        )
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return path
@@ -1,14 +1,23 @@
+import asyncio
+import json
+import logging
+from collections.abc import Callable
+from pathlib import Path
+
 from fastapi import APIRouter
 
 from src.codes import SystemCode
 from src.config import SettingsDep
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import FileResponse, Response, StreamingResponse
 
-from src.geojson import csv_export
+from src.geojson import csv_export, geo_export
 from src.io import files
+from src.io.result_response import result_file_response
 from src.responses import api_response
 from src.schemas import route_responses
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(tags=["geojson"])
 
 _WHISP_NAME = {
@@ -17,6 +26,8 @@ _WHISP_NAME = {
     "pt": "Parcelas WHISP",
     "es": "Parcelas WHISP",
 }
+# closes the result object with its name
+_NAME_SUFFIX = (',"name":' + json.dumps(_WHISP_NAME, ensure_ascii=False, separators=(",", ":")) + "}").encode("utf-8")
 
 
 @router.get(
@@ -24,21 +35,15 @@ _WHISP_NAME = {
     response_model=None,
     responses=route_responses(SystemCode.ANALYSIS_JOB_NOT_FOUND, SystemCode.SYSTEM_INTERNAL_SERVER_ERROR),
 )
-async def generate_geojson(token: str, settings: SettingsDep) -> JSONResponse:
-    path = files.result_path(token, settings)
-    if not path.exists():
-        return api_response(SystemCode.ANALYSIS_JOB_NOT_FOUND)
-
+async def generate_geojson(token: str, settings: SettingsDep) -> Response:
+    # the result file with the name added, streamed from disk
     try:
-        parsed = files.read_json(path)
-    except Exception:
+        response = await result_file_response(files.result_path(token, settings), suffix=_NAME_SUFFIX, open_object=True)
+    except ValueError:
         return api_response(SystemCode.SYSTEM_INTERNAL_SERVER_ERROR)
-
-    if not parsed:
+    if response is None:
         return api_response(SystemCode.ANALYSIS_JOB_NOT_FOUND)
-
-    geojson = {**parsed, "name": _WHISP_NAME}
-    return JSONResponse(content=geojson)
+    return response
 
 
 @router.get(
@@ -50,15 +55,45 @@ async def download_csv(token: str) -> Response:
     if not csv_export.valid_token(token):
         return api_response(SystemCode.ANALYSIS_JOB_NOT_FOUND)
 
-    csv, err = csv_export.load_or_build_csv(token)
+    csv, err = await asyncio.to_thread(csv_export.open_csv, token)
     if err == "not_found":
         return api_response(SystemCode.ANALYSIS_JOB_NOT_FOUND)
     if err or csv is None:
         return api_response(SystemCode.SYSTEM_INTERNAL_SERVER_ERROR)
 
-    filename = csv_export.timestamp_filename("csv")
-    return Response(
-        content=csv,
-        media_type="text/csv; charset=utf-8",
-        headers=csv_export.csv_attachment_headers(filename),
-    )
+    headers = csv_export.csv_attachment_headers(csv_export.timestamp_filename("csv"))
+    if isinstance(csv, Path):
+        return FileResponse(csv, media_type="text/csv; charset=utf-8", headers=headers)
+    return StreamingResponse(csv, media_type="text/csv; charset=utf-8", headers=headers)
+
+
+async def _download(token: str, build: Callable[[str], Path | None], ext: str, media_type: str) -> Response:
+    if not csv_export.valid_token(token):
+        return api_response(SystemCode.ANALYSIS_JOB_NOT_FOUND)
+    try:
+        path = await asyncio.to_thread(build, token)
+    except Exception:
+        logger.exception("could not build the %s download of job %s", ext, token)
+        return api_response(SystemCode.SYSTEM_INTERNAL_SERVER_ERROR)
+    if path is None:
+        return api_response(SystemCode.ANALYSIS_JOB_NOT_FOUND)
+    headers = csv_export.attachment_headers(csv_export.timestamp_filename(ext), media_type)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+@router.get(
+    "/download-geoparquet/{token}",
+    response_model=None,
+    responses=route_responses(SystemCode.ANALYSIS_JOB_NOT_FOUND, SystemCode.SYSTEM_INTERNAL_SERVER_ERROR),
+)
+async def download_geoparquet(token: str) -> Response:
+    return await _download(token, geo_export.geoparquet, "parquet", geo_export.GEOPARQUET_MEDIA_TYPE)
+
+
+@router.get(
+    "/download-flatgeobuf/{token}",
+    response_model=None,
+    responses=route_responses(SystemCode.ANALYSIS_JOB_NOT_FOUND, SystemCode.SYSTEM_INTERNAL_SERVER_ERROR),
+)
+async def download_flatgeobuf(token: str) -> Response:
+    return await _download(token, geo_export.flatgeobuf, "fgb", geo_export.FLATGEOBUF_MEDIA_TYPE)
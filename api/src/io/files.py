@@ -1,5 +1,6 @@
 import json
 import os
+import shutil
 from pathlib import Path
 from typing import Any
 
@@ -14,10 +15,49 @@ def input_path(token: str, settings: Settings | None = None) -> Path:
     return _temp(settings) / f"{token}.json"
 
 
+def upload_path(token: str, settings: Settings | None = None) -> Path:
+    return _temp(settings) / f"{token}.upload"
+
+
+def pending_input_path(token: str, settings: Settings | None = None) -> Path:
+    return _temp(settings) / f"{token}-pending.json"
+
+
+def shard_input_path(token: str, shard: int, settings: Settings | None = None) -> Path:
+    return _temp(settings) / f"{token}-shard-{shard}.json"
+
+
+def shard_stats_path(token: str, shard: int | str, settings: Settings | None = None) -> Path:
+    return _temp(settings) / f"{token}-shard-{shard}-stats.pkl"
+
+
+def checkpoint_dir(token: str, settings: Settings | None = None) -> Path:
+    return _temp(settings) / f"{token}-checkpoints"
+
+
+def partial_dir(token: str, settings: Settings | None = None) -> Path:
+    return _temp(settings) / f"{token}-partial"
+
+
 def result_path(token: str, settings: Settings | None = None) -> Path:
     return _temp(settings) / f"{token}-result.json"
 
 
+def result_table_path(token: str, settings: Settings | None = None) -> Path:
+    return _temp(settings) / f"{token}-result.parquet"
+
+
+def cached_result_path(key: str, settings: Settings | None = None) -> Path:
+    return _temp(settings) / "cache" / f"{key}-result.json"
+
+
+def atomic_copy(src: Path, dst: Path) -> None:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_suffix(dst.suffix + ".tmp")
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
 def atomic_write_json(path: Path, data: Any) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     tmp = path.with_suffix(path.suffix + ".tmp")
@@ -25,6 +65,35 @@ def atomic_write_json(path: Path, data: Any) -> None:
     os.replace(tmp, path)
 
 
+class FeatureCollectionWriter:
+    def __init__(self, path: Path):
+        self.path = path
+        self.count = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp = path.with_suffix(path.suffix + ".tmp")
+        self._fh = self._tmp.open("w", encoding="utf-8")
+        self._fh.write('{"type": "FeatureCollection", "features": [')
+
+    def write(self, feature: dict) -> None:
+        if self.count:
+            self._fh.write(", ")
+        self._fh.write(json.dumps(feature))
+        self.count += 1
+
+    def commit(self, **members: Any) -> None:
+        self._fh.write("]")
+        for key, value in members.items():
+            if value is not None:
+                self._fh.write(f", {json.dumps(key)}: {json.dumps(value)}")
+        self._fh.write("}")
+        self._fh.close()
+        os.replace(self._tmp, self.path)
+
+    def discard(self) -> None:
+        self._fh.close()
+        self._tmp.unlink(missing_ok=True)
+
+
 def read_json(path: Path) -> Any:
     return json.loads(path.read_text(encoding="utf-8"))
 
@@ -0,0 +1,160 @@
+import codecs
+import json
+from collections.abc import AsyncIterator, Iterator
+from typing import Any
+
+_WHITESPACE = " \t\n\r"
+_MIN_RETRY_GROWTH = 64 * 1024
+
+
+class JsonStreamError(ValueError):
+    pass
+
+
+class ObjectStreamParser:
+    # Incremental parser for a top-level JSON object. Members are decoded whole,
+    # except the array stored under `stream_key`, whose items are emitted one by one
+    # so that only a single item has to be held in memory at a time.
+
+    def __init__(self, stream_key: str):
+        self.stream_key = stream_key
+        self.streamed = False
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._retry_at = 0
+        self._eof = False
+        self._state = "start"
+        self._key: str | None = None
+
+    def feed(self, chunk: bytes) -> list[tuple[str, Any]]:
+        self._buf += self._text.decode(chunk)
+        return list(self._drain())
+
+    def close(self) -> list[tuple[str, Any]]:
+        self._buf += self._text.decode(b"", final=True)
+        self._eof = True
+        events = list(self._drain())
+        if self._state != "done":
+            raise JsonStreamError("unexpected end of JSON document")
+        return events
+
+    def _skip_ws(self) -> bool:
+        while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+            self._pos += 1
+        if self._pos < len(self._buf):
+            return True
+        if self._eof and self._state != "done":
+            raise JsonStreamError("unexpected end of JSON document")
+        return False
+
+    def _expect(self, chars: str) -> str | None:
+        if not self._skip_ws():
+            return None
+        ch = self._buf[self._pos]
+        if ch not in chars:
+            raise JsonStreamError(f"unexpected {ch!r} at offset {self._pos}")
+        self._pos += 1
+        return ch
+
+    def _value(self) -> tuple[bool, Any]:
+        if not self._skip_ws() or (len(self._buf) < self._retry_at and not self._eof):
+            return False, None
+        try:
+            value, end = self._decoder.raw_decode(self._buf, self._pos)
+        except json.JSONDecodeError as e:
+            if self._eof:
+                raise JsonStreamError(str(e)) from None
+            self._retry_at = max(len(self._buf) * 2, len(self._buf) + _MIN_RETRY_GROWTH)
+            return False, None
+        # a number at the very end of the buffer may still continue in the next chunk
+        if end == len(self._buf) and not self._eof:
+            self._retry_at = len(self._buf) + 1
+            return False, None
+        self._retry_at = 0
+        self._pos = end
+        return True, value
+
+    def _compact(self) -> None:
+        if self._pos > _MIN_RETRY_GROWTH:
+            self._buf = self._buf[self._pos:]
+            self._retry_at = max(0, self._retry_at - self._pos)
+            self._pos = 0
+
+    def _drain(self) -> Iterator[tuple[str, Any]]:
+        while True:
+            self._compact()
+            state = self._state
+            if state == "start":
+                if self._expect("{") is None:
+                    return
+                self._state = "key_or_end"
+            elif state in ("key_or_end", "key"):
+                if not self._skip_ws():
+                    return
+                if state == "key_or_end" and self._buf[self._pos] == "}":
+                    self._pos += 1
+                    self._state = "done"
+                    continue
+                ok, key = self._value()
+                if not ok:
+                    return
+                if not isinstance(key, str):
+                    raise JsonStreamError("object keys must be strings")
+                self._key = key
+                self._state = "colon"
+            elif state == "colon":
+                if self._expect(":") is None:
+                    return
+                self._state = "value"
+            elif state == "value":
+                if not self._skip_ws():
+                    return
+                if self._key == self.stream_key and self._buf[self._pos] == "[":
+                    self._pos += 1
+                    self.streamed = True
+                    self._state = "item_or_end"
+                    continue
+                ok, value = self._value()
+                if not ok:
+                    return
+                self._state = "member_sep"
+                yield "member", (self._key, value)
+            elif state == "member_sep":
+                ch = self._expect(",}")
+                if ch is None:
+                    return
+                self._state = "key" if ch == "," else "done"
+            elif state in ("item_or_end", "item"):
+                if not self._skip_ws():
+                    return
+                if state == "item_or_end" and self._buf[self._pos] == "]":
+                    self._pos += 1
+                    self._state = "member_sep"
+                    continue
+                ok, value = self._value()
+                if not ok:
+                    return
+                self._state = "item_sep"
+                yield "item", value
+            elif state == "item_sep":
+                ch = self._expect(",]")
+                if ch is None:
+                    return
+                self._state = "item" if ch == "," else "member_sep"
+            else:
+                if self._skip_ws():
+                    raise JsonStreamError(f"unexpected data after JSON document at offset {self._pos}")
+                return
+
+
+async def iter_object_stream(
+    chunks: AsyncIterator[bytes], stream_key: str
+) -> AsyncIterator[tuple[str, Any]]:
+    parser = ObjectStreamParser(stream_key)
+    async for chunk in chunks:
+        for event in parser.feed(chunk):
+            yield event
+    for event in parser.close():
+        yield event
@@ -0,0 +1,174 @@
+import hashlib
+import os
+from collections.abc import Iterator
+from email.utils import formatdate
+from io import BufferedReader
+from pathlib import Path
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import FileResponse, MalformedRangeHeader, PlainTextResponse, RangeNotSatisfiable, Response
+from starlette.types import Receive, Scope, Send
+
+# Result files are sent as they are on disk, wrapped in `prefix` and `suffix` (the response
+# envelope), instead of being parsed and encoded again: memory per download does not depend
+# on the size of the result. The file is sent with sendfile when the server offers the ASGI
+# zero-copy extension.
+_CHUNK_SIZE = 64 * 1024
+# the closing brace of a result file is within its last bytes (json.dump adds no padding)
+_TAIL_BYTES = 4096
+
+
+class ResultFileResponse(Response):
+    def __init__(
+        self,
+        file: BufferedReader,
+        length: int,
+        prefix: bytes,
+        suffix: bytes,
+        stat_result: os.stat_result,
+        status_code: int = 200,
+        headers: dict[str, str] | None = None,
+        media_type: str = "application/json",
+    ) -> None:
+        self.file = file
+        self.length = length
+        self.prefix = prefix
+        self.suffix = suffix
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.init_headers(headers)
+        self.size = len(prefix) + length + len(suffix)
+        # the file is replaced, never rewritten, so its mtime and size identify its content
+        digest = hashlib.md5(f"{stat_result.st_mtime_ns}-{stat_result.st_size}".encode(), usedforsecurity=False)
+        digest.update(prefix)
+        digest.update(suffix)
+        self.headers["content-length"] = str(self.size)
+        self.headers["etag"] = f'"{digest.hexdigest()}"'
+        self.headers["last-modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+        self.headers["accept-ranges"] = "bytes"
+
+    def _not_modified(self, request: Headers) -> bool:
+        if_none_match = request.get("if-none-match")
+        if if_none_match is None:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or self.headers["etag"] in tags
+
+    def _range(self, request: Headers) -> tuple[int, int] | None:
+        # Only single ranges are served; others get the whole body, as RFC 9110 allows.
+        http_range = request.get("range")
+        if http_range is None or self.status_code != 200:
+            return None
+        if_range = request.get("if-range")
+        if if_range is not None and if_range not in (self.headers["etag"], self.headers["last-modified"]):
+            return None
+        ranges = FileResponse._parse_range_header(http_range, self.size)
+        return ranges[0] if len(ranges) == 1 else None
+
+    def _segments(self, start: int, end: int) -> Iterator[tuple[bytes | None, int, int]]:
+        # (bytes, 0, 0) for parts of the envelope, (None, offset, count) for parts of the file
+        file_start, file_end = len(self.prefix), len(self.prefix) + self.length
+        if start < file_start:
+            yield self.prefix[start:min(end, file_start)], 0, 0
+        if start < file_end and end > file_start:
+            offset = max(start, file_start) - file_start
+            yield None, offset, min(end, file_end) - file_start - offset
+        if end > file_end:
+            yield self.suffix[max(start, file_end) - file_end:end - file_end], 0, 0
+
+    async def _send_body(self, scope: Scope, send: Send, start: int, end: int) -> None:
+        zero_copy = "http.response.zerocopysend" in scope.get("extensions", {})
+        fd = self.file.fileno()
+        for data, offset, count in self._segments(start, end):
+            if data is not None:
+                await send({"type": "http.response.body", "body": data, "more_body": True})
+            elif zero_copy:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": self.file,
+                    "offset": offset,
+                    "count": count,
+                    "more_body": True,
+                })
+            else:
+                while count > 0:
+                    chunk = await anyio.to_thread.run_sync(os.pread, fd, min(_CHUNK_SIZE, count), offset)
+                    if not chunk:
+                        raise RuntimeError(f"{self.file.name} is shorter than expected")
+                    offset += len(chunk)
+                    count -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self._respond(scope, receive, send)
+        finally:
+            self.file.close()
+
+    async def _respond(self, scope: Scope, receive: Receive, send: Send) -> None:
+        request = Headers(scope=scope)
+        if self._not_modified(request):
+            headers = {k: self.headers[k] for k in ("etag", "last-modified")}
+            return await Response(status_code=304, headers=headers)(scope, receive, send)
+        try:
+            byte_range = self._range(request)
+        except MalformedRangeHeader as exc:
+            return await PlainTextResponse(exc.content, status_code=400)(scope, receive, send)
+        except RangeNotSatisfiable as exc:
+            response = PlainTextResponse(status_code=416, headers={"content-range": f"bytes */{exc.max_size}"})
+            return await response(scope, receive, send)
+
+        start, end = byte_range or (0, self.size)
+        headers = MutableHeaders(raw=list(self.raw_headers))
+        status_code = self.status_code
+        if byte_range is not None:
+            status_code = 206
+            headers["content-range"] = f"bytes {start}-{end - 1}/{self.size}"
+            headers["content-length"] = str(end - start)
+        await send({"type": "http.response.start", "status": status_code, "headers": headers.raw})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        await self._send_body(scope, send, start, end)
+
+
+def _open(path: Path, open_object: bool) -> tuple[BufferedReader, int, os.stat_result] | None:
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    try:
+        stat_result = os.fstat(file.fileno())
+        length = stat_result.st_size
+        if open_object:
+            # drops the closing brace, so the suffix can add members
+            tail_start = max(length - _TAIL_BYTES, 0)
+            brace = os.pread(file.fileno(), length - tail_start, tail_start).rfind(b"}")
+            if brace < 0:
+                raise ValueError(f"{path} does not hold a JSON object")
+            length = tail_start + brace
+        return file, length, stat_result
+    except BaseException:
+        file.close()
+        raise
+
+
+async def result_file_response(
+    path: Path,
+    prefix: bytes = b"",
+    suffix: bytes = b"",
+    *,
+    open_object: bool = False,
+    status_code: int = 200,
+    headers: dict[str, str] | None = None,
+) -> ResultFileResponse | None:
+    # None when there is no file at `path`. The file stays open until the response is sent,
+    # so it is the one served even if a new result replaces it meanwhile.
+    opened = await anyio.to_thread.run_sync(_open, path, open_object)
+    if opened is None:
+        return None
+    file, length, stat_result = opened
+    return ResultFileResponse(file, length, prefix, suffix, stat_result, status_code=status_code, headers=headers)
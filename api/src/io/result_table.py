@@ -0,0 +1,167 @@
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import shapely
+
+from src.config import Settings
+from src.io import files
+
+# Columnar copy of a result: the properties as typed columns and the geometry as WKB, in a
+# GeoParquet file next to the GeoJSON. Readers take only the columns and row groups they need
+# from the memory-mapped file. The worker writes it with the result; results that are copies
+# (result cache, attached jobs, direct lane) get theirs from the GeoJSON on first use.
+GEOMETRY = "geometry"
+ROW_GROUP_SIZE = 1000
+_GEOMETRY_TYPES = {
+    shapely.GeometryType.POINT: "Point",
+    shapely.GeometryType.LINESTRING: "LineString",
+    shapely.GeometryType.POLYGON: "Polygon",
+    shapely.GeometryType.MULTIPOINT: "MultiPoint",
+    shapely.GeometryType.MULTILINESTRING: "MultiLineString",
+    shapely.GeometryType.MULTIPOLYGON: "MultiPolygon",
+    shapely.GeometryType.GEOMETRYCOLLECTION: "GeometryCollection",
+}
+
+
+def _text(value: Any) -> str | None:
+    # a value of a mixed or nested column, as the CSV export writes it
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if value is None or pd.isna(value):
+        return None
+    return str(value)
+
+
+def _column(values: pd.Series) -> pa.Array:
+    try:
+        array = pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        array = None
+    if array is None or pa.types.is_nested(array.type):
+        array = pa.array([_text(v) for v in values], pa.string())
+    # vectorized NaN/inf handling of tasks._json_safe (NaN is already null here)
+    if pa.types.is_floating(array.type):
+        return pc.if_else(pc.is_finite(array), array, pa.scalar(None, array.type))
+    if pa.types.is_string(array.type):
+        return pc.fill_null(array, "")
+    return array
+
+
+def _geometries(geo: pd.Series) -> np.ndarray:
+    # whisp keeps geometries as GeoJSON text with single quotes
+    text = [
+        g.replace("'", '"') if isinstance(g, str) else json.dumps(g) if isinstance(g, dict) else None for g in geo
+    ]
+    return shapely.from_geojson(np.array(text, dtype=object), on_invalid="ignore")
+
+
+def _geo_metadata(geometries: np.ndarray) -> bytes:
+    # GeoParquet 1.1 file metadata; no crs means OGC:CRS84, as for GeoJSON
+    type_ids = np.unique(shapely.get_type_id(geometries))
+    column = {
+        "encoding": "WKB",
+        "geometry_types": sorted(_GEOMETRY_TYPES[shapely.GeometryType(i)] for i in type_ids if i >= 0),
+    }
+    bounds = shapely.total_bounds(geometries)
+    if not np.isnan(bounds).any():
+        column["bbox"] = bounds.tolist()
+    return json.dumps({"version": "1.1.0", "primary_column": GEOMETRY, "columns": {GEOMETRY: column}}).encode()
+
+
+def geometry_types(schema: pa.Schema) -> list[str]:
+    geo = json.loads((schema.metadata or {}).get(b"geo", b"{}"))
+    return geo.get("columns", {}).get(GEOMETRY, {}).get("geometry_types", [])
+
+
+def from_frame(risk_df: pd.DataFrame, geo_column: str = "geo") -> pa.Table:
+    names = [str(name) for name in risk_df.columns if name != geo_column]
+    columns = [_column(risk_df[name]) for name in risk_df.columns if name != geo_column]
+    geometries = _geometries(risk_df[geo_column])
+    table = pa.table([*columns, pa.array(shapely.to_wkb(geometries), pa.binary())], names=[*names, GEOMETRY])
+    return table.replace_schema_metadata({b"geo": _geo_metadata(geometries)})
+
+
+def from_features(features: list[dict]) -> pa.Table:
+    frame = pd.DataFrame.from_records([f.get("properties") or {} for f in features])
+    frame["geo"] = [f.get("geometry") for f in features]
+    return from_frame(frame)
+
+
+def write(table: pa.Table, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        pq.write_table(table, tmp, row_group_size=ROW_GROUP_SIZE, compression="zstd")
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def ensure(token: str, settings: Settings | None = None) -> Path | None:
+    # Blocking. The Parquet file of the result, built from the GeoJSON when there is none yet;
+    # None when the job has no result.
+    path = files.result_table_path(token, settings)
+    if path.exists():
+        return path
+    try:
+        result = files.read_json(files.result_path(token, settings))
+    except FileNotFoundError:
+        return None
+    write(from_features(result.get("features") or []), path)
+    return path
+
+
+def open_file(token: str, settings: Settings | None = None) -> pq.ParquetFile | None:
+    path = ensure(token, settings)
+    return pq.ParquetFile(path, memory_map=True) if path else None
+
+
+def take(parquet: pq.ParquetFile, rows: np.ndarray, columns: list[str] | None = None) -> pa.Table:
+    # The rows at the (sorted) positions `rows`, reading only the row groups holding them.
+    sizes = np.array([parquet.metadata.row_group(i).num_rows for i in range(parquet.metadata.num_row_groups)])
+    if not len(rows):
+        return parquet.schema_arrow.empty_table().select(columns or parquet.schema_arrow.names)
+    starts = np.concatenate([[0], np.cumsum(sizes)])
+    group_of = np.searchsorted(starts, rows, side="right") - 1
+    groups = np.unique(group_of)
+    table = parquet.read_row_groups(groups.tolist(), columns=columns)
+    # where each group starts in `table`
+    base = np.concatenate([[0], np.cumsum(sizes[groups])[:-1]])
+    return table.take(pa.array(base[np.searchsorted(groups, group_of)] + rows - starts[group_of]))
+
+
+def read_rows(parquet: pq.ParquetFile, offset: int, limit: int, columns: list[str] | None = None) -> pa.Table:
+    return take(parquet, np.arange(offset, min(offset + limit, parquet.metadata.num_rows)), columns)
+
+
+def matching_rows(parquet: pq.ParquetFile, filters: dict[str, list[str]]) -> np.ndarray:
+    # Positions of the rows whose columns hold one of the given values (compared as text),
+    # reading only those columns.
+    table = parquet.read(columns=list(filters))
+    mask = np.ones(table.num_rows, dtype=bool)
+    for column, values in filters.items():
+        found = pc.is_in(pc.cast(table[column], pa.string()), value_set=pa.array(values, pa.string()))
+        mask &= pc.fill_null(found, False).to_numpy(zero_copy_only=False)
+    return np.flatnonzero(mask)
+
+
+def features(table: pa.Table) -> list[dict]:
+    # GeoJSON features of the rows of `table`
+    if GEOMETRY in table.column_names:
+        wkb = table.column(GEOMETRY).to_numpy(zero_copy_only=False)
+        geometries = [json.loads(g) if g else None for g in shapely.to_geojson(shapely.from_wkb(wkb))]
+        table = table.drop_columns(GEOMETRY)
+    else:
+        geometries = [None] * table.num_rows
+    return [
+        {"type": "Feature", "geometry": geometry, "properties": properties}
+        for geometry, properties in zip(geometries, table.to_pylist())
+    ]
@@ -1,3 +1,4 @@
+import json
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Any
@@ -18,6 +19,8 @@ class JobProgress:
     error_message: str | None = None
     feature_count: int | None = None
     async_mode: bool | None = None
+    # analysed features that can be read before the job ends (see src.worker.partial_results)
+    partial_features: int | None = None
 
     @staticmethod
     def _parse_status(value: SystemCode | str | None) -> SystemCode:
@@ -40,6 +43,7 @@ class JobProgress:
         error_message: str | None = None,
         feature_count: int | None = None,
         async_mode: bool | None = None,
+        partial_features: int | None = None,
     ) -> "JobProgress":
         return cls(
             status=cls._parse_status(status),
@@ -48,6 +52,7 @@ class JobProgress:
             error_message=error_message,
             feature_count=feature_count,
             async_mode=async_mode,
+            partial_features=partial_features,
         )
 
     @classmethod
@@ -60,11 +65,14 @@ class JobProgress:
             error_message=data.get("error_message"),
             feature_count=data.get("feature_count"),
             async_mode=data.get("async_mode"),
+            partial_features=data.get("partial_features"),
         )
 
     @classmethod
     def from_db(cls, row: dict[str, Any]) -> "JobProgress":
         options = row.get("analysis_options") or {}
+        if isinstance(options, str):
+            options = json.loads(options)
         return cls(
             id=row["id"],
             status=cls._parse_status(row["status"]),
@@ -74,13 +82,15 @@ class JobProgress:
         )
 
     def to_redis(self) -> dict[str, Any]:
+        # an event of the job's stream (see src.redis.events): unset fields are left out, and
+        # messages are the ones to append
         payload: dict[str, Any] = {
             "status": self.status.value,
             "percent": self.percent,
             "error_message": self.error_message,
             "feature_count": self.feature_count,
             "async_mode": self.async_mode,
+            "partial_features": self.partial_features,
+            "messages": self.messages,
         }
-        if self.messages is not None:
-            payload["messages"] = self.messages
-        return payload
+        return {k: v for k, v in payload.items() if v is not None}
@@ -7,6 +7,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from prometheus_fastapi_instrumentator import Instrumentator
 
 from src.app_logging import LogContextMiddleware
+from src.auth import key_cache
 from src.config import get_settings
 from src.db import close_pool, init_pool
 from src.redis import close_redis, init_redis
@@ -14,7 +15,10 @@ from src.exceptions import register
 from src.geojson.router import router as geojson_router
 from src.public_config.router import router as config_router
 from src.result_fields.router import router as result_fields_router
+from src.schemas import streamed_request_schemas
 from src.status.router import router as status_router
+from src.submit.direct_lane import close_direct_lane, init_direct_lane
+from src.submit.executor import close_validation_pool, init_validation_pool
 from src.submit.router import router as submit_router
 
 API_PREFIX = "/api"
@@ -24,9 +28,15 @@ API_PREFIX = "/api"
 async def lifespan(_app: FastAPI):
     await init_pool()
     await init_redis()
+    await init_validation_pool()
+    await init_direct_lane()
+    key_cache.start_listener()
     try:
         yield
     finally:
+        await key_cache.stop_listener()
+        close_direct_lane()
+        close_validation_pool()
         await close_redis()
         await close_pool()
 
@@ -112,7 +122,9 @@ def create_app() -> FastAPI:
             for op in path_item.values():
                 if isinstance(op, dict):
                     op.get("responses", {}).pop("422", None)
-        comps = schema.get("components", {}).get("schemas", {})
+        comps = schema.setdefault("components", {}).setdefault("schemas", {})
+        for name, body_schema in streamed_request_schemas().items():
+            comps.setdefault(name, body_schema)
         comps.pop("HTTPValidationError", None)
         comps.pop("ValidationError", None)
         return schema
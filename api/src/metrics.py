@@ -0,0 +1,57 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# exposed on /api/metrics by the instrumentator through the default registry
+
+VALIDATION_QUEUE_WAIT = Histogram(
+    "whisp_submission_validation_queue_wait_seconds",
+    "Time a submission waited for a validation worker process",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+VALIDATION_DURATION = Histogram(
+    "whisp_submission_validation_seconds",
+    "Time spent validating and normalizing a submission",
+    ["mode"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+VALIDATION_REJECTED = Counter(
+    "whisp_submission_validation_rejected_total",
+    "Submissions rejected because the validation pool was saturated",
+)
+RESULT_CACHE_LOOKUPS = Counter(
+    "whisp_result_cache_lookups_total",
+    "Result cache lookups for submitted jobs",
+    ["result"],
+)
+DIRECT_LANE_DURATION = Histogram(
+    "whisp_direct_lane_seconds",
+    "Time to analyse a submission on the API direct lane",
+    buckets=(0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 30, 60),
+)
+DIRECT_LANE_SKIPPED = Counter(
+    "whisp_direct_lane_skipped_total",
+    "Direct lane submissions sent to the worker queue because every lane process was busy",
+)
+API_KEY_LOOKUPS = Counter(
+    "whisp_api_key_lookups_total",
+    "API key resolutions by outcome (hit, negative_hit, miss)",
+    ["result"],
+)
+API_KEY_LOOKUP_DURATION = Histogram(
+    "whisp_api_key_lookup_seconds",
+    "Time to resolve an API key",
+    ["source"],
+    buckets=(0.00001, 0.0001, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+EVENT_LISTENERS = Gauge(
+    "whisp_job_event_listeners",
+    "Job event listeners (status streams and sync waiters) served by this process",
+)
+CANCEL_DURATION = Histogram(
+    "whisp_cancel_seconds",
+    "Time from a cancel request until the running tasks of the job stopped by themselves",
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60),
+)
+CANCEL_KILLS = Counter(
+    "whisp_cancel_kills_total",
+    "Tasks killed after the cancel grace period; each one restarts a worker process",
+)
@@ -1,23 +1,29 @@
 from src.redis.events import (
     check_redis,
+    client,
     close_redis,
     get,
     get_sync,
     init_redis,
     publish,
+    publish_many_sync,
     publish_sync,
     subscribe,
+    sync_client,
     wait_for,
 )
 
 __all__ = [
     "check_redis",
+    "client",
     "close_redis",
     "get",
     "get_sync",
     "init_redis",
     "publish",
+    "publish_many_sync",
     "publish_sync",
     "subscribe",
+    "sync_client",
     "wait_for",
 ]
@@ -1,10 +1,15 @@
+import asyncio
 import json
 import logging
+import re
 import threading
 from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
 from typing import Any
 
+from src.codes import TERMINAL_STATUSES
 from src.config import get_settings
+from src.metrics import EVENT_LISTENERS
 
 logger = logging.getLogger(__name__)
 
@@ -13,22 +18,114 @@ _worker_redis = threading.local()
 
 _PUBSUB_POLL_SECONDS = 30.0
 _SNAPSHOT_TTL_SECONDS = 600
-
-
-def _state_key(job_id: str) -> str:
-    return f"job:{job_id}:state"
+_STREAM_MAX_ENTRIES = 1000
+# entries folded into the base snapshot at once
+_COMPACT_ENTRIES = 100
+_LISTENER_BUFFER = 32
+_RECONNECT_SECONDS = (1, 2, 5, 10, 30)
+
+# job id -> queues of the listeners in this process
+_listeners: dict[str, set[asyncio.Queue]] = {}
+_dispatcher: asyncio.Task | None = None
+
+
+# A job's events are deltas in a capped stream: the status, any other field that changed and
+# only the new messages. The state is rebuilt on read by folding the stream, and entry ids
+# let a client resume where it left off. Each entry is also published, as "<id> <delta>",
+# on the job channel for live listeners. Once the stream is a step over its cap, its oldest
+# entries are folded (as _fold does) into a base snapshot of the job, which reads take as
+# their first entry.
+_TERMINAL = {status.value for status in TERMINAL_STATUSES}
+_ID = re.compile(r"\d+-\d+")
+_APPEND = """
+local id = redis.call('XADD', KEYS[1], '*', 'd', ARGV[1])
+redis.call('PUBLISH', KEYS[2], id .. ' ' .. ARGV[1])
+local excess = redis.call('XLEN', KEYS[1]) - tonumber(ARGV[2])
+if excess >= tonumber(ARGV[4]) then
+  local stored = redis.call('GET', KEYS[3])
+  local base = stored and cjson.decode(stored) or {d = {}}
+  local state = base.d
+  local messages = state.messages or {}
+  local ids = {}
+  for _, entry in ipairs(redis.call('XRANGE', KEYS[1], '-', '+', 'COUNT', excess)) do
+    if not string.find(ARGV[5], ',' .. tostring(state.status) .. ',', 1, true) then
+      local delta = cjson.decode(entry[2][2])
+      for _, message in ipairs(delta.messages or {}) do
+        table.insert(messages, message)
+      end
+      delta.messages = nil
+      for field, value in pairs(delta) do
+        state[field] = value
+      end
+    end
+    base.id = entry[1]
+    table.insert(ids, entry[1])
+  end
+  if #messages > 0 then
+    state.messages = messages
+  end
+  redis.call('SET', KEYS[3], cjson.encode(base))
+  redis.call('XDEL', KEYS[1], unpack(ids))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+return id
+"""
+
+
+def _stream_key(job_id: str) -> str:
+    return f"job:{job_id}:log"
 
 
 def _channel(job_id: str) -> str:
     return f"job:{job_id}:events"
 
 
-def _parse(data: str | bytes | dict) -> dict[str, Any]:
-    if isinstance(data, dict):
-        return data
-    if isinstance(data, bytes):
-        data = data.decode("utf-8")
-    return json.loads(data)
+def _base_key(job_id: str) -> str:
+    return f"job:{job_id}:base"
+
+
+def _append_args(job_id: str, data: dict[str, Any]) -> tuple:
+    return (
+        _APPEND, 3, _stream_key(job_id), _channel(job_id), _base_key(job_id),
+        json.dumps(data), _STREAM_MAX_ENTRIES, _SNAPSHOT_TTL_SECONDS, _COMPACT_ENTRIES,
+        "," + ",".join(sorted(_TERMINAL)) + ",",
+    )
+
+
+def _id_key(event_id: str) -> tuple[int, int]:
+    ms, seq = event_id.split("-")
+    return int(ms), int(seq)
+
+
+def _range_start(after: str | None) -> str:
+    return f"({after}" if after else "-"
+
+
+def _fold(entries: list[tuple[str, dict[str, Any]]]) -> dict[str, Any]:
+    state: dict[str, Any] = {}
+    messages: list[str] = []
+    for _, delta in entries:
+        # progress a worker published after the job ended (while stopping on cancel) is ignored
+        if state.get("status") in _TERMINAL:
+            break
+        messages.extend(delta.pop("messages", None) or [])
+        state.update(delta)
+    if messages:
+        state["messages"] = messages
+    return state
+
+
+def _entries(base: str | None, raw: list, after: str | None = None) -> list[tuple[str, dict[str, Any]]] | None:
+    # The entries after `after`, or all of them (the base snapshot first) when it is None.
+    # None when entries after `after` were folded into the base snapshot.
+    entries = [(event_id, json.loads(fields["d"])) for event_id, fields in raw]
+    if base is None:
+        return entries
+    snapshot = json.loads(base)
+    if after is None:
+        return [(snapshot["id"], snapshot["d"]), *entries]
+    return entries if _id_key(after) >= _id_key(snapshot["id"]) else None
 
 
 def _sync_redis():
@@ -39,25 +136,31 @@ def _sync_redis():
     return _worker_redis.client
 
 
-def _store_and_publish(body: str, job_id: str) -> None:
-    r = _sync_redis()
-    pipe = r.pipeline()
-    pipe.setex(_state_key(job_id), _SNAPSHOT_TTL_SECONDS, body)
-    pipe.publish(_channel(job_id), body)
-    pipe.execute()
-
-
 def publish_sync(job_id: str, data: dict[str, Any]) -> None:
     try:
-        _store_and_publish(json.dumps(data), job_id)
+        _sync_redis().eval(*_append_args(job_id, data))
     except Exception:
         logger.exception("redis publish failed for job %s", job_id)
 
 
+def publish_many_sync(events: list[tuple[str, dict[str, Any]]]) -> None:
+    # one round trip for several events
+    try:
+        pipe = _sync_redis().pipeline(transaction=False)
+        for job_id, data in events:
+            pipe.eval(*_append_args(job_id, data))
+        pipe.execute()
+    except Exception:
+        logger.exception("redis publish failed for %d events", len(events))
+
+
 def get_sync(job_id: str) -> dict[str, Any] | None:
     try:
-        raw = _sync_redis().get(_state_key(job_id))
-        return _parse(raw) if raw is not None else None
+        pipe = _sync_redis().pipeline()
+        pipe.get(_base_key(job_id))
+        pipe.xrange(_stream_key(job_id))
+        entries = _entries(*pipe.execute())
+        return _fold(entries) if entries else None
     except Exception:
         logger.exception("redis get failed for job %s", job_id)
         return None
@@ -74,7 +177,14 @@ async def init_redis() -> None:
 
 
 async def close_redis() -> None:
-    global _async_redis
+    global _async_redis, _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.cancel()
+        try:
+            await _dispatcher
+        except asyncio.CancelledError:
+            pass
+        _dispatcher = None
     if _async_redis is not None:
         await _async_redis.aclose()
         _async_redis = None
@@ -86,71 +196,155 @@ def _async_redis_client():
     return _async_redis
 
 
+def client():
+    return _async_redis_client()
+
+
+def sync_client():
+    return _sync_redis()
+
+
 async def check_redis() -> None:
     await _async_redis_client().ping()
 
 
 async def publish(job_id: str, data: dict[str, Any]) -> None:
     try:
-        body = json.dumps(data)
-        r = _async_redis_client()
-        await r.setex(_state_key(job_id), _SNAPSHOT_TTL_SECONDS, body)
-        await r.publish(_channel(job_id), body)
+        await _async_redis_client().eval(*_append_args(job_id, data))
     except Exception:
         logger.exception("redis publish failed for job %s", job_id)
 
 
+async def _read(job_id: str, after: str | None = None) -> list[tuple[str, dict[str, Any]]]:
+    # the entries after `after`; all of them when some of those were folded into the base
+    # snapshot, so a client resuming from before it gets the whole state
+    pipe = _async_redis_client().pipeline()
+    pipe.get(_base_key(job_id))
+    pipe.xrange(_stream_key(job_id), min=_range_start(after))
+    entries = _entries(*await pipe.execute(), after)
+    return entries if entries is not None else await _read(job_id)
+
+
 async def get(job_id: str) -> dict[str, Any] | None:
     try:
-        raw = await _async_redis_client().get(_state_key(job_id))
-        return _parse(raw) if raw is not None else None
+        entries = await _read(job_id)
+        return _fold(entries) if entries else None
     except Exception:
         logger.exception("redis get failed for job %s", job_id)
         return None
 
 
-async def _pubsub_bodies(job_id: str) -> AsyncIterator[str | None]:
-    pubsub = _async_redis_client().pubsub()
-    await pubsub.subscribe(_channel(job_id))
+# One pattern subscription per process feeds every listener, so Redis connections do not
+# grow with the number of status streams and sync waiters. Each listener has a bounded
+# queue. None in a queue asks the listener to catch up from the stream: it replaces the
+# queue of a listener that fell behind, and is sent when the subscription (re)connects,
+# since events published meanwhile were missed.
+def _job_id(channel: str) -> str:
+    return channel.removeprefix("job:").removesuffix(":events")
+
+
+def _deliver(queue: asyncio.Queue, body: str | None) -> None:
+    if queue.full():
+        while not queue.empty():
+            queue.get_nowait()
+        body = None
+    queue.put_nowait(body)
+
+
+def _resync() -> None:
+    for queues in _listeners.values():
+        for queue in queues:
+            _deliver(queue, None)
+
+
+async def _dispatch() -> None:
+    attempt = 0
+    while True:
+        pubsub = None
+        try:
+            pubsub = _async_redis_client().pubsub()
+            await pubsub.psubscribe(_channel("*"))
+            attempt = 0
+            _resync()
+            while True:
+                msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=_PUBSUB_POLL_SECONDS)
+                if msg is None or msg.get("type") != "pmessage":
+                    continue
+                for queue in _listeners.get(_job_id(msg["channel"]), ()):
+                    _deliver(queue, msg["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("redis event subscription failed")
+        finally:
+            if pubsub is not None:
+                await pubsub.aclose()
+        await asyncio.sleep(_RECONNECT_SECONDS[min(attempt, len(_RECONNECT_SECONDS) - 1)])
+        attempt += 1
+
+
+@asynccontextmanager
+async def _listen(job_id: str) -> AsyncIterator[asyncio.Queue]:
+    global _dispatcher
+    if _dispatcher is None or _dispatcher.done():
+        _async_redis_client()
+        _dispatcher = asyncio.create_task(_dispatch())
+    queue: asyncio.Queue = asyncio.Queue(maxsize=_LISTENER_BUFFER)
+    _listeners.setdefault(job_id, set()).add(queue)
+    EVENT_LISTENERS.inc()
     try:
-        while True:
-            msg = await pubsub.get_message(
-                ignore_subscribe_messages=True,
-                timeout=_PUBSUB_POLL_SECONDS,
-            )
-            if msg is None:
-                yield None
-            elif msg.get("type") == "message":
-                yield msg["data"]
+        yield queue
     finally:
-        await pubsub.unsubscribe(_channel(job_id))
-        await pubsub.aclose()
+        queues = _listeners.get(job_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del _listeners[job_id]
+        EVENT_LISTENERS.dec()
+
+
+async def _bodies(queue: asyncio.Queue) -> AsyncIterator[str | None]:
+    while True:
+        try:
+            yield await asyncio.wait_for(queue.get(), _PUBSUB_POLL_SECONDS)
+        except TimeoutError:
+            yield None
 
 
 async def wait_for(job_id: str, until: Callable[[dict[str, Any]], bool]) -> dict[str, Any]:
-    state = await get(job_id)
-    if state and until(state):
-        return state
+    async with _listen(job_id) as queue:
+        state = await get(job_id)
+        if state and until(state):
+            return state
 
-    async for body in _pubsub_bodies(job_id):
-        if body is None:
-            state = await get(job_id)
+        async for body in _bodies(queue):
+            if body is None:
+                state = await get(job_id)
+            else:
+                state = json.loads(body.split(" ", 1)[1])
             if state and until(state):
                 return state
-            continue
-        state = _parse(body)
-        if until(state):
-            return state
-
 
-async def subscribe(job_id: str, *, skip_cached: bool = False) -> AsyncIterator[dict[str, Any]]:
-    state = await get(job_id)
-    if state and not skip_cached:
-        yield state
 
-    last_body = json.dumps(state, sort_keys=True) if state else None
-    async for body in _pubsub_bodies(job_id):
-        if body is None or body == last_body:
-            continue
-        last_body = body
-        yield _parse(body)
+async def subscribe(job_id: str, *, after: str | None = None) -> AsyncIterator[tuple[str | None, dict[str, Any]]]:
+    # Yields (event id, delta). The first one folds every event after `after`, or the whole
+    # state when it is None or older than the base snapshot, and is empty when there is none;
+    # later ones fold new events.
+    if after is not None and not _ID.fullmatch(after):
+        after = None
+    async with _listen(job_id) as queue:
+        entries = await _read(job_id, after)
+        last_id = entries[-1][0] if entries else after
+        yield last_id, _fold(entries)
+
+        async for body in _bodies(queue):
+            if body is None:
+                entries = await _read(job_id, last_id)
+            else:
+                event_id, delta = body.split(" ", 1)
+                if last_id is not None and _id_key(event_id) <= _id_key(last_id):
+                    continue
+                entries = [(event_id, json.loads(delta))]
+            if entries:
+                last_id = entries[-1][0]
+                yield last_id, _fold(entries)
@@ -1,9 +1,12 @@
+import json
 from collections.abc import Sequence
+from pathlib import Path
 from typing import Any
 
 from fastapi.responses import JSONResponse
 
 from src.codes import SystemCode
+from src.io.result_response import ResultFileResponse, result_file_response
 
 
 def api_envelope(
@@ -36,9 +39,30 @@ def api_response(
     data: Any = None,
     context: dict | None = None,
     cause: str | None = None,
+    headers: dict[str, str] | None = None,
     **extra: Any,
 ) -> JSONResponse:
     return JSONResponse(
         status_code=code.http_status,
         content=api_envelope(code, args=args, data=data, context=context, cause=cause, **extra),
+        headers=headers,
+    )
+
+
+async def api_result_response(
+    code: SystemCode,
+    path: Path,
+    *,
+    context: dict | None = None,
+    headers: dict[str, str] | None = None,
+) -> ResultFileResponse | None:
+    # Like api_response with the JSON file at `path` as data, which is sent without being
+    # parsed. None when the file does not exist.
+    envelope = json.dumps(api_envelope(code, context=context), ensure_ascii=False, separators=(",", ":"))
+    return await result_file_response(
+        path,
+        envelope[:-1].encode("utf-8") + b',"data":',
+        b"}",
+        status_code=code.http_status,
+        headers=headers,
     )
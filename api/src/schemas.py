@@ -92,6 +92,29 @@ class SubmitGeoIdsRequest(BaseModel):
     analysisOptions: AnalysisOptionsInput | None = None
 
 
+# Routes that parse these bodies incrementally declare them through `streamed_request_body`
+# so the OpenAPI document still describes the payload.
+STREAMED_REQUEST_MODELS: tuple[type[BaseModel], ...] = (SubmitGeoJsonRequest,)
+
+
+def streamed_request_body(model: type[BaseModel]) -> dict[str, Any]:
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": {"$ref": f"#/components/schemas/{model.__name__}"}}},
+        }
+    }
+
+
+def streamed_request_schemas() -> dict[str, dict]:
+    schemas: dict[str, dict] = {}
+    for model in STREAMED_REQUEST_MODELS:
+        schema = model.model_json_schema(ref_template="#/components/schemas/{model}")
+        schema.pop("$defs", None)
+        schemas[model.__name__] = schema
+    return schemas
+
+
 # ── Response model ─────────────────────────────────────────────────────────────
 
 class ApiResponse(BaseModel):
@@ -188,7 +211,11 @@ VALIDATION_ERRORS: tuple[SystemCode, ...] = (
 SUBMIT_ERRORS: tuple[SystemCode, ...] = (
     *AUTH_ERRORS,
     *VALIDATION_ERRORS,
-    SystemCode.ANALYSIS_TOO_MANY_CONCURRENT
+    SystemCode.ANALYSIS_TOO_MANY_CONCURRENT,
+    SystemCode.SERVICE_SUBMISSIONS_BUSY,
+    SystemCode.VALIDATION_INVALID_IDEMPOTENCY_KEY,
+    SystemCode.VALIDATION_IDEMPOTENCY_KEY_REUSED,
+    SystemCode.VALIDATION_IDEMPOTENCY_KEY_IN_USE,
 )
 
 SUBMIT_GEOID_ERRORS: tuple[SystemCode, ...] = (
@@ -1,20 +1,28 @@
-from typing import AsyncIterator
+import asyncio
+import contextlib
+from typing import Annotated, AsyncIterator
 
-from fastapi import APIRouter, Depends, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
 from src.auth.api_key import ApiKey, api_key_dependency
 from src.config import SettingsDep
 from src.codes import SystemCode, RUNNING_STATUSES, TERMINAL_STATUSES
-from src.io.files import load_completed_result
+from src.io.files import result_path
 from src.job_progress import JobProgress
-from src.responses import api_response
+from src.responses import api_response, api_result_response
 from src.redis import subscribe
 from src.schemas import AUTH_ERRORS, route_responses
 from src.status import service
+from src.worker import partial_results
 
 router = APIRouter(prefix="/status", tags=["status"])
 
+_QUEUE_POLL_SECONDS = 5
+_PAGE_SIZE = 100
+# query parameters filtering a completed result
+_RISK_PREFIX = "risk_"
+
 _SSE_HEADERS = {
     "Content-Type": "text/event-stream",
     "Cache-Control": "no-cache",
@@ -31,26 +39,104 @@ _SSE_HEADERS = {
         SystemCode.ANALYSIS_JOB_NOT_FOUND,
         SystemCode.ANALYSIS_ERROR,
         SystemCode.ANALYSIS_TIMEOUT,
+        SystemCode.VALIDATION_INVALID_RESULT_FIELD,
         *AUTH_ERRORS,
     ),
 )
 async def get_status(
     token: str,
+    request: Request,
     settings: SettingsDep,
+    offset: Annotated[int | None, Query(ge=0)] = None,
+    limit: Annotated[int | None, Query(ge=1, le=1000)] = None,
+    fields: Annotated[
+        str | None, Query(description="Comma-separated properties to return; add `geometry` for the geometry")
+    ] = None,
+    _api_key: ApiKey = Depends(api_key_dependency),
+) -> Response:
+    # A completed result comes whole, or a page of it when paged, projected with `fields` or
+    # filtered on risk columns (for example ?risk_pcrop=high; repeat a parameter for several values).
+    job = await service.get_job_state(token)
+    if not job:
+        return api_response(SystemCode.ANALYSIS_JOB_NOT_FOUND)
+
+    filters = {
+        name: request.query_params.getlist(name) for name in request.query_params if name.startswith(_RISK_PREFIX)
+    }
+    paged = offset is not None or limit is not None or fields is not None or filters
+    if job.status == SystemCode.ANALYSIS_COMPLETED and paged:
+        offset = offset or 0
+        page = await asyncio.to_thread(
+            service.result_page,
+            token,
+            offset,
+            limit or _PAGE_SIZE,
+            settings,
+            [name.strip() for name in fields.split(",") if name.strip()] if fields else None,
+            filters,
+        )
+        if page is None:
+            return api_response(SystemCode.ANALYSIS_JOB_NOT_FOUND)
+        features, total = page
+        return api_response(
+            job.status,
+            data={"type": "FeatureCollection", "features": features, "offset": offset, "total": total},
+        )
+
+    if job.status == SystemCode.ANALYSIS_COMPLETED:
+        response = await api_result_response(job.status, result_path(token, settings))
+        if response is None:
+            return api_response(SystemCode.ANALYSIS_JOB_NOT_FOUND)
+        return response
+
+    if job.status in RUNNING_STATUSES:
+        position = await service.queue_position(token, job)
+        return api_response(job.status, data=service.progress_api_data(job, token=token, position=position))
+
+    return await service.terminal_api_response(token, job)
+
+
+@router.get(
+    "/{token}/partial",
+    response_model=None,
+    responses=route_responses(
+        SystemCode.ANALYSIS_COMPLETED,
+        SystemCode.ANALYSIS_PROCESSING,
+        SystemCode.ANALYSIS_JOB_NOT_FOUND,
+        SystemCode.ANALYSIS_ERROR,
+        SystemCode.ANALYSIS_TIMEOUT,
+        *AUTH_ERRORS,
+    ),
+)
+async def get_partial(
+    token: str,
+    settings: SettingsDep,
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=1000)] = _PAGE_SIZE,
     _api_key: ApiKey = Depends(api_key_dependency),
 ) -> JSONResponse:
+    # Result features analysed so far, in pages. `partialFeatures` progress events announce
+    # new ones; once the job completed the pages come from its result.
     job = await service.get_job_state(token)
     if not job:
         return api_response(SystemCode.ANALYSIS_JOB_NOT_FOUND)
 
     if job.status == SystemCode.ANALYSIS_COMPLETED:
-        data = load_completed_result(token, settings)
-        if data is None:
+        page = await asyncio.to_thread(service.result_page, token, offset, limit, settings)
+        if page is None:
             return api_response(SystemCode.ANALYSIS_JOB_NOT_FOUND)
-        return api_response(job.status, data=data)
+        features, total = page
+        return api_response(
+            job.status,
+            data={"features": features, "offset": offset, "total": total, "complete": True},
+        )
 
     if job.status in RUNNING_STATUSES:
-        return api_response(job.status, data=service.progress_api_data(job, token=token))
+        features, total = await partial_results.page(token, offset, limit, settings)
+        return api_response(
+            job.status,
+            data={"features": features, "offset": offset, "total": total, "complete": False},
+        )
 
     return await service.terminal_api_response(token, job)
 
@@ -95,6 +181,9 @@ async def cancel_status(
             "content": {"text/event-stream": {"schema": {"type": "string"}}},
             "description": (
                 "Server-Sent Events stream. Each event is a JSON object with `code` and optional `data` / `cause`. "
+                "The first event carries the current progress; later ones only what changed, with "
+                "`processStatusMessages` holding the new messages. Events have ids: reconnect with "
+                "`Last-Event-ID` to receive only what was published since. "
                 "The final event has `\"final\": true`."
             ),
         },
@@ -117,18 +206,58 @@ async def status_stream(
             headers=_SSE_HEADERS,
         )
 
+    resume = request.headers.get("last-event-id")
+
     async def _gen() -> AsyncIterator[bytes]:
-        yield service.progress_sse(job, token=token)
+        # the first event holds everything after Last-Event-ID, or the whole state on a new
+        # connection; later ones only what changed
+        events = subscribe(token, after=resume)
+        next_event = None
+        try:
+            event_id, delta = await anext(events)
+            progress = JobProgress.from_redis(delta, id=token) if delta else job
+            if progress.status in TERMINAL_STATUSES:
+                yield service.terminal_sse(token, progress, settings, event_id)
+                return
+            position = await service.queue_position(token, progress)
+            if delta or resume is None:
+                yield service.progress_sse(progress, token=token, position=position, event_id=event_id)
 
-        async for event in subscribe(token, skip_cached=True):
-            if await request.is_disconnected():
-                break
+            # no event is published when a queued job moves up, so its position is re-read
+            # while it waits
+            next_event = asyncio.ensure_future(anext(events))
+            while True:
+                done, _ = await asyncio.wait(
+                    {next_event}, timeout=_QUEUE_POLL_SECONDS if position is not None else None
+                )
+                if await request.is_disconnected():
+                    break
 
-            progress = JobProgress.from_redis(event, id=token)
-            if progress.status in TERMINAL_STATUSES:
-                yield service.terminal_sse(token, progress, settings)
-                break
+                if not done:
+                    latest = await service.queue_position(token, progress)
+                    if latest != position:
+                        position = latest
+                        yield service.progress_sse(JobProgress(status=progress.status), position=position)
+                    continue
+
+                try:
+                    event_id, delta = next_event.result()
+                except StopAsyncIteration:
+                    break
+                next_event = asyncio.ensure_future(anext(events))
+
+                progress = JobProgress.from_redis(delta, id=token)
+                if progress.status in TERMINAL_STATUSES:
+                    yield service.terminal_sse(token, progress, settings, event_id)
+                    break
 
-            yield service.progress_sse(progress)
+                position = await service.queue_position(token, progress)
+                yield service.progress_sse(progress, position=position, event_id=event_id)
+        finally:
+            if next_event is not None:
+                next_event.cancel()
+                with contextlib.suppress(asyncio.CancelledError, StopAsyncIteration):
+                    await next_event
+            await events.aclose()
 
     return StreamingResponse(_gen(), headers=_SSE_HEADERS)
@@ -1,17 +1,31 @@
+import asyncio
 import json
+import logging
+import time
 
 from fastapi.responses import JSONResponse
 
 from src.codes import RUNNING_STATUSES, SystemCode
-from src.config import Settings
+from src.config import Settings, get_settings
 from src.db import jobs as db_jobs
+from src.exceptions import AppError
+from src.io import result_table
 from src.io.files import load_completed_result
-from src.job_progress import JobProgress
+from src.job_progress import JobProgress, timestamped
+from src.metrics import CANCEL_DURATION, CANCEL_KILLS
 from src.redis import get, publish
 from src.responses import api_response
+from src.submit import inflight, queue_index
 from src.worker.celery_app import app as celery_app
+from src.worker import cancellation, shards
 from src.worker.analysis_task import AnalysisTask
 
+logger = logging.getLogger(__name__)
+
+_CANCEL_POLL_SECONDS = 0.5
+
+_background: set[asyncio.Task] = set()
+
 
 async def get_job_state(token: str) -> JobProgress | None:
     state = await get(token)
@@ -33,27 +47,80 @@ async def terminal_api_response(token: str, job: JobProgress) -> JSONResponse:
 
 
 async def terminate_analysis(token: str, error_message: str | None = None) -> None:
-    celery_app.control.revoke(AnalysisTask.task_id_for(token), terminate=True, signal="SIGKILL")
     job = await db_jobs.get_job(token)
-    if not job or JobProgress.from_db(job).status not in RUNNING_STATUSES:
+    status = JobProgress.from_db(job).status if job else None
+    # an attached job only detaches; the run is stopped once no other job waits for it
+    attached_to = job.get("source_job_id") if job and job.get("result_source") == db_jobs.COALESCED else None
+    waiting = await inflight.detach(str(attached_to or token), token)
+    await queue_index.remove(token)
+    if status in RUNNING_STATUSES:
+        updates: dict = {
+            "status": SystemCode.ANALYSIS_CANCELLED,
+            "completed_at": db_jobs.utc_now(),
+        }
+        if error_message:
+            updates["error_message"] = error_message
+        await db_jobs.update_analysis_job(token, **updates)
+        await publish(
+            token,
+            JobProgress.of(
+                SystemCode.ANALYSIS_CANCELLED,
+                error_message=error_message,
+            ).to_redis(),
+        )
+    if attached_to is None and not waiting:
+        await _stop_run(token, processing=status == SystemCode.ANALYSIS_PROCESSING)
+
+
+async def _stop_run(token: str, *, processing: bool) -> None:
+    # Revoked tasks still queued are dropped. Running ones stop at their next progress line
+    # (see src.worker.cancellation) and are killed only if they have not after the grace period.
+    count = await shards.shard_count(token)
+    task_ids = [AnalysisTask.task_id_for(token)] + [shards.task_id(token, i) for i in range(count)]
+    await cancellation.request(token)
+    celery_app.control.revoke(task_ids)
+    if not processing:
         return
-    updates: dict = {
-        "status": SystemCode.ANALYSIS_CANCELLED,
-        "completed_at": db_jobs.utc_now(),
-    }
-    if error_message:
-        updates["error_message"] = error_message
-    await db_jobs.update_analysis_job(token, **updates)
-    await publish(
-        token,
-        JobProgress.of(
-            SystemCode.ANALYSIS_CANCELLED,
-            error_message=error_message,
-        ).to_redis(),
-    )
-
-
-def progress_api_data(job: JobProgress, *, token: str | None = None) -> dict:
+    if count:
+        running = [shards.task_id(token, i) for i in await shards.unfinished(token)]
+    else:
+        # batched and direct-lane jobs have no task to kill: a batch runs on for the jobs
+        # batched with the cancelled one, and the direct lane is not a Celery worker
+        running = await cancellation.started(token)
+    if not running:
+        return
+    task = asyncio.create_task(_enforce_cancel(token, running, get_settings().cancel_grace_seconds))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def _enforce_cancel(token: str, task_ids: list[str], grace: int) -> None:
+    started = time.monotonic()
+    remaining = task_ids
+    try:
+        while True:
+            stopped = await cancellation.stopped(token)
+            remaining = [t for t in task_ids if t not in stopped]
+            if not remaining:
+                CANCEL_DURATION.observe(time.monotonic() - started)
+                return
+            if time.monotonic() - started >= grace:
+                break
+            await asyncio.sleep(_CANCEL_POLL_SECONDS)
+    except Exception:
+        logger.exception("could not follow the cancellation of job %s", token)
+    logger.warning("cancelled job %s still running after %ds, killing %d tasks", token, grace, len(remaining))
+    celery_app.control.revoke(remaining, terminate=True, signal="SIGKILL")
+    CANCEL_KILLS.inc(len(remaining))
+
+
+async def queue_position(token: str, job: JobProgress) -> int | None:
+    if job.status != SystemCode.ANALYSIS_QUEUED:
+        return None
+    return await queue_index.position(token)
+
+
+def progress_api_data(job: JobProgress, *, token: str | None = None, position: int | None = None) -> dict:
     data: dict = {}
     if token is not None:
         data["token"] = token
@@ -63,13 +130,45 @@ def progress_api_data(job: JobProgress, *, token: str | None = None) -> dict:
         data["percent"] = job.percent
     if job.async_mode is not None:
         data["asyncMode"] = job.async_mode
-    if job.messages:
-        data["processStatusMessages"] = job.messages
+    if job.partial_features is not None:
+        data["partialFeatures"] = job.partial_features
+    messages = list(job.messages or [])
+    if position is not None:
+        data["queuePosition"] = position
+        messages.append(timestamped(f"Position {position} in queue"))
+    if messages:
+        data["processStatusMessages"] = messages
     return data
 
 
-def sse_bytes(payload: dict) -> bytes:
-    return f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+def result_page(
+    token: str,
+    offset: int,
+    limit: int,
+    settings: Settings,
+    fields: list[str] | None = None,
+    filters: dict[str, list[str]] | None = None,
+) -> tuple[list[dict], int] | None:
+    # Blocking. A page of the result features (with only `fields` among their properties and
+    # geometry) and how many features match `filters`, read from the row groups of the
+    # columnar result that hold them (see src.io.result_table). None when there is no result.
+    parquet = result_table.open_file(token, settings)
+    if parquet is None:
+        return None
+    available = parquet.schema_arrow.names
+    for name in [*(fields or []), *(filters or {})]:
+        if name not in available:
+            raise AppError(SystemCode.VALIDATION_INVALID_RESULT_FIELD, [name, ", ".join(available)])
+    if filters:
+        rows = result_table.matching_rows(parquet, filters)
+        page = result_table.take(parquet, rows[offset:offset + limit], fields)
+        return result_table.features(page), len(rows)
+    return result_table.features(result_table.read_rows(parquet, offset, limit, fields)), parquet.metadata.num_rows
+
+
+def sse_bytes(payload: dict, event_id: str | None = None) -> bytes:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}data: {json.dumps(payload)}\n\n".encode("utf-8")
 
 
 def not_found_sse() -> bytes:
@@ -87,9 +186,13 @@ def terminal_sse_payload(token: str, job: JobProgress, settings: Settings | None
     return payload
 
 
-def terminal_sse(token: str, job: JobProgress, settings: Settings | None) -> bytes:
-    return sse_bytes(terminal_sse_payload(token, job, settings))
+def terminal_sse(token: str, job: JobProgress, settings: Settings | None, event_id: str | None = None) -> bytes:
+    return sse_bytes(terminal_sse_payload(token, job, settings), event_id)
 
 
-def progress_sse(job: JobProgress, *, token: str | None = None) -> bytes:
-    return sse_bytes({"code": job.status.value, "data": progress_api_data(job, token=token)})
+def progress_sse(
+    job: JobProgress, *, token: str | None = None, position: int | None = None, event_id: str | None = None
+) -> bytes:
+    return sse_bytes(
+        {"code": job.status.value, "data": progress_api_data(job, token=token, position=position)}, event_id
+    )
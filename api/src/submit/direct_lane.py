@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict
+
+from src.config import Settings, get_settings
+from src.metrics import DIRECT_LANE_DURATION, DIRECT_LANE_SKIPPED
+from src.submit.schemas import AnalysisOptions
+from src.worker.celery_app import initialize_ee
+from src.worker.tasks import analyse_direct
+
+logger = logging.getLogger(__name__)
+
+
+def _warm_up() -> None:
+    import openforis_whisp  # noqa: F401
+
+
+class DirectLane:
+    # Processes of the API with Earth Engine initialized that analyse tiny sync submissions
+    # without the job queue. Nothing waits for a process: when all are busy the job takes the
+    # worker queue as usual.
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.in_flight = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+    def _create(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.settings.direct_lane_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=initialize_ee,
+        )
+
+    async def start(self) -> None:
+        if self.settings.direct_lane_workers <= 0:
+            return
+        self._executor = self._create()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self._executor, _warm_up) for _ in range(self.settings.direct_lane_workers))
+        )
+        logger.info("direct lane started (workers=%d)", self.settings.direct_lane_workers)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def accepts(self, opts: AnalysisOptions, feature_count: int) -> bool:
+        if self._executor is None or opts.async_mode or feature_count > self.settings.direct_lane_max_features:
+            return False
+        if self.in_flight >= self.settings.direct_lane_workers:
+            DIRECT_LANE_SKIPPED.inc()
+            return False
+        return True
+
+    def _release(self, _future) -> None:
+        self.in_flight -= 1
+
+    async def run(self, token: str, opts: AnalysisOptions, timeout: int) -> dict:
+        # A timed out analysis keeps its process until whisp returns, so the slot is
+        # released with the process and not with the request.
+        self.in_flight += 1
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self._executor, analyse_direct, token, asdict(opts))
+        except BaseException:
+            self.in_flight -= 1
+            raise
+        future.add_done_callback(self._release)
+        started = loop.time()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except BrokenProcessPool:
+            logger.exception("direct lane process died, restarting pool")
+            self.close()
+            self._executor = self._create()
+            raise
+        finally:
+            DIRECT_LANE_DURATION.observe(loop.time() - started)
+
+
+_lane: DirectLane | None = None
+
+
+async def init_direct_lane() -> DirectLane:
+    global _lane
+    if _lane is None:
+        _lane = DirectLane(get_settings())
+        await _lane.start()
+    return _lane
+
+
+def close_direct_lane() -> None:
+    global _lane
+    if _lane is not None:
+        _lane.close()
+        _lane = None
+
+
+def get_direct_lane() -> DirectLane:
+    global _lane
+    if _lane is None:
+        # not started by the lifespan (scripts, tests): disabled
+        _lane = DirectLane(get_settings())
+    return _lane
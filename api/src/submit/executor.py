@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, TypeVar
+
+from src.codes import SystemCode
+from src.config import Settings, get_settings
+from src.exceptions import AppError
+from src.metrics import VALIDATION_DURATION, VALIDATION_QUEUE_WAIT, VALIDATION_REJECTED
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _warm_up() -> None:
+    import src.submit.prepare  # noqa: F401
+
+
+def _timed(fn: Callable[..., T], args: tuple) -> tuple[float, float, T | None, AppError | None]:
+    started = time.time()
+    t0 = time.perf_counter()
+    try:
+        result, error = fn(*args), None
+    except AppError as e:
+        result, error = None, e
+    return started, time.perf_counter() - t0, result, error
+
+
+class ValidationPool:
+    # Bounded process pool for CPU-bound submission validation, so large payloads do not
+    # block the event loop. Once `workers + queue_limit` submissions are in flight, new
+    # ones are rejected with a 503 instead of queueing without bound.
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.capacity = settings.validation_workers + settings.validation_queue_limit
+        self.in_flight = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+    def _create(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.settings.validation_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    async def start(self) -> None:
+        if self.settings.validation_workers <= 0:
+            return
+        self._executor = self._create()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self._executor, _warm_up) for _ in range(self.settings.validation_workers))
+        )
+        logger.info("validation pool started (workers=%d)", self.settings.validation_workers)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn: Callable[..., T], *args: Any, inline: bool = False) -> T:
+        if inline or self._executor is None:
+            _, elapsed, result, error = _timed(fn, args)
+            VALIDATION_DURATION.labels(mode="inline").observe(elapsed)
+            if error is not None:
+                raise error
+            return result
+
+        if self.in_flight >= self.capacity:
+            VALIDATION_REJECTED.inc()
+            retry_after = self.settings.validation_retry_after_seconds
+            raise AppError(
+                SystemCode.SERVICE_SUBMISSIONS_BUSY,
+                [retry_after],
+                headers={"Retry-After": str(retry_after)},
+            )
+
+        self.in_flight += 1
+        submitted = time.time()
+        try:
+            started, elapsed, result, error = await asyncio.get_running_loop().run_in_executor(
+                self._executor, _timed, fn, args
+            )
+        except BrokenProcessPool:
+            logger.exception("validation worker died, restarting pool")
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._create()
+            raise AppError(SystemCode.SYSTEM_INTERNAL_SERVER_ERROR)
+        finally:
+            self.in_flight -= 1
+
+        VALIDATION_QUEUE_WAIT.observe(max(0.0, started - submitted))
+        VALIDATION_DURATION.labels(mode="pool").observe(elapsed)
+        if error is not None:
+            raise error
+        return result
+
+
+_pool: ValidationPool | None = None
+
+
+async def init_validation_pool() -> ValidationPool:
+    global _pool
+    if _pool is None:
+        _pool = ValidationPool(get_settings())
+        await _pool.start()
+    return _pool
+
+
+def close_validation_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+def get_validation_pool() -> ValidationPool:
+    global _pool
+    if _pool is None:
+        # not started by the lifespan (scripts, tests): validate inline
+        _pool = ValidationPool(get_settings())
+    return _pool
@@ -0,0 +1,261 @@
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+
+# whisp.analyze_geojson converts EPSG:4326 areas with this factor (accurate at the equator only)
+_DEGREES_TO_HA = 1232100
+
+_NUMERIC_KINDS = "biuf"
+
+
+@dataclass
+class GeometryReport:
+    feature_count: int
+    polygon_count: int
+    in_meters: bool
+    valid_wgs84: bool
+    common_properties: set[str] = field(default_factory=set)
+    input_metrics: dict[str, Any] = field(default_factory=dict)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float))
+
+
+class GeometryArrays:
+    # Validation engine for submitted GeoJSON. Every geometry is normalized to 2D Features
+    # while its coordinates are packed into float64 arrays with ring/part/feature offsets,
+    # so bounds checks, polygon counts, property-key intersection and the input metrics
+    # are computed over arrays instead of walking the coordinates again.
+
+    def __init__(self) -> None:
+        self.feature_count = 0
+        self.polygon_count = 0
+        self.geometry_types: dict[str, int] = {}
+        self._malformed = False
+        self._chunks: list[np.ndarray] = []
+        self._n_points = 0
+        # rings of polygonal features in input order, rings per part, parts per feature
+        self._ring_start: list[int] = []
+        self._ring_length: list[int] = []
+        self._part_rings: list[int] = []
+        self._feature_parts: list[int] = []
+        self._key_ids: dict[str, int] = {}
+        self._feature_keys: list[int] = []
+        self._features_hash = hashlib.sha256()
+
+    def _pack(self, seq: Any) -> list:
+        # Packs a coordinate sequence and returns it reduced to 2D.
+        try:
+            arr = np.asarray(seq)
+        except (ValueError, TypeError):
+            arr = None
+        if arr is not None and arr.ndim == 2 and arr.shape[1] >= 2 and arr.dtype.kind in _NUMERIC_KINDS:
+            self._chunks.append(arr[:, :2].astype(np.float64, copy=False))
+            self._n_points += len(arr)
+            return seq if arr.shape[1] == 2 else [c[:2] for c in seq]
+        if not isinstance(seq, list):
+            self._malformed = True
+            return []
+        kept = []
+        for c in seq:
+            if isinstance(c, list) and len(c) >= 2 and _is_number(c[0]) and _is_number(c[1]):
+                kept.append(c[:2])
+            else:
+                self._malformed = True
+        if kept:
+            self._chunks.append(np.asarray(kept, dtype=np.float64))
+            self._n_points += len(kept)
+        return kept
+
+    def _polygon(self, rings: Any) -> list:
+        if not isinstance(rings, list):
+            self._malformed = True
+            rings = []
+        out = []
+        for ring in rings:
+            start = self._n_points
+            out.append(self._pack(ring))
+            self._ring_start.append(start)
+            self._ring_length.append(self._n_points - start)
+        self._part_rings.append(len(out))
+        return out
+
+    def _emit(self, out: list[dict], geom_type: str, coords: Any, props: dict) -> None:
+        out.append({"type": "Feature", "properties": {**props}, "geometry": {"type": geom_type, "coordinates": coords}})
+        self.feature_count += 1
+        self.polygon_count += len(coords) if geom_type == "MultiPolygon" else 1
+        self.geometry_types[geom_type] = self.geometry_types.get(geom_type, 0) + 1
+        # the end offset ties the feature to its packed coordinates, since lines are packed but not emitted
+        self._features_hash.update(
+            f"{geom_type}:{len(coords)}:{self._n_points}:{json.dumps(props, sort_keys=True, default=str)}\n".encode()
+        )
+        for key in props:
+            self._feature_keys.append(self._key_ids.setdefault(key, len(self._key_ids)))
+
+    def _walk(self, node: Any, out: list[dict], props: dict | None = None) -> None:
+        if not isinstance(node, dict):
+            return
+        t = node.get("type")
+        coords = node.get("coordinates")
+        p = props or {}
+        if t == "Polygon":
+            self._emit(out, t, self._polygon(coords or []), p)
+            self._feature_parts.append(1)
+        elif t == "MultiPolygon":
+            polys = [self._polygon(poly) for poly in coords or []]
+            self._emit(out, t, polys, p)
+            self._feature_parts.append(len(polys))
+        elif t == "Point":
+            packed = self._pack([coords]) if isinstance(coords, list) else []
+            self._emit(out, t, packed[0] if packed else (coords or [])[:2], p)
+        elif t == "MultiPoint":
+            for pt in self._pack(coords or []):
+                self._emit(out, "Point", pt, p)
+        elif t == "GeometryCollection":
+            for sub in node.get("geometries", []) or []:
+                self._walk(sub, out, p)
+        elif t == "Feature":
+            self._walk(node.get("geometry"), out, node.get("properties") or {})
+        elif t == "FeatureCollection":
+            for feat in node.get("features", []) or []:
+                self._walk(feat, out)
+        elif t == "LineString" and isinstance(coords, list):
+            # lines are not analysed but their coordinates still have to be valid
+            self._pack(coords)
+        elif t == "MultiLineString" and isinstance(coords, list):
+            for line in coords:
+                self._pack(line or [])
+
+    def add(self, node: Any) -> list[dict]:
+        # Returns the normalized Features of a Feature, FeatureCollection or bare geometry.
+        out: list[dict] = []
+        self._walk(node, out)
+        return out
+
+    def _points(self) -> np.ndarray:
+        if len(self._chunks) > 1:
+            self._chunks = [np.concatenate(self._chunks)]
+        return self._chunks[0] if self._chunks else np.empty((0, 2), dtype=np.float64)
+
+    def _common_properties(self) -> set[str]:
+        if not self.feature_count:
+            return set()
+        counts = np.bincount(np.asarray(self._feature_keys, dtype=np.int64), minlength=len(self._key_ids))
+        return {key for key, i in self._key_ids.items() if counts[i] == self.feature_count}
+
+    def _polygon_stats(self, xy: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Per polygonal feature: area in hectares (NaN when whisp would skip it) and vertex count.
+        parts = np.asarray(self._feature_parts, dtype=np.int64)
+        part_rings = np.asarray(self._part_rings, dtype=np.int64)
+        start = np.asarray(self._ring_start, dtype=np.int64)
+        length = np.asarray(self._ring_length, dtype=np.int64)
+        n_features, n_rings = len(parts), len(start)
+
+        part_feature = np.repeat(np.arange(n_features), parts)
+        ring_part = np.repeat(np.arange(len(part_rings)), part_rings)
+        ring_feature = part_feature[ring_part]
+        vertices = np.bincount(ring_feature, weights=length, minlength=n_features).astype(np.int64)
+
+        # shoelace over all rings at once, closing each ring back to its first position
+        point_ring = np.repeat(np.arange(n_rings), length)
+        base = start[point_ring]
+        offset = np.arange(len(point_ring)) - np.repeat(np.cumsum(length) - length, length)
+        idx = base + offset
+        nxt = base + (offset + 1) % length[point_ring]
+        cross = xy[idx, 0] * xy[nxt, 1] - xy[nxt, 0] * xy[idx, 1]
+        ring_area = np.abs(np.bincount(point_ring, weights=cross, minlength=n_rings)) / 2
+
+        # the first ring of each part is its shell, the others are holes
+        is_shell = np.zeros(n_rings, dtype=bool)
+        is_shell[(np.cumsum(part_rings) - part_rings)[part_rings > 0]] = True
+        part_area = np.bincount(ring_part, weights=np.where(is_shell, ring_area, -ring_area), minlength=len(part_rings))
+        area = np.abs(np.bincount(part_feature, weights=part_area, minlength=n_features)) * _DEGREES_TO_HA
+
+        # shapely rejects non-empty rings of one or two positions; whisp then falls back to
+        # the bounding box of the whole geometry and skips empty boxes
+        degenerate = (length > 0) & (length < 3)
+        for f in np.unique(ring_feature[degenerate]):
+            span = np.ptp(xy[idx[ring_feature[point_ring] == f]], axis=0)
+            bbox = span[0] * span[1] * _DEGREES_TO_HA
+            area[f] = bbox if bbox > 0 else np.nan
+        return area, vertices
+
+    def _input_metrics(self, areas: np.ndarray, vertices: np.ndarray) -> dict[str, Any]:
+        # Same numbers as whisp.analyze_geojson on the normalized collection.
+        metrics: dict[str, Any] = {"count": self.feature_count, "geometry_types": dict(self.geometry_types)}
+        if not len(vertices):
+            metrics.update(_zero_distribution("area"))
+            metrics.update(_zero_distribution("vertex"))
+            return metrics
+
+        areas = np.sort(areas[~np.isnan(areas)])
+        if len(areas):
+            median = round(float(_median(areas)), 2)
+            metrics.update(
+                min_area_ha=round(float(areas[0]), 2),
+                mean_area_ha=round(float(areas.sum() / len(areas)), 2),
+                median_area_ha=median,
+                max_area_ha=round(float(areas[-1]), 2),
+                area_percentiles={k: round(float(val), 2) for k, val in _percentiles(areas, median).items()},
+            )
+        else:
+            metrics.update(_zero_distribution("area"))
+
+        vertices = np.sort(vertices)
+        if len(vertices) % 2 == 1:
+            median = int(vertices[len(vertices) // 2])
+        else:
+            median = round(float(_median(vertices)), 0)
+        metrics.update(
+            min_vertices=int(vertices[0]),
+            mean_vertices=round(float(vertices.sum() / len(vertices)), 2),
+            median_vertices=median,
+            max_vertices=int(vertices[-1]),
+            vertex_percentiles={k: val if k == "p50" else int(val) for k, val in _percentiles(vertices, median).items()},
+        )
+        return metrics
+
+    def digest(self) -> str:
+        # Canonical hash of the normalized features: coordinates are hashed as packed
+        # float64 pairs, so 3D input, int/float spelling and key order do not matter.
+        h = hashlib.sha256(self._features_hash.digest())
+        h.update(np.ascontiguousarray(self._points()).tobytes())
+        h.update(np.asarray(self._ring_length, dtype=np.int64).tobytes())
+        h.update(np.asarray(self._part_rings, dtype=np.int64).tobytes())
+        return h.hexdigest()
+
+    def report(self) -> GeometryReport:
+        xy = self._points()
+        x, y = np.abs(xy[:, 0]), np.abs(xy[:, 1])
+        outside = (x > 180) | (y > 90)
+        areas, vertices = self._polygon_stats(xy)
+        return GeometryReport(
+            feature_count=self.feature_count,
+            polygon_count=self.polygon_count,
+            in_meters=bool(outside.any()),
+            valid_wgs84=not self._malformed and not outside.any() and not np.isnan(xy).any(),
+            common_properties=self._common_properties(),
+            input_metrics=self._input_metrics(areas, vertices),
+        )
+
+
+def _median(values: np.ndarray) -> Any:
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 == 1 else (values[mid - 1] + values[mid]) / 2
+
+
+def _percentiles(values: np.ndarray, p50: Any) -> dict[str, Any]:
+    n = len(values)
+    return {"p25": values[n // 4], "p50": p50, "p75": values[(n * 3) // 4], "p90": values[int(n * 0.9)]}
+
+
+def _zero_distribution(name: str) -> dict[str, Any]:
+    if name == "area":
+        keys = ("min_area_ha", "mean_area_ha", "median_area_ha", "max_area_ha")
+    else:
+        keys = ("min_vertices", "mean_vertices", "median_vertices", "max_vertices")
+    return {**{k: 0 for k in keys}, f"{name}_percentiles": {"p25": 0, "p50": 0, "p75": 0, "p90": 0}}
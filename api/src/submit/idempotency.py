@@ -0,0 +1,72 @@
+import hashlib
+import json
+import logging
+
+from src.codes import SystemCode
+from src.config import Settings
+from src.exceptions import AppError
+from src.redis import client
+
+logger = logging.getLogger(__name__)
+
+# Idempotency-Key support for the submit routes. A key is scoped to the API key and maps to
+# the fingerprint of the first request (route + body) and the job token it was given. The
+# record lives for a short pending window until the job exists, then for the full TTL.
+_MAX_KEY_LENGTH = 255
+_PENDING_MARGIN_SECONDS = 300
+
+_RELEASE = """
+local record = redis.call('GET', KEYS[1])
+if not record or cjson.decode(record)['token'] ~= ARGV[1] then return 0 end
+if ARGV[2] == '0' then return redis.call('DEL', KEYS[1]) end
+return redis.call('EXPIRE', KEYS[1], ARGV[2])
+"""
+
+
+def check_key(key: str | None) -> str | None:
+    if key is None:
+        return None
+    if not 0 < len(key) <= _MAX_KEY_LENGTH or not key.isascii() or not key.isprintable():
+        raise AppError(SystemCode.VALIDATION_INVALID_IDEMPOTENCY_KEY, [_MAX_KEY_LENGTH])
+    return key
+
+
+def fingerprint(endpoint: str, body_digest: str) -> str:
+    return hashlib.sha256(f"{endpoint}\n{body_digest}".encode()).hexdigest()
+
+
+def _record_key(scope: int | None, key: str) -> str:
+    return f"idempotency:{scope}:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+async def reserve(scope: int | None, key: str, request_fingerprint: str, token: str, settings: Settings) -> str | None:
+    # Returns the token of the original request for a repeat, None when this request goes ahead.
+    record = json.dumps({"fingerprint": request_fingerprint, "token": token})
+    pending_ttl = settings.analysis_timeout_sync_seconds + _PENDING_MARGIN_SECONDS
+    try:
+        r = client()
+        for _ in range(2):
+            if await r.set(_record_key(scope, key), record, nx=True, ex=pending_ttl):
+                return None
+            existing = await r.get(_record_key(scope, key))
+            if existing is not None:
+                break
+        else:
+            return None
+    except Exception:
+        logger.exception("idempotency lookup failed")
+        return None
+
+    original = json.loads(existing)
+    if original["fingerprint"] != request_fingerprint:
+        raise AppError(SystemCode.VALIDATION_IDEMPOTENCY_KEY_REUSED)
+    return original["token"]
+
+
+async def settle(scope: int | None, key: str, token: str, *, created: bool, settings: Settings) -> None:
+    # Keeps the record for the full TTL once the job exists, otherwise frees the key for a retry.
+    try:
+        ttl = settings.idempotency_ttl_seconds if created else 0
+        await client().eval(_RELEASE, 1, _record_key(scope, key), token, str(ttl))
+    except Exception:
+        logger.exception("idempotency update failed for job %s", token)
@@ -0,0 +1,121 @@
+import logging
+
+from src.redis import client, sync_client
+
+logger = logging.getLogger(__name__)
+
+# Single-flight for identical submissions. The first job claims the result cache key and is
+# enqueued; identical submissions made while it runs attach to it instead of running again.
+# Every job waiting on a run is a member of it, so cancelling one only detaches that job
+# and the run is revoked once nobody waits for it.
+_CLAIM_ATTEMPTS = 3
+_CLAIM_MARGIN_SECONDS = 300
+
+# attach only while the claim still belongs to the primary
+_ATTACH = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end
+redis.call('SADD', KEYS[2], ARGV[2])
+return 1
+"""
+
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then redis.call('DEL', KEYS[1]) end
+redis.call('DEL', KEYS[2], KEYS[3])
+return 1
+"""
+
+# the claim (KEYS[3], when the run has one) goes away with the last member, so nobody
+# attaches to a revoked run
+_DETACH = """
+redis.call('SREM', KEYS[1], ARGV[1])
+local remaining = redis.call('SCARD', KEYS[1])
+if remaining == 0 then
+  if KEYS[3] and redis.call('GET', KEYS[2]) == KEYS[3] and redis.call('GET', KEYS[3]) == ARGV[2] then
+    redis.call('DEL', KEYS[3])
+  end
+  redis.call('DEL', KEYS[2])
+end
+return remaining
+"""
+
+
+def _claim_key(cache_key: str, async_mode: bool) -> str:
+    return f"inflight:{cache_key}:{'async' if async_mode else 'sync'}"
+
+
+def _members_key(primary: str) -> str:
+    return f"inflight:{primary}:members"
+
+
+def _claim_ref_key(primary: str) -> str:
+    return f"inflight:{primary}:claim"
+
+
+async def claim(cache_key: str, async_mode: bool, token: str, timeout: int) -> str | None:
+    # Returns the token of the job to attach to, or None when `token` runs the analysis itself.
+    ttl = timeout + _CLAIM_MARGIN_SECONDS
+    try:
+        r = client()
+        key = _claim_key(cache_key, async_mode)
+        for _ in range(_CLAIM_ATTEMPTS):
+            if await r.set(key, token, nx=True, ex=ttl):
+                pipe = r.pipeline()
+                pipe.sadd(_members_key(token), token)
+                pipe.expire(_members_key(token), ttl)
+                pipe.set(_claim_ref_key(token), key, ex=ttl)
+                await pipe.execute()
+                return None
+            primary = await r.get(key)
+            if primary is not None and await r.eval(_ATTACH, 2, key, _members_key(primary), primary, token):
+                return primary
+    except Exception:
+        logger.exception("in-flight claim failed for job %s", token)
+    return None
+
+
+async def holds(cache_key: str, async_mode: bool, primary: str) -> bool:
+    try:
+        return await client().get(_claim_key(cache_key, async_mode)) == primary
+    except Exception:
+        logger.exception("in-flight lookup failed for job %s", primary)
+        return True
+
+
+async def release(cache_key: str, async_mode: bool, primary: str) -> None:
+    try:
+        await client().eval(
+            _RELEASE, 3, _claim_key(cache_key, async_mode), _members_key(primary), _claim_ref_key(primary), primary
+        )
+    except Exception:
+        logger.exception("in-flight release failed for job %s", primary)
+
+
+def release_sync(cache_key: str, async_mode: bool, primary: str) -> None:
+    try:
+        sync_client().eval(
+            _RELEASE, 3, _claim_key(cache_key, async_mode), _members_key(primary), _claim_ref_key(primary), primary
+        )
+    except Exception:
+        logger.exception("in-flight release failed for job %s", primary)
+
+
+async def detach(primary: str, token: str) -> bool:
+    # Removes `token` from the run of `primary`; True while other jobs still wait on it.
+    try:
+        r = client()
+        # the claim key is looked up first, so the script is given every key it touches
+        claim = await r.get(_claim_ref_key(primary))
+        keys = [_members_key(primary), _claim_ref_key(primary), *([claim] if claim else [])]
+        return await r.eval(_DETACH, len(keys), *keys, token, primary) > 0
+    except Exception:
+        logger.exception("in-flight detach failed for job %s", token)
+        return False
+
+
+def members_sync(primary: str) -> list[str]:
+    # Jobs that receive the progress of the run of `primary`.
+    try:
+        return sorted(sync_client().smembers(_members_key(primary)))
+    except Exception:
+        logger.exception("in-flight members lookup failed for job %s", primary)
+        return [primary]
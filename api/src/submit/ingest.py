@@ -0,0 +1,182 @@
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from fastapi import Request
+from pydantic import ValidationError
+
+from src.codes import SystemCode
+from src.config import Settings
+from src.exceptions import AppError
+from src.io import files
+from src.io.json_stream import JsonStreamError, ObjectStreamParser
+from src.schemas import AnalysisOptionsInput
+from src.submit import validators as v
+from src.submit.geometry_arrays import GeometryArrays, GeometryReport
+from src.submit.schemas import AnalysisOptions
+
+_READ_CHUNK_BYTES = 256 * 1024
+
+
+@dataclass
+class IngestedGeoJson:
+    writer: files.FeatureCollectionWriter
+    opts: AnalysisOptions
+    geometry: GeometryArrays = field(default_factory=GeometryArrays)
+    report: GeometryReport | None = None
+
+    def add(self, node: Any) -> None:
+        for feature in self.geometry.add(node):
+            self.writer.write(feature)
+
+
+def _too_large(received: int, max_bytes: int) -> AppError:
+    return AppError(
+        SystemCode.VALIDATION_REQUEST_BODY_TOO_LARGE,
+        [f"{received / 1024:.2f}", f"{max_bytes / 1024:.2f}"],
+    )
+
+
+def _parse_options(raw: Any) -> AnalysisOptions:
+    try:
+        parsed = AnalysisOptionsInput.model_validate(raw) if raw is not None else None
+    except ValidationError:
+        raise AppError(SystemCode.VALIDATION_MISSING_REQUEST_BODY)
+    return AnalysisOptions.parse(parsed.model_dump(by_alias=True) if parsed else None)
+
+
+class _GeoJsonIngest:
+    def __init__(self, writer: files.FeatureCollectionWriter, settings: Settings):
+        self.settings = settings
+        self.head: dict[str, Any] = {}
+        self.errors: list[str] = []
+        self.index = 0
+        self.result = IngestedGeoJson(writer=writer, opts=AnalysisOptions())
+
+    def _check_limit(self) -> None:
+        if "analysisOptions" not in self.head:
+            return
+        s = self.settings
+        limit = s.geometry_limit_async if self.result.opts.async_mode else s.geometry_limit_sync
+        if self.result.geometry.polygon_count > limit:
+            raise AppError(SystemCode.VALIDATION_TOO_MANY_GEOMETRIES, [limit])
+
+    def handle(self, kind: str, value: Any) -> None:
+        if kind == "member":
+            self.on_member(*value)
+        else:
+            self.on_feature(value)
+
+    def on_member(self, key: str, value: Any) -> None:
+        self.head[key] = value
+        if key == "analysisOptions":
+            self.result.opts = _parse_options(value)
+            self._check_limit()
+
+    def on_feature(self, feat: Any) -> None:
+        self.errors.extend(v.validate_feature_structure(feat, self.index))
+        self.index += 1
+        if self.errors:
+            return
+        self.result.add(feat)
+        self._check_limit()
+
+    def finish(self, streamed: bool) -> IngestedGeoJson:
+        head = self.head
+        if not streamed or head.get("type") != "FeatureCollection":
+            # only FeatureCollections are streamed; single features and bare geometries are small
+            fc_dict = {k: val for k, val in head.items() if k != "analysisOptions"}
+            self.errors = v.validate_geojson_structure(fc_dict)
+            if not self.errors:
+                writer = self.result.writer
+                writer.discard()
+                self.result = IngestedGeoJson(
+                    writer=files.FeatureCollectionWriter(writer.path),
+                    opts=self.result.opts,
+                )
+                self.result.add(fc_dict)
+
+        if self.errors:
+            raise AppError(
+                SystemCode.VALIDATION_INVALID_GEOJSON,
+                ["\n".join(f"- {e}" for e in self.errors)],
+            )
+        ok, _ = v.validate_crs(head)
+        if not ok:
+            raise AppError(SystemCode.VALIDATION_INVALID_CRS)
+        report = self.result.report = self.result.geometry.report()
+        if report.in_meters:
+            raise AppError(SystemCode.VALIDATION_COORDINATES_IN_METERS)
+        if not report.valid_wgs84:
+            raise AppError(SystemCode.VALIDATION_INVALID_COORDINATES)
+        return self.result
+
+
+def _chunks(body: bytes | Path) -> Iterator[bytes]:
+    if isinstance(body, bytes):
+        yield body
+        return
+    with body.open("rb") as fh:
+        while chunk := fh.read(_READ_CHUNK_BYTES):
+            yield chunk
+
+
+def ingest_geojson(body: bytes | Path, token: str, settings: Settings) -> IngestedGeoJson:
+    parser = ObjectStreamParser("features")
+    ingest = _GeoJsonIngest(files.FeatureCollectionWriter(files.input_path(token, settings)), settings)
+    try:
+        try:
+            for chunk in _chunks(body):
+                for kind, value in parser.feed(chunk):
+                    ingest.handle(kind, value)
+            for kind, value in parser.close():
+                ingest.handle(kind, value)
+        except JsonStreamError:
+            raise AppError(SystemCode.VALIDATION_MISSING_REQUEST_BODY)
+        return ingest.finish(parser.streamed)
+    except BaseException:
+        ingest.result.writer.discard()
+        raise
+
+
+async def receive_body(request: Request, token: str, settings: Settings, digest: Any = None) -> bytes | Path:
+    # Small bodies stay in memory; larger ones are spooled to disk as they arrive so they
+    # can be parsed by a validation worker without holding the whole body in memory.
+    # `digest` (a hashlib object) is updated with the body as it arrives.
+    max_bytes = settings.max_request_body_size_bytes
+    declared = request.headers.get("content-length")
+    if max_bytes is not None and declared and declared.isdigit() and int(declared) > max_bytes:
+        raise _too_large(int(declared), max_bytes)
+
+    path = files.upload_path(token, settings)
+    buf = bytearray()
+    spool = None
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if digest is not None:
+                digest.update(chunk)
+            if max_bytes is not None and received > max_bytes:
+                raise _too_large(received, max_bytes)
+            if spool is None and received > settings.validation_inline_max_bytes:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                spool = path.open("wb")
+                spool.write(buf)
+                buf.clear()
+            if spool is not None:
+                spool.write(chunk)
+            else:
+                buf += chunk
+    except BaseException:
+        if spool is not None:
+            spool.close()
+            path.unlink(missing_ok=True)
+        raise
+    if spool is not None:
+        spool.close()
+        return path
+    if not received:
+        raise AppError(SystemCode.VALIDATION_MISSING_REQUEST_BODY)
+    return bytes(buf)
@@ -0,0 +1,103 @@
+from dataclasses import dataclass
+from pathlib import Path
+
+from src.codes import SystemCode
+from src.config import Settings
+from src.exceptions import AppError
+from src.io import files
+from src.submit import validators as v
+from src.submit.geometry_arrays import GeometryArrays, GeometryReport
+from src.submit.ingest import ingest_geojson
+from src.submit.schemas import AnalysisOptions
+
+# The prepare_* functions validate a submission and write the worker input file. They are
+# CPU-bound and run on the validation pool, so arguments and results must be picklable.
+
+
+@dataclass
+class PreparedSubmission:
+    opts: AnalysisOptions
+    feature_count: int
+    input_metrics: dict
+    input_hash: str
+
+
+def options_payload(opts: AnalysisOptions) -> dict:
+    payload: dict = {}
+    if opts.external_id_column:
+        payload["externalIdColumn"] = opts.external_id_column
+    if opts.unit_type:
+        payload["unitType"] = opts.unit_type
+    if opts.national_codes:
+        payload["nationalCodes"] = opts.national_codes
+    if opts.async_mode:
+        payload["async"] = True
+    if opts.geometry_audit_trail:
+        payload["geometryAuditTrail"] = True
+    return payload
+
+
+def _check_features(report: GeometryReport, opts: AnalysisOptions, settings: Settings) -> None:
+    if not report.feature_count:
+        raise AppError(SystemCode.VALIDATION_MISSING_REQUEST_BODY)
+
+    limit = settings.geometry_limit_async if opts.async_mode else settings.geometry_limit_sync
+    if report.polygon_count > limit:
+        raise AppError(SystemCode.VALIDATION_TOO_MANY_GEOMETRIES, [limit])
+
+    common = report.common_properties
+    if opts.external_id_column and opts.external_id_column not in common:
+        raise AppError(
+            SystemCode.VALIDATION_INVALID_EXTERNAL_ID_COLUMN,
+            [opts.external_id_column, ", ".join(sorted(common))],
+        )
+
+
+def _write_input(token: str, fc: dict, opts: AnalysisOptions, settings: Settings) -> None:
+    payload = dict(fc)
+    options = options_payload(opts)
+    if options:
+        payload["analysisOptions"] = options
+    files.atomic_write_json(files.input_path(token, settings), payload)
+
+
+def prepare_geojson(body: bytes | Path, token: str, settings: Settings) -> PreparedSubmission:
+    ingested = ingest_geojson(body, token, settings)
+    try:
+        _check_features(ingested.report, ingested.opts, settings)
+        ingested.writer.commit(analysisOptions=options_payload(ingested.opts) or None)
+    except BaseException:
+        ingested.writer.discard()
+        raise
+    report = ingested.report
+    return PreparedSubmission(ingested.opts, report.feature_count, report.input_metrics, ingested.geometry.digest())
+
+
+def prepare_wkt(wkt: str, opts: AnalysisOptions, token: str, settings: Settings) -> PreparedSubmission:
+    geom = v.wkt_to_geojson(wkt)
+    if geom is None:
+        raise AppError(SystemCode.VALIDATION_INVALID_WKT)
+    geometry = GeometryArrays()
+    features = geometry.add(geom)
+    report = geometry.report()
+    if report.in_meters:
+        raise AppError(SystemCode.VALIDATION_COORDINATES_IN_METERS)
+    if not report.valid_wgs84:
+        raise AppError(SystemCode.VALIDATION_INVALID_COORDINATES)
+    if not features:
+        raise AppError(SystemCode.VALIDATION_INVALID_WKT)
+
+    _check_features(report, opts, settings)
+    _write_input(token, {"type": "FeatureCollection", "features": features}, opts, settings)
+    return PreparedSubmission(opts, report.feature_count, report.input_metrics, geometry.digest())
+
+
+def prepare_feature_collection(
+    fc: dict, opts: AnalysisOptions, token: str, settings: Settings
+) -> PreparedSubmission:
+    geometry = GeometryArrays()
+    geometry.add(fc)
+    report = geometry.report()
+    _check_features(report, opts, settings)
+    _write_input(token, fc, opts, settings)
+    return PreparedSubmission(opts, report.feature_count, report.input_metrics, geometry.digest())
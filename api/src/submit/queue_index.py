@@ -0,0 +1,64 @@
+import logging
+import time
+
+from src.redis import client, sync_client
+
+logger = logging.getLogger(__name__)
+
+# Queued jobs per worker queue in a sorted set scored by enqueue time, so the position of
+# a job is a ZRANK when a client asks for it. Jobs leave the set when they start or end;
+# entries older than a day are dropped in case a job vanished without either.
+_QUEUES = ("sync", "async")
+_STALE_SECONDS = 86400
+
+
+def _key(queue: str) -> str:
+    return f"queue:{queue}"
+
+
+async def add(token: str, async_mode: bool) -> int | None:
+    # Returns the position of the job in its queue.
+    key = _key("async" if async_mode else "sync")
+    now = time.time()
+    try:
+        pipe = client().pipeline()
+        pipe.zremrangebyscore(key, "-inf", now - _STALE_SECONDS)
+        pipe.zadd(key, {token: now})
+        pipe.zrank(key, token)
+        *_, rank = await pipe.execute()
+        return rank + 1 if rank is not None else None
+    except Exception:
+        logger.exception("queue index update failed for job %s", token)
+        return None
+
+
+async def position(token: str) -> int | None:
+    try:
+        pipe = client().pipeline()
+        for queue in _QUEUES:
+            pipe.zrank(_key(queue), token)
+        ranks = await pipe.execute()
+    except Exception:
+        logger.exception("queue position lookup failed for job %s", token)
+        return None
+    return next((rank + 1 for rank in ranks if rank is not None), None)
+
+
+async def remove(*tokens: str) -> None:
+    try:
+        pipe = client().pipeline()
+        for queue in _QUEUES:
+            pipe.zrem(_key(queue), *tokens)
+        await pipe.execute()
+    except Exception:
+        logger.exception("queue index update failed for jobs %s", ", ".join(tokens))
+
+
+def remove_sync(*tokens: str) -> None:
+    try:
+        pipe = sync_client().pipeline()
+        for queue in _QUEUES:
+            pipe.zrem(_key(queue), *tokens)
+        pipe.execute()
+    except Exception:
+        logger.exception("queue index update failed for jobs %s", ", ".join(tokens))
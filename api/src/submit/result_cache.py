@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+from src.config import Settings
+from src.io import files
+from src.metrics import RESULT_CACHE_LOOKUPS
+from src.redis import client, sync_client
+from src.submit.schemas import AnalysisOptions
+
+logger = logging.getLogger(__name__)
+
+# Results of completed jobs, keyed by a hash of the normalized input, the options that
+# affect the output and the library versions. Entries point at the job that produced
+# them; the result itself is copied under {temp}/cache so it outlives that job's files.
+_INDEX_KEY = "result-cache:index"
+
+
+def _entry_key(key: str) -> str:
+    return f"result-cache:{key}"
+
+
+def cache_key(input_hash: str, opts: AnalysisOptions, settings: Settings) -> str:
+    payload = {
+        "input": input_hash,
+        "externalIdColumn": opts.external_id_column,
+        "unitType": opts.unit_type,
+        "nationalCodes": opts.national_codes,
+        "geometryAuditTrail": opts.geometry_audit_trail,
+        "openforisWhispVersion": settings.openforis_whisp_version,
+        "earthengineApiVersion": settings.earthengine_api_version,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+async def lookup(key: str, token: str, settings: Settings) -> str | None:
+    # On a hit the cached result is copied to the result file of `token` and the id of the
+    # job that produced it is returned.
+    if settings.result_cache_ttl_seconds <= 0:
+        return None
+    try:
+        source = await client().get(_entry_key(key))
+        if source is not None:
+            await asyncio.to_thread(
+                files.atomic_copy, files.cached_result_path(key, settings), files.result_path(token, settings)
+            )
+    except FileNotFoundError:
+        source = None
+    except Exception:
+        logger.exception("result cache lookup failed")
+        source = None
+    RESULT_CACHE_LOOKUPS.labels(result="miss" if source is None else "hit").inc()
+    return source
+
+
+def _evict(r, settings: Settings, now: float) -> None:
+    expired = r.zrangebyscore(_INDEX_KEY, "-inf", now - settings.result_cache_ttl_seconds)
+    overflow = r.zcard(_INDEX_KEY) - len(expired) - settings.result_cache_max_entries
+    if overflow > 0:
+        expired += r.zrange(_INDEX_KEY, len(expired), len(expired) + overflow - 1)
+    if not expired:
+        return
+    for key in expired:
+        files.cached_result_path(key, settings).unlink(missing_ok=True)
+    pipe = r.pipeline()
+    pipe.zrem(_INDEX_KEY, *expired)
+    pipe.delete(*(_entry_key(key) for key in expired))
+    pipe.execute()
+
+
+def store(key: str, token: str, settings: Settings) -> None:
+    if settings.result_cache_ttl_seconds <= 0:
+        return
+    try:
+        files.atomic_copy(files.result_path(token, settings), files.cached_result_path(key, settings))
+        r = sync_client()
+        now = time.time()
+        pipe = r.pipeline()
+        pipe.set(_entry_key(key), token, ex=settings.result_cache_ttl_seconds)
+        pipe.zadd(_INDEX_KEY, {key: now})
+        pipe.execute()
+        _evict(r, settings, now)
+    except Exception:
+        logger.exception("result cache store failed for job %s", token)
@@ -1,12 +1,17 @@
+import hashlib
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
 from fastapi import APIRouter, Depends, Header, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
 
 from src.auth.api_key import ApiKey, api_key_dependency
 from src.codes import SystemCode
 from src.config import Settings, SettingsDep
+from src.db import jobs as db_jobs
 from src.exceptions import AppError
 from src.geoid import client as geoid
-from src.responses import api_response
+from src.responses import api_response, api_result_response
 from src.schemas import (
     SUBMIT_ERRORS,
     SUBMIT_GEOID_ERRORS,
@@ -14,10 +19,13 @@ from src.schemas import (
     SubmitGeoIdsRequest,
     SubmitWktRequest,
     route_responses,
+    streamed_request_body,
 )
-from src.submit import service
-from src.submit import validators as v
-from src.submit.schemas import AnalysisOptions, JobContext
+from src.submit import idempotency, service
+from src.submit.executor import get_validation_pool
+from src.submit.ingest import receive_body
+from src.submit.prepare import PreparedSubmission, prepare_feature_collection, prepare_geojson, prepare_wkt
+from src.submit.schemas import AnalysisOptions, JobContext, SubmitResult
 
 router = APIRouter(prefix="/submit", tags=["submit"])
 
@@ -44,25 +52,60 @@ def _check_request_size(request: Request, settings: Settings) -> None:
         )
 
 
-async def _read_json(request: Request, settings: Settings) -> dict:
-    body_size = _request_body_size(request)
-    if body_size == 0:
-        raise AppError(SystemCode.VALIDATION_MISSING_REQUEST_BODY)
+async def _body_digest(request: Request) -> str:
+    # the JSON body was already read (and cached) to build the request model
+    return hashlib.sha256(await request.body()).hexdigest()
 
-    max_bytes = settings.max_request_body_size_bytes
-    if max_bytes is not None and body_size > max_bytes:
-        raise AppError(
-            SystemCode.VALIDATION_REQUEST_BODY_TOO_LARGE,
-            [f"{body_size / 1024:.2f}", f"{max_bytes / 1024:.2f}"],
-        )
 
+async def _job_exists(token: str) -> bool:
     try:
-        body = await request.json()
+        return await db_jobs.get_job(token) is not None
     except Exception:
-        raise AppError(SystemCode.VALIDATION_MISSING_REQUEST_BODY)
-    if not isinstance(body, dict):
-        raise AppError(SystemCode.VALIDATION_MISSING_REQUEST_BODY)
-    return body
+        return False
+
+
+async def _respond(result: SubmitResult) -> Response:
+    if result.result is None:
+        return api_response(result.code, data=result.data, context=result.context)
+    response = await api_result_response(result.code, result.result, context=result.context)
+    if response is None:
+        return api_response(SystemCode.ANALYSIS_JOB_NOT_FOUND)
+    return response
+
+
+async def _submit(
+    request: Request,
+    api_key: ApiKey,
+    settings: Settings,
+    token: str,
+    prepare: Callable[[], Awaitable[PreparedSubmission]],
+    *,
+    idempotency_key: str | None = None,
+    body_digest: str = "",
+) -> Response:
+    ctx = _build_context(request, api_key)
+    if idempotency_key is None:
+        result = await service.submit(token, await prepare(), ctx, settings)
+        return await _respond(result)
+
+    fingerprint = idempotency.fingerprint(request.url.path, body_digest)
+    original = await idempotency.reserve(api_key.key_id, idempotency_key, fingerprint, token, settings)
+    if original is not None:
+        result = await service.replay(original, ctx, settings)
+        return await _respond(result)
+
+    created = False
+    try:
+        prepared = await prepare()
+        result = await service.submit(token, prepared, ctx, settings)
+        created = True
+    except BaseException:
+        # a request that failed before its job existed can be retried with the same key
+        created = await _job_exists(token)
+        raise
+    finally:
+        await idempotency.settle(api_key.key_id, idempotency_key, token, created=created, settings=settings)
+    return await _respond(result)
 
 
 def _build_context(request: Request, api_key: ApiKey) -> JobContext:
@@ -90,42 +133,32 @@ def _build_context(request: Request, api_key: ApiKey) -> JobContext:
         SystemCode.ANALYSIS_QUEUED,
         *SUBMIT_ERRORS,
     ),
+    openapi_extra=streamed_request_body(SubmitGeoJsonRequest),
 )
 async def submit_geojson(
     request: Request,
-    body: SubmitGeoJsonRequest,
     settings: SettingsDep,
     api_key: ApiKey = Depends(api_key_dependency),
-) -> JSONResponse:
-    _check_request_size(request, settings)
+    idempotency_key: str | None = Header(default=None, alias="idempotency-key"),
+) -> Response:
+    # The body is parsed feature by feature and written straight to the worker input file;
+    # bodies too large to validate inline are spooled to disk and parsed on the validation pool.
+    key = idempotency.check_key(idempotency_key)
+    digest = hashlib.sha256() if key else None
+    token = service.new_token()
+    body = await receive_body(request, token, settings, digest=digest)
 
-    raw_options = body.analysisOptions
-    fc_dict = body.model_dump(exclude={"analysisOptions"})
+    async def prepare() -> PreparedSubmission:
+        return await get_validation_pool().run(prepare_geojson, body, token, settings, inline=isinstance(body, bytes))
 
-    errors = v.validate_geojson_structure(fc_dict)
-    if errors:
-        raise AppError(
-            SystemCode.VALIDATION_INVALID_GEOJSON,
-            ["\n".join(f"- {e}" for e in errors)],
+    try:
+        return await _submit(
+            request, api_key, settings, token, prepare,
+            idempotency_key=key, body_digest=digest.hexdigest() if digest else "",
         )
-
-    ok, _ = v.validate_crs(fc_dict)
-    if not ok:
-        raise AppError(SystemCode.VALIDATION_INVALID_CRS)
-    if v.coordinates_likely_in_meters(fc_dict):
-        raise AppError(SystemCode.VALIDATION_COORDINATES_IN_METERS)
-    if not v.is_valid_wgs84(fc_dict):
-        raise AppError(SystemCode.VALIDATION_INVALID_COORDINATES)
-
-    fc = v.to_feature_collection(fc_dict)
-    opts = AnalysisOptions.parse(raw_options.model_dump(by_alias=True) if raw_options else None)
-    input_metrics = service.validate_feature_collection(fc, opts, settings)
-
-    ctx = _build_context(request, api_key)
-
-    token = service.new_token()
-    result = await service.submit(token, fc, opts, ctx, settings, input_metrics=input_metrics)
-    return api_response(result.code, data=result.data, context=result.context)
+    finally:
+        if isinstance(body, Path):
+            body.unlink(missing_ok=True)
 
 
 @router.post(
@@ -142,31 +175,26 @@ async def submit_wkt(
     body: SubmitWktRequest,
     settings: SettingsDep,
     api_key: ApiKey = Depends(api_key_dependency),
-) -> JSONResponse:
+    idempotency_key: str | None = Header(default=None, alias="idempotency-key"),
+) -> Response:
     _check_request_size(request, settings)
-
-    geom = v.wkt_to_geojson(body.wkt)
-    if geom is None:
-        raise AppError(SystemCode.VALIDATION_INVALID_WKT)
-    if v.coordinates_likely_in_meters(geom):
-        raise AppError(SystemCode.VALIDATION_COORDINATES_IN_METERS)
-    if not v.is_valid_wgs84(geom):
-        raise AppError(SystemCode.VALIDATION_INVALID_COORDINATES)
-
-    fc = v.wkt_to_feature_collection(body.wkt)
-    if fc is None:
-        raise AppError(SystemCode.VALIDATION_INVALID_WKT)
+    key = idempotency.check_key(idempotency_key)
 
     opts = AnalysisOptions.parse(
         body.analysisOptions.model_dump(by_alias=True) if body.analysisOptions else None
     )
-    input_metrics = service.validate_feature_collection(fc, opts, settings)
+    token = service.new_token()
 
-    ctx = _build_context(request, api_key)
+    async def prepare() -> PreparedSubmission:
+        return await get_validation_pool().run(
+            prepare_wkt, body.wkt, opts, token, settings,
+            inline=len(body.wkt) <= settings.validation_inline_max_bytes,
+        )
 
-    token = service.new_token()
-    result = await service.submit(token, fc, opts, ctx, settings, input_metrics=input_metrics)
-    return api_response(result.code, data=result.data, context=result.context)
+    return await _submit(
+        request, api_key, settings, token, prepare,
+        idempotency_key=key, body_digest=await _body_digest(request) if key else "",
+    )
 
 
 @router.post(
@@ -184,27 +212,32 @@ async def submit_geo_ids(
     settings: SettingsDep,
     api_key: ApiKey = Depends(api_key_dependency),
     x_geoid_token: str | None = Header(default=None, alias="x-geoid-token"),
-) -> JSONResponse:
+    idempotency_key: str | None = Header(default=None, alias="idempotency-key"),
+) -> Response:
     _check_request_size(request, settings)
+    key = idempotency.check_key(idempotency_key)
 
     raw_options = body.analysisOptions.model_dump(by_alias=True) if body.analysisOptions else {}
     raw_options.setdefault("externalIdColumn", "geoid")
     opts = AnalysisOptions.parse(raw_options)
+    token = service.new_token()
 
-    resolved = await geoid.resolve_geo_ids(body.geoIds, settings, token=x_geoid_token)
-
-    missing = [gid for gid, feat in zip(body.geoIds, resolved) if feat is None]
-    if missing:
-        raise AppError(
-            SystemCode.VALIDATION_GEO_ID_NOT_FOUND,
-            cause="The following GeoIDs were not found:\n" + "\n".join(missing),
-        )
+    async def prepare() -> PreparedSubmission:
+        resolved = await geoid.resolve_geo_ids(body.geoIds, settings, token=x_geoid_token)
 
-    fc = {"type": "FeatureCollection", "features": [f for f in resolved if f is not None]}
-    input_metrics = service.validate_feature_collection(fc, opts, settings)
+        missing = [gid for gid, feat in zip(body.geoIds, resolved) if feat is None]
+        if missing:
+            raise AppError(
+                SystemCode.VALIDATION_GEO_ID_NOT_FOUND,
+                cause="The following GeoIDs were not found:\n" + "\n".join(missing),
+            )
 
-    ctx = _build_context(request, api_key)
+        fc = {"type": "FeatureCollection", "features": [f for f in resolved if f is not None]}
+        return await get_validation_pool().run(
+            prepare_feature_collection, fc, opts, token, settings, inline=len(body.geoIds) == 1
+        )
 
-    token = service.new_token()
-    result = await service.submit(token, fc, opts, ctx, settings, input_metrics=input_metrics)
-    return api_response(result.code, data=result.data, context=result.context)
+    return await _submit(
+        request, api_key, settings, token, prepare,
+        idempotency_key=key, body_digest=await _body_digest(request) if key else "",
+    )
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from pathlib import Path
 
 from src.codes import SystemCode
 
@@ -31,6 +32,10 @@ class AnalysisTaskContext:
     user_id: int | None = None
     api_key_id: int | None = None
     input_metrics: dict | None = None
+    cache_key: str | None = None
+    # set on the shard tasks of a split job
+    shard_count: int | None = None
+    deadline: float | None = None
 
     @classmethod
     def parse(cls, raw: dict) -> "AnalysisTaskContext":
@@ -40,6 +45,9 @@ class AnalysisTaskContext:
             user_id=raw.get("user_id"),
             api_key_id=raw.get("api_key_id"),
             input_metrics=raw.get("input_metrics"),
+            cache_key=raw.get("cache_key"),
+            shard_count=raw.get("shard_count"),
+            deadline=raw.get("deadline"),
         )
 
     @property
@@ -65,6 +73,8 @@ class SubmitResult:
     code: SystemCode
     data: dict | None = None
     context: dict | None = None
+    # a result file sent as data, without being parsed (see src.responses.api_result_response)
+    result: Path | None = None
 
 
 @dataclass
@@ -1,81 +1,45 @@
+import asyncio
 import logging
 import uuid
 from dataclasses import asdict
 
-from src.codes import SystemCode, TERMINAL_STATUSES
+from src.codes import RUNNING_STATUSES, SystemCode, TERMINAL_STATUSES
 from src.config import Settings
 from src.db import jobs as db_jobs
 from src.exceptions import AppError
 from src.io import files
 from src.job_progress import JobProgress, timestamped
-from src.redis import publish, wait_for
-from src.submit.schemas import AnalysisOptions, AnalysisTaskContext, JobContext, SubmitResult
-from src.submit.validators import count_individual_polygons, get_common_property_names, validate_external_id_column
+from src.redis import get, publish, wait_for
+from src.submit import inflight, queue_index, result_cache
+from src.submit.direct_lane import DirectLane, get_direct_lane
+from src.submit.prepare import PreparedSubmission, options_payload
+from src.submit.schemas import AnalysisTaskContext, JobContext, SubmitResult
 from src.worker.celery_app import app as celery_app
+from src.worker import batching
 from src.worker.analysis_task import AnalysisTask
 
 logger = logging.getLogger(__name__)
 
+# results of the direct lane cached after their response
+_background: set[asyncio.Task] = set()
+
 
 def new_token() -> str:
     return str(uuid.uuid4())
 
 
-def validate_feature_collection(fc: dict, opts: AnalysisOptions, settings: Settings) -> dict:
-    import openforis_whisp as whisp
-
-    features = fc.get("features") or []
-    if not features:
-        raise AppError(SystemCode.VALIDATION_MISSING_REQUEST_BODY)
-
-    # whisp.analyze_geojson counts features, not individual polygons inside multipolygons.
-    # TODO: align this in the whisp library so we can use its count directly.
-    polygon_count = count_individual_polygons(fc)
-    limit = settings.geometry_limit_async if opts.async_mode else settings.geometry_limit_sync
-    if polygon_count > limit:
-        raise AppError(SystemCode.VALIDATION_TOO_MANY_GEOMETRIES, [limit])
-
-    if opts.external_id_column and not validate_external_id_column(fc, opts.external_id_column):
-        raise AppError(
-            SystemCode.VALIDATION_INVALID_EXTERNAL_ID_COLUMN,
-            [opts.external_id_column, ", ".join(get_common_property_names(fc))],
-        )
-
-    try:
-        metrics = whisp.analyze_geojson(fc)
-    except Exception as e:
-        logger.warning("analyze_geojson failed, falling back to count-only metrics: %s", e)
-        metrics = {"count": polygon_count}
-    return metrics
-
-
-def _options_payload(opts: AnalysisOptions) -> dict:
-    payload: dict = {}
-    if opts.external_id_column:
-        payload["externalIdColumn"] = opts.external_id_column
-    if opts.unit_type:
-        payload["unitType"] = opts.unit_type
-    if opts.national_codes:
-        payload["nationalCodes"] = opts.national_codes
-    if opts.async_mode:
-        payload["async"] = True
-    if opts.geometry_audit_trail:
-        payload["geometryAuditTrail"] = True
-    return payload
-
-
 def _is_terminal_event(event: dict) -> bool:
     return JobProgress.from_redis(event).status in TERMINAL_STATUSES
 
 
 def _completed_result(token: str, settings: Settings) -> SubmitResult:
-    data = files.load_completed_result(token, settings)
-    if data is None:
+    path = files.result_path(token, settings)
+    if not path.exists():
         raise AppError(SystemCode.ANALYSIS_JOB_NOT_FOUND)
     return SubmitResult(
         SystemCode.ANALYSIS_COMPLETED,
-        data=data,
         context={"token": token},
+        result=path,
     )
 
 
@@ -111,15 +75,8 @@ async def _wait_for_completion(token: str, timeout: int, settings: Settings) ->
     )
 
 
-async def submit(
-    token: str, fc: dict, opts: AnalysisOptions, ctx: JobContext, settings: Settings,
-    input_metrics: dict | None = None,
-) -> SubmitResult:
-    feature_count = (input_metrics or {}).get("count") or len(fc.get("features") or [])
-    timeout = settings.analysis_timeout_seconds(async_mode=opts.async_mode)
-    options_payload = _options_payload(opts)
-
-    queue_position = await db_jobs.create_analysis_job(
+def _job_kwargs(token: str, prepared: PreparedSubmission, ctx: JobContext, settings: Settings) -> dict:
+    return dict(
         job_id=token,
         api_key_id=ctx.api_key_id,
         user_id=ctx.user_id,
@@ -127,33 +84,291 @@ async def submit(
         ip_address=ctx.ip_address,
         api_version=settings.api_version,
         endpoint=ctx.endpoint,
-        feature_count=feature_count,
-        analysis_options=options_payload or None,
-        timeout_seconds=timeout,
-        status=SystemCode.ANALYSIS_QUEUED,
-        is_async=opts.async_mode,
+        feature_count=prepared.feature_count,
+        analysis_options=options_payload(prepared.opts) or None,
+        timeout_seconds=settings.analysis_timeout_seconds(async_mode=prepared.opts.async_mode),
         openforis_whisp_version=settings.openforis_whisp_version,
         earthengine_api_version=settings.earthengine_api_version,
-        max_concurrent_analyses=ctx.max_concurrent_analyses,
-        input_metrics=input_metrics,
+        input_metrics=prepared.input_metrics,
+    )
+
+
+def _accepted(token: str, feature_count: int, message: str) -> SubmitResult:
+    return SubmitResult(
+        SystemCode.ANALYSIS_QUEUED,
+        data={
+            "token": token,
+            "statusUrl": f"/api/status/{token}",
+            "featureCount": feature_count,
+            "processStatusMessages": [timestamped(message)],
+        },
+    )
+
+
+async def submit(token: str, prepared: PreparedSubmission, ctx: JobContext, settings: Settings) -> SubmitResult:
+    key = result_cache.cache_key(prepared.input_hash, prepared.opts, settings)
+    source = await result_cache.lookup(key, token, settings)
+    if source is not None:
+        files.input_path(token, settings).unlink(missing_ok=True)
+        return await _complete_from_cache(token, source, prepared, ctx, settings)
+
+    lane = get_direct_lane()
+    if ctx.agent != "ui" and lane.accepts(prepared.opts, prepared.feature_count):
+        return await _run_direct(token, key, prepared, ctx, lane, settings)
+
+    timeout = settings.analysis_timeout_seconds(async_mode=prepared.opts.async_mode)
+    primary = await inflight.claim(key, prepared.opts.async_mode, token, timeout)
+    if primary is not None:
+        files.input_path(token, settings).unlink(missing_ok=True)
+        return await _attach(token, primary, key, prepared, ctx, settings)
+    return await _enqueue(token, prepared, ctx, settings, cache_key=key)
+
+
+async def replay(token: str, ctx: JobContext, settings: Settings) -> SubmitResult:
+    # Response to a repeat of the request that created job `token` (same Idempotency-Key).
+    job = await db_jobs.get_job(token)
+    if job is None:
+        raise AppError(SystemCode.VALIDATION_IDEMPOTENCY_KEY_IN_USE)
+    state = JobProgress.from_db(job)
+    if state.async_mode or ctx.agent == "ui":
+        return _accepted(token, state.feature_count, "Returning the analysis of the original request")
+    timeout = job.get("timeout_seconds")
+    if state.status in TERMINAL_STATUSES:
+        return _raise_or_return_completed(token, state.status, state.error_message, settings, timeout=timeout)
+    return await _wait_for_completion(token, timeout, settings)
+
+
+async def _complete_from_cache(
+    token: str, source: str, prepared: PreparedSubmission, ctx: JobContext, settings: Settings
+) -> SubmitResult:
+    try:
+        # served without a worker, so it does not count against max_concurrent_analyses
+        await db_jobs.create_analysis_job(
+            **_job_kwargs(token, prepared, ctx, settings),
+            status=SystemCode.ANALYSIS_COMPLETED,
+            result_source="cache",
+            source_job_id=source,
+        )
+    except BaseException:
+        files.result_path(token, settings).unlink(missing_ok=True)
+        raise
+
+    message = "Result served from cache"
+    await publish(
+        token,
+        JobProgress.of(
+            SystemCode.ANALYSIS_COMPLETED,
+            percent=100,
+            feature_count=prepared.feature_count,
+            async_mode=prepared.opts.async_mode,
+            messages=[timestamped(message)],
+        ).to_redis(),
     )
+    logger.info("job %s served from cache of job %s", token, source)
 
-    queue_msg = f"Position {queue_position} in queue"
+    if prepared.opts.async_mode or ctx.agent == "ui":
+        return _accepted(token, prepared.feature_count, message)
+    return _completed_result(token, settings)
 
+
+async def _run_direct(
+    token: str, key: str, prepared: PreparedSubmission, ctx: JobContext, lane: DirectLane, settings: Settings
+) -> SubmitResult:
+    timeout = settings.analysis_timeout_sync_seconds
+    try:
+        # admitted as any other run of the user, against max_concurrent_analyses
+        await db_jobs.create_analysis_job(
+            **_job_kwargs(token, prepared, ctx, settings),
+            status=SystemCode.ANALYSIS_PROCESSING,
+            started_at=db_jobs.utc_now(),
+            max_concurrent_analyses=ctx.max_concurrent_analyses,
+        )
+    except BaseException:
+        files.input_path(token, settings).unlink(missing_ok=True)
+        raise
+
+    status, error_message, data = SystemCode.ANALYSIS_COMPLETED, None, None
+    try:
+        data = await lane.run(token, prepared.opts, timeout)
+    except TimeoutError:
+        status, error_message = SystemCode.ANALYSIS_TIMEOUT, SystemCode.ANALYSIS_TIMEOUT.format(timeout)
+    except Exception as e:
+        logger.exception("direct analysis failed for job %s", token)
+        status, error_message = SystemCode.ANALYSIS_ERROR, str(e)
+    except BaseException:
+        # the request was cancelled: the job ends with it, so it no longer counts as running
+        await asyncio.shield(db_jobs.finish_jobs([token], SystemCode.ANALYSIS_ERROR, "Request cancelled"))
+        raise
+
+    # a job ended meanwhile (cancelled, or by the stuck-job reaper) keeps its status, as in
+    # AnalysisTask.after_return
+    job = await db_jobs.get_job(token)
+    if _ended(job):
+        return _ended_direct(token, job, settings, timeout)
+    if data is not None:
+        await asyncio.to_thread(files.atomic_write_json, files.result_path(token, settings), data)
+    if not await db_jobs.finish_jobs([token], status, error_message):
+        files.result_path(token, settings).unlink(missing_ok=True)
+        return _ended_direct(token, await db_jobs.get_job(token), settings, timeout)
     await publish(
         token,
         JobProgress.of(
-            SystemCode.ANALYSIS_QUEUED,
-            feature_count=feature_count,
+            status,
+            percent=100 if data is not None else None,
+            error_message=error_message,
+            feature_count=prepared.feature_count,
+            async_mode=False,
+            messages=[timestamped("Analysed on the direct lane")],
+        ).to_redis(),
+    )
+
+    if data is None:
+        return _raise_or_return_completed(token, status, error_message, settings, timeout=timeout)
+    # only the result cache is filled after the response
+    task = asyncio.create_task(_cache_direct(token, key, settings))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return SubmitResult(SystemCode.ANALYSIS_COMPLETED, data=data, context={"token": token})
+
+
+def _ended(job: dict | None) -> bool:
+    return job is None or JobProgress.from_db(job).status in TERMINAL_STATUSES
+
+
+def _ended_direct(token: str, job: dict | None, settings: Settings, timeout: int) -> SubmitResult:
+    if job is None:
+        raise AppError(SystemCode.ANALYSIS_JOB_NOT_FOUND)
+    state = JobProgress.from_db(job)
+    return _raise_or_return_completed(token, state.status, state.error_message, settings, timeout=timeout)
+
+
+async def _cache_direct(token: str, key: str, settings: Settings) -> None:
+    try:
+        await asyncio.to_thread(result_cache.store, key, token, settings)
+    except Exception:
+        logger.exception("caching the result of direct job %s failed", token)
+
+
+async def _finish_followers(
+    primary: str, followers: list[str], status: SystemCode, error_message: str | None, settings: Settings
+) -> None:
+    if status == SystemCode.ANALYSIS_COMPLETED:
+        for token in followers:
+            await asyncio.to_thread(
+                files.atomic_copy, files.result_path(primary, settings), files.result_path(token, settings)
+            )
+    for token in await db_jobs.finish_followers(primary, followers, status, error_message):
+        await publish(token, JobProgress.of(status, error_message=error_message).to_redis())
+
+
+async def _attach(
+    token: str, primary: str, key: str, prepared: PreparedSubmission, ctx: JobContext, settings: Settings
+) -> SubmitResult:
+    opts = prepared.opts
+    job = _job_kwargs(token, prepared, ctx, settings)
+    try:
+        # runs on the worker slot of the primary, so it does not count against max_concurrent_analyses
+        await db_jobs.create_analysis_job(
+            **job,
+            status=SystemCode.ANALYSIS_QUEUED,
+            result_source=db_jobs.COALESCED,
+            source_job_id=primary,
+        )
+    except BaseException:
+        await inflight.detach(primary, token)
+        raise
+
+    message = "Attached to an identical analysis already in progress"
+    state = JobProgress.from_redis(await get(primary) or {"status": SystemCode.ANALYSIS_QUEUED.value})
+    if state.status == SystemCode.ANALYSIS_PROCESSING:
+        await db_jobs.start_followers(primary)
+    await publish(
+        token,
+        JobProgress.of(
+            state.status if state.status in RUNNING_STATUSES else SystemCode.ANALYSIS_QUEUED,
+            percent=state.percent,
+            feature_count=prepared.feature_count,
             async_mode=opts.async_mode,
-            messages=[timestamped(queue_msg)],
+            messages=[timestamped(message)],
         ).to_redis(),
     )
+    logger.info("job %s attached to job %s", token, primary)
+
+    # the primary resolves every follower it finds when it finishes; one that finished
+    # before this row existed is mirrored here
+    if not await inflight.holds(key, opts.async_mode, primary):
+        primary_job = await db_jobs.get_job(primary)
+        if primary_job is None:
+            await _finish_followers(
+                primary, [token], SystemCode.ANALYSIS_ERROR, "The attached analysis could not be queued", settings
+            )
+        else:
+            primary_state = JobProgress.from_db(primary_job)
+            if primary_state.status in TERMINAL_STATUSES:
+                await _finish_followers(primary, [token], primary_state.status, primary_state.error_message, settings)
+
+    if opts.async_mode or ctx.agent == "ui":
+        return _accepted(token, prepared.feature_count, message)
+    return await _wait_for_completion(token, job["timeout_seconds"], settings)
+
+
+async def _enqueue_batched(task_context: AnalysisTaskContext, prepared: PreparedSubmission, settings: Settings) -> bool:
+    # Small sync jobs run in a batch with the others submitted with the same options.
+    if not batching.eligible(prepared.opts, prepared.feature_count, settings):
+        return False
+    signature = batching.signature(prepared.opts)
+    try:
+        countdown = await batching.enqueue(signature, asdict(task_context), asdict(prepared.opts), settings)
+    except Exception:
+        logger.exception("batch enqueue failed for job %s", task_context.token)
+        return False
+    if countdown is not None:
+        celery_app.send_task(
+            "src.worker.tasks.run_analysis_batch",
+            args=[signature],
+            queue="sync",
+            countdown=countdown,
+        )
+    return True
+
 
-    payload = dict(fc)
-    if options_payload:
-        payload["analysisOptions"] = options_payload
-    files.atomic_write_json(files.input_path(token), payload)
+async def _enqueue(
+    token: str, prepared: PreparedSubmission, ctx: JobContext, settings: Settings, *, cache_key: str | None
+) -> SubmitResult:
+    opts = prepared.opts
+    job = _job_kwargs(token, prepared, ctx, settings)
+    timeout = job["timeout_seconds"]
+
+    try:
+        await db_jobs.create_analysis_job(
+            **job,
+            status=SystemCode.ANALYSIS_QUEUED,
+            max_concurrent_analyses=ctx.max_concurrent_analyses,
+        )
+    except BaseException:
+        files.input_path(token).unlink(missing_ok=True)
+        if cache_key:
+            await inflight.release(cache_key, opts.async_mode, token)
+            followers = await db_jobs.list_followers(token)
+            if followers:
+                await _finish_followers(
+                    token, followers, SystemCode.ANALYSIS_ERROR, "The attached analysis could not be queued", settings
+                )
+        raise
+
+    # the position is read from the queue index when a client asks; only the first one is sent
+    queue_position = await queue_index.add(token, opts.async_mode)
+    queue_msg = f"Position {queue_position} in queue" if queue_position else "Added to the queue"
+
+    await publish(
+        token,
+        JobProgress.of(
+            SystemCode.ANALYSIS_QUEUED,
+            feature_count=prepared.feature_count,
+            async_mode=opts.async_mode,
+            messages=[timestamped("Added to the queue")],
+        ).to_redis(),
+    )
 
     queue = "async" if opts.async_mode else "sync"
     task_context = AnalysisTaskContext(
@@ -161,25 +376,19 @@ async def submit(
         timeout=timeout,
         user_id=ctx.user_id,
         api_key_id=ctx.api_key_id,
-        input_metrics=input_metrics,
-    )
-    celery_app.send_task(
-        "src.worker.tasks.run_analysis",
-        args=[asdict(task_context), asdict(opts)],
-        queue=queue,
-        task_id=AnalysisTask.task_id_for(token),
-        time_limit=timeout,
+        input_metrics=prepared.input_metrics,
+        cache_key=cache_key,
     )
+    if not await _enqueue_batched(task_context, prepared, settings):
+        celery_app.send_task(
+            "src.worker.tasks.run_analysis",
+            args=[asdict(task_context), asdict(opts)],
+            queue=queue,
+            task_id=AnalysisTask.task_id_for(token),
+            time_limit=timeout,
+        )
 
     if opts.async_mode or ctx.agent == "ui":
-        return SubmitResult(
-            SystemCode.ANALYSIS_QUEUED,
-            data={
-                "token": token,
-                "statusUrl": f"/api/status/{token}",
-                "featureCount": feature_count,
-                "processStatusMessages": [timestamped(queue_msg)],
-            },
-        )
+        return _accepted(token, prepared.feature_count, queue_msg)
 
     return await _wait_for_completion(token, timeout, settings)
@@ -33,6 +33,10 @@ def validate_geojson_structure(obj: Any) -> list[str]:
     return [f'Unsupported or missing "type": {t!r}']
 
 
+def validate_feature_structure(feat: Any, index: int) -> list[str]:
+    return _check_feature(feat, f"features[{index}]")
+
+
 def _check_feature(feat: Any, prefix: str) -> list[str]:
     if not isinstance(feat, dict):
         return [f"{prefix} must be an object"]
@@ -69,126 +73,6 @@ def validate_crs(geojson: dict) -> tuple[bool, str]:
     return False, "Invalid CRS specification. Only EPSG:4326 is supported."
 
 
-def _iter_coords(geom: Any):
-    if not isinstance(geom, dict):
-        return
-    t, coords = geom.get("type"), geom.get("coordinates")
-    if t == "Point" and isinstance(coords, list):
-        yield coords
-    elif t in {"LineString", "MultiPoint"} and isinstance(coords, list):
-        yield from coords
-    elif t in {"Polygon", "MultiLineString"} and isinstance(coords, list):
-        for ring in coords:
-            yield from (ring or [])
-    elif t == "MultiPolygon" and isinstance(coords, list):
-        for poly in coords:
-            for ring in (poly or []):
-                yield from (ring or [])
-    elif t == "GeometryCollection":
-        for sub in geom.get("geometries", []) or []:
-            yield from _iter_coords(sub)
-    elif t == "Feature":
-        yield from _iter_coords(geom.get("geometry"))
-    elif t == "FeatureCollection":
-        for feat in geom.get("features", []) or []:
-            yield from _iter_coords(feat.get("geometry") if isinstance(feat, dict) else None)
-
-
-def is_valid_wgs84(geom: Any) -> bool:
-    for c in _iter_coords(geom):
-        if not isinstance(c, list) or len(c) < 2:
-            return False
-        lon, lat = c[0], c[1]
-        if not (isinstance(lon, (int, float)) and isinstance(lat, (int, float))):
-            return False
-        if not (-180 <= lon <= 180 and -90 <= lat <= 90):
-            return False
-    return True
-
-
-def coordinates_likely_in_meters(geom: Any) -> bool:
-    for c in _iter_coords(geom):
-        if isinstance(c, list) and len(c) >= 2:
-            x, y = c[0], c[1]
-            if isinstance(x, (int, float)) and isinstance(y, (int, float)):
-                if abs(x) > 180 or abs(y) > 90:
-                    return True
-    return False
-
-
-def _extract_features(node: Any, out: list[dict], props: dict | None = None) -> None:
-    if not isinstance(node, dict):
-        return
-    t = node.get("type")
-    p = props or {}
-    if t == "Polygon":
-        out.append({"type": "Feature", "properties": {**p}, "geometry": {
-            "type": "Polygon",
-            "coordinates": [[c[:2] for c in ring] for ring in node.get("coordinates", [])],
-        }})
-    elif t == "Point":
-        out.append({"type": "Feature", "properties": {**p}, "geometry": {
-            "type": "Point", "coordinates": (node.get("coordinates") or [])[:2],
-        }})
-    elif t == "MultiPoint":
-        for pt in node.get("coordinates", []) or []:
-            out.append({"type": "Feature", "properties": {**p}, "geometry": {"type": "Point", "coordinates": pt[:2]}})
-    elif t == "MultiPolygon":
-        out.append({"type": "Feature", "properties": {**p}, "geometry": {
-            "type": "MultiPolygon",
-            "coordinates": [[[c[:2] for c in ring] for ring in poly] for poly in node.get("coordinates", [])],
-        }})
-    elif t == "GeometryCollection":
-        for sub in node.get("geometries", []) or []:
-            _extract_features(sub, out, p)
-    elif t == "Feature":
-        _extract_features(node.get("geometry"), out, node.get("properties") or {})
-    elif t == "FeatureCollection":
-        for feat in node.get("features", []) or []:
-            _extract_features(feat, out)
-
-
-def count_individual_polygons(fc: dict) -> int:
-    total = 0
-    for feat in (fc.get("features") or []):
-        if not isinstance(feat, dict):
-            continue
-        geom = feat.get("geometry") or {}
-        if geom.get("type") == "MultiPolygon":
-            total += len(geom.get("coordinates") or [])
-        else:
-            total += 1
-    return total
-
-
-def to_feature_collection(geojson: Any) -> dict:
-    features: list[dict] = []
-    _extract_features(geojson, features)
-    return {"type": "FeatureCollection", "features": features}
-
-
-def get_common_property_names(fc: dict) -> list[str]:
-    features = fc.get("features") if isinstance(fc, dict) else None
-    if not isinstance(features, list):
-        return []
-    common: set[str] | None = None
-    for feat in features:
-        if not isinstance(feat, dict):
-            continue
-        props = list((feat.get("properties") or {}).keys())
-        common = set(props) if common is None else common & set(props)
-        if common is not None and not common:
-            break
-    return sorted(common or [])
-
-
-def validate_external_id_column(fc: dict, column: str) -> bool:
-    features = fc.get("features") if isinstance(fc, dict) else None
-    if not isinstance(features, list) or not features:
-        return False
-    return all(isinstance(f, dict) and column in (f.get("properties") or {}) for f in features)
-
-
 def wkt_to_geojson(wkt: str) -> dict | None:
     try:
         geom = shapely_wkt.loads(_WKT_DIMENSION.sub("", wkt))
@@ -197,10 +81,3 @@ def wkt_to_geojson(wkt: str) -> dict | None:
     # mapping() returns tuples; json round-trip coerces to lists
     return json.loads(json.dumps(mapping(geom)))
 
-
-def wkt_to_feature_collection(wkt: str) -> dict | None:
-    geom = wkt_to_geojson(wkt)
-    if geom is None:
-        return None
-    fc = to_feature_collection(geom)
-    return fc if fc.get("features") else None
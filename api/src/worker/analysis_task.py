@@ -1,4 +1,5 @@
 import logging
+import shutil
 
 from celery import Task
 from celery.exceptions import Ignore, TimeLimitExceeded
@@ -9,34 +10,65 @@ from src.app_logging import bind
 from src.codes import SystemCode
 from src.db import jobs as db_jobs
 from src.db.pool import run_sync
-from src.redis import get_sync, publish_sync
-from src.job_progress import JobProgress, timestamped
+from src.io import files
+from src.redis import publish_sync
+from src.job_progress import JobProgress
+from src.submit import inflight, queue_index
 from src.submit.schemas import AnalysisTaskContext
+from src.worker import cancellation, partial_results, progress_publisher, shards
+from src.worker.cancellation import AnalysisCancelled
 
 logger = logging.getLogger(__name__)
 
 
+def resolve_followers(
+    ctx: AnalysisTaskContext, async_mode: bool, status: SystemCode, error_message: str | None = None
+) -> None:
+    # Jobs attached to this run (see src.submit.inflight) get its outcome and result.
+    if not ctx.cache_key:
+        return
+    inflight.release_sync(ctx.cache_key, async_mode, ctx.token)
+    followers = run_sync(db_jobs.list_followers, ctx.token)
+    # the followers' progress of this run goes out before their outcome
+    progress_publisher.flush(ctx.token)
+    if not followers:
+        return
+    if status == SystemCode.ANALYSIS_COMPLETED:
+        for token in followers:
+            files.atomic_copy(files.result_path(ctx.token), files.result_path(token))
+    for token in run_sync(db_jobs.finish_followers, ctx.token, followers, status, error_message):
+        publish_sync(token, JobProgress.of(status, error_message=error_message).to_redis())
+    logger.info("resolved %d attached jobs", len(followers))
+
+
 class AnalysisRequest(Request):
     # TODO remove, this is temp workaround until Celery 5.7
     def on_timeout(self, soft, timeout):
         ctx = AnalysisTask._task_context(self.args, self.kwargs)
-        if ctx is not None and not self.task._already_terminal(ctx.token):
-            bind(
-                token=ctx.token,
-                user_id=ctx.user_id,
-                api_key_id=ctx.api_key_id,
-                input_metrics=ctx.input_metrics,
-            )
+        if ctx is not None:
             error_message = SystemCode.ANALYSIS_TIMEOUT.format(ctx.timeout)
-            self.task._persist_terminal(
-                ctx.token, SystemCode.ANALYSIS_TIMEOUT, error_message=error_message,
-            )
-            logger.warning("analysis timed out: %s", error_message)
+            if not self.task._already_terminal(ctx.token):
+                bind(
+                    token=ctx.token,
+                    user_id=ctx.user_id,
+                    api_key_id=ctx.api_key_id,
+                    input_metrics=ctx.input_metrics,
+                )
+                self.task._persist_terminal(
+                    ctx.token, SystemCode.ANALYSIS_TIMEOUT, error_message=error_message,
+                )
+                logger.warning("analysis timed out: %s", error_message)
+            self.task._resolve_followers(ctx, self.args, SystemCode.ANALYSIS_TIMEOUT, error_message)
+            self.task._abort_shards(ctx, self.args)
+            shutil.rmtree(files.checkpoint_dir(ctx.token), ignore_errors=True)
+            partial_results.clear_sync(ctx.token)
         super().on_timeout(soft, timeout)
 
 
 class AnalysisTask(Task):
     Request = AnalysisRequest
+    # logged without a traceback
+    throws = (AnalysisCancelled,)
 
     @classmethod
     def task_id_for(cls, token: str) -> str:
@@ -53,11 +85,40 @@ class AnalysisTask(Task):
         error_message: str | None = None,
     ) -> None:
         run_sync(db_jobs.update_analysis_job, token, status=status, completed_at=db_jobs.utc_now(), error_message=error_message)
+        queue_index.remove_sync(token)
+        progress_publisher.flush(token)
         publish_sync(
             token,
             JobProgress.of(status, error_message=error_message).to_redis(),
         )
 
+    @staticmethod
+    def _is_async(args: tuple) -> bool:
+        opts_dict = args[1] if len(args) > 1 and isinstance(args[1], dict) else {}
+        return bool(opts_dict.get("async_mode"))
+
+    def _resolve_followers(
+        self, ctx: AnalysisTaskContext, args: tuple, status: SystemCode, error_message: str | None = None
+    ) -> None:
+        resolve_followers(ctx, self._is_async(args), status, error_message)
+
+    def _abort_shards(self, ctx: AnalysisTaskContext, args: tuple, kill: bool = True) -> None:
+        # A failed or timed out shard ends the whole set: the other shards are revoked. On
+        # cancellation the running ones see the cancel flag and stop by themselves.
+        if not ctx.shard_count:
+            return
+        own = args[2] if len(args) > 2 else None
+        others = [shards.task_id(ctx.token, i) for i in range(ctx.shard_count) if i != own]
+        if kill:
+            self.app.control.revoke(others, terminate=True, signal="SIGKILL")
+        else:
+            self.app.control.revoke(others)
+        shards.clear(ctx.token)
+        for i in range(ctx.shard_count):
+            files.shard_input_path(ctx.token, i).unlink(missing_ok=True)
+            files.shard_stats_path(ctx.token, i).unlink(missing_ok=True)
+        files.shard_stats_path(ctx.token, "cached").unlink(missing_ok=True)
+
     def _already_terminal(self, token: str) -> bool:
         job = run_sync(db_jobs.get_job, token)
         if not job:
@@ -75,35 +136,33 @@ class AnalysisTask(Task):
         ctx = self._task_context(args, kwargs)
         if ctx is None:
             return
-        if self._already_terminal(ctx.token):
+        # a cancelled job still runs while attached jobs wait for its result
+        cancelled = self._already_terminal(ctx.token)
+        if cancelled and not run_sync(db_jobs.list_followers, ctx.token):
             raise Ignore()
+        if ctx.shard_count:
+            logger.info("starting shard %s of %d", args[2] if len(args) > 2 else "?", ctx.shard_count)
+            return
         logger.info("starting analysis...")
-        run_sync(
-            db_jobs.update_analysis_job,
-            ctx.token,
-            status=SystemCode.ANALYSIS_PROCESSING,
-            started_at=db_jobs.utc_now(),
-        )
-
-        opts_dict = args[1] if len(args) > 1 and isinstance(args[1], dict) else {}
-        is_async = bool(opts_dict.get("async_mode"))
-        for position, job in enumerate(run_sync(db_jobs.list_queued_jobs, is_async), start=1):
-            state = get_sync(job["id"]) or {}
-            publish_sync(
-                job["id"],
-                JobProgress.of(
-                    SystemCode.ANALYSIS_QUEUED,
-                    feature_count=job.get("feature_count"),
-                    async_mode=is_async,
-                    messages=[*(state.get("messages") or []), timestamped(f"Position {position} in queue")],
-                ).to_redis(),
+        # what a cancel of the job may have to kill (see src.status.service._stop_run)
+        cancellation.start_sync(ctx.token, task_id)
+        queue_index.remove_sync(ctx.token)
+        if not cancelled:
+            run_sync(
+                db_jobs.update_analysis_job,
+                ctx.token,
+                status=SystemCode.ANALYSIS_PROCESSING,
+                started_at=db_jobs.utc_now(),
             )
+        run_sync(db_jobs.start_followers, ctx.token)
 
     def on_failure(self, exc, task_id, args, kwargs, einfo):
         ctx = self._task_context(args, kwargs)
         timeout = ctx.timeout if ctx else None
 
-        if isinstance(exc, TimeLimitExceeded):
+        if isinstance(exc, AnalysisCancelled):
+            self._outcome = SystemCode.ANALYSIS_CANCELLED
+        elif isinstance(exc, TimeLimitExceeded):
             self._outcome = SystemCode.ANALYSIS_TIMEOUT
             self._error_message = SystemCode.ANALYSIS_TIMEOUT.format(timeout)
         else:
@@ -114,9 +173,9 @@ class AnalysisTask(Task):
 
     def after_return(self, status, retval, task_id, args, kwargs, einfo):
         ctx = self._task_context(args, kwargs)
-        token = ctx.token if ctx else None
-        if token is None or self._already_terminal(token):
+        if ctx is None:
             return
+        cancellation.acknowledge_sync(ctx.token, task_id)
 
         if status == SUCCESS:
             outcome = SystemCode.ANALYSIS_COMPLETED
@@ -124,4 +183,11 @@ class AnalysisTask(Task):
             outcome = self._outcome or SystemCode.ANALYSIS_ERROR
 
         error_message = self._error_message or None
-        self._persist_terminal(token, outcome, error_message=error_message)
+        if not self._already_terminal(ctx.token):
+            self._persist_terminal(ctx.token, outcome, error_message=error_message)
+        self._resolve_followers(ctx, args, outcome, error_message)
+        if outcome != SystemCode.ANALYSIS_COMPLETED:
+            self._abort_shards(ctx, args, kill=outcome != SystemCode.ANALYSIS_CANCELLED)
+        # kept only for a redelivery of a task that did not return (see tasks._analyse_checkpointed)
+        shutil.rmtree(files.checkpoint_dir(ctx.token), ignore_errors=True)
+        partial_results.clear_sync(ctx.token)
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import logging
+from dataclasses import asdict
+
+from src.config import Settings
+from src.redis import client, sync_client
+from src.submit.schemas import AnalysisOptions
+
+logger = logging.getLogger(__name__)
+
+# Micro-batching of small sync jobs. Jobs with the same options are queued in a Redis list
+# instead of getting a task each; the first one schedules a batch task after the window and
+# that task runs every job queued by then (up to the job and feature bounds) as one whisp call.
+
+
+def _queue_key(signature: str) -> str:
+    return f"batch:{signature}"
+
+
+def _scheduled_key(signature: str) -> str:
+    return f"batch:{signature}:scheduled"
+
+
+def signature(opts: AnalysisOptions) -> str:
+    # jobs share a whisp call only when they were submitted with the same options
+    payload = json.dumps(asdict(opts), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def eligible(opts: AnalysisOptions, feature_count: int, settings: Settings) -> bool:
+    return (
+        not opts.async_mode
+        and settings.sync_batch_window_ms > 0
+        and 0 < feature_count <= settings.sync_batch_job_features
+    )
+
+
+async def enqueue(signature: str, context: dict, opts_dict: dict, settings: Settings) -> float | None:
+    # Returns the countdown of the batch task to schedule, None when one is already scheduled.
+    ttl = settings.analysis_timeout_sync_seconds
+    r = client()
+    pipe = r.pipeline()
+    pipe.rpush(_queue_key(signature), json.dumps({"context": context, "opts": opts_dict}))
+    pipe.expire(_queue_key(signature), ttl)
+    pipe.set(_scheduled_key(signature), 1, nx=True, ex=ttl)
+    length, _, scheduled = await pipe.execute()
+    if scheduled:
+        return settings.sync_batch_window_ms / 1000
+    # a full batch does not wait for the window
+    if length == settings.sync_batch_max_jobs:
+        return 0
+    return None
+
+
+def take(signature: str, settings: Settings) -> tuple[list[dict], bool]:
+    # Pops the next batch; the flag is cleared first so a job queued meanwhile schedules a new task.
+    r = sync_client()
+    r.delete(_scheduled_key(signature))
+    jobs: list[dict] = []
+    features = 0
+    while len(jobs) < settings.sync_batch_max_jobs:
+        raw = r.lpop(_queue_key(signature))
+        if raw is None:
+            break
+        job = json.loads(raw)
+        count = (job["context"].get("input_metrics") or {}).get("count") or 0
+        if jobs and features + count > settings.sync_batch_max_features:
+            r.lpush(_queue_key(signature), raw)
+            break
+        jobs.append(job)
+        features += count
+    return jobs, r.llen(_queue_key(signature)) > 0
+
+
+def reschedule(signature: str, settings: Settings) -> bool:
+    # True when the caller has to schedule the task for the jobs left in the queue.
+    return bool(sync_client().set(_scheduled_key(signature), 1, nx=True, ex=settings.analysis_timeout_sync_seconds))
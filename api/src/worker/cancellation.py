@@ -0,0 +1,83 @@
+import logging
+import time
+
+from src.redis import client, sync_client
+
+logger = logging.getLogger(__name__)
+
+# Cooperative cancellation. The API sets a flag on the job; the worker checks it on each
+# whisp progress line, aborts with AnalysisCancelled and records each stopped task, so the
+# API only has to kill (and so restart) worker processes whose task did not stop in time.
+_FLAG_TTL_SECONDS = 24 * 3600
+
+_ACKNOWLEDGE = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  return 0
+end
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+
+class AnalysisCancelled(Exception):
+    pass
+
+
+class StopAnalysis(BaseException):
+    # Raised inside whisp, which takes any Exception from a batch for a failed batch and goes
+    # on with the others; the worker turns it into AnalysisCancelled (or a timeout, see
+    # tasks._shard_deadline) once out of whisp.
+    pass
+
+
+def _flag_key(token: str) -> str:
+    return f"cancel:{token}"
+
+
+def _stopped_key(token: str) -> str:
+    return f"cancel:{token}:stopped"
+
+
+def _started_key(token: str) -> str:
+    return f"cancel:{token}:started"
+
+
+async def request(token: str) -> None:
+    await client().set(_flag_key(token), time.time(), ex=_FLAG_TTL_SECONDS)
+
+
+async def stopped(token: str) -> set[str]:
+    return set(await client().smembers(_stopped_key(token)))
+
+
+async def started(token: str) -> list[str]:
+    # Analysis tasks of the job a worker started; none for batched and direct-lane jobs,
+    # which have no task of their own.
+    return sorted(await client().smembers(_started_key(token)))
+
+
+def requested_sync(token: str) -> bool:
+    try:
+        return bool(sync_client().exists(_flag_key(token)))
+    except Exception:
+        logger.exception("cancel flag lookup failed")
+        return False
+
+
+def start_sync(token: str, task_id: str) -> None:
+    try:
+        pipe = sync_client().pipeline()
+        pipe.sadd(_started_key(token), task_id)
+        pipe.expire(_started_key(token), _FLAG_TTL_SECONDS)
+        pipe.execute()
+    except Exception:
+        logger.exception("recording a started task failed")
+
+
+def acknowledge_sync(token: str, task_id: str) -> None:
+    # Records that a task of the job is no longer running, if the job was cancelled.
+    try:
+        sync_client().eval(_ACKNOWLEDGE, 2, _flag_key(token), _stopped_key(token), task_id, _FLAG_TTL_SECONDS)
+    except Exception:
+        logger.exception("cancel acknowledgement failed")
@@ -75,9 +75,7 @@ def _clear_task_log_context(**_):
     clear_context()
 
 
-@worker_init.connect
-@worker_process_init.connect
-def _init_worker(sender=None, **kwargs):
+def initialize_ee() -> None:
     import openforis_whisp as whisp
 
     high_vol = os.environ.get("EE_HIGH_VOL") == "1"
@@ -90,4 +88,10 @@ def _init_worker(sender=None, **kwargs):
     )
 
 
+@worker_init.connect
+@worker_process_init.connect
+def _init_worker(sender=None, **kwargs):
+    initialize_ee()
+
+
 import src.worker.tasks  # noqa: E402, F401 — register tasks
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import logging
+import time
+from typing import Any
+
+from src.config import Settings
+from src.redis import sync_client
+from src.submit.schemas import AnalysisOptions
+
+logger = logging.getLogger(__name__)
+
+# Formatted whisp statistics of single features (before whisp_risk, without plotId), keyed
+# by the geometry, the feature's external id, the options that change the statistics and
+# the library versions, so rows computed by another whisp or EE release are never read.
+_INDEX_KEY = "feature-cache:index"
+_BATCH = 500
+
+
+def _entry_key(key: str) -> str:
+    return f"feature-cache:{key}"
+
+
+def feature_keys(features: list[dict], opts: AnalysisOptions, settings: Settings) -> list[str]:
+    prefix = hashlib.sha256(
+        json.dumps(
+            {
+                "externalIdColumn": opts.external_id_column,
+                "unitType": opts.unit_type,
+                "nationalCodes": opts.national_codes,
+                "geometryAuditTrail": opts.geometry_audit_trail,
+                "openforisWhispVersion": settings.openforis_whisp_version,
+                "earthengineApiVersion": settings.earthengine_api_version,
+            },
+            sort_keys=True,
+        ).encode()
+    ).digest()
+    keys = []
+    for feature in features:
+        h = hashlib.sha256(prefix)
+        h.update(json.dumps(feature.get("geometry"), separators=(",", ":")).encode())
+        if opts.external_id_column:
+            external_id = (feature.get("properties") or {}).get(opts.external_id_column)
+            h.update(b"\0" + json.dumps(external_id, default=str).encode())
+        keys.append(h.hexdigest())
+    return keys
+
+
+def lookup(keys: list[str], settings: Settings) -> list[dict[str, Any] | None]:
+    if settings.feature_cache_ttl_seconds <= 0 or not keys:
+        return [None] * len(keys)
+    try:
+        r = sync_client()
+        raw: list[str | None] = []
+        for i in range(0, len(keys), _BATCH):
+            raw += r.mget([_entry_key(key) for key in keys[i:i + _BATCH]])
+        hits = [key for key, value in zip(keys, raw) if value is not None]
+        if hits:
+            # rows in use are refreshed so eviction drops the least recently used ones
+            now = time.time()
+            pipe = r.pipeline()
+            pipe.zadd(_INDEX_KEY, {key: now for key in hits})
+            for key in hits:
+                pipe.expire(_entry_key(key), settings.feature_cache_ttl_seconds)
+            pipe.execute()
+        return [json.loads(value) if value is not None else None for value in raw]
+    except Exception:
+        logger.exception("feature cache lookup failed")
+        return [None] * len(keys)
+
+
+def _evict(r, settings: Settings, now: float) -> None:
+    # expired entries are already gone, only their index members remain
+    r.zremrangebyscore(_INDEX_KEY, "-inf", now - settings.feature_cache_ttl_seconds)
+    overflow = r.zcard(_INDEX_KEY) - settings.feature_cache_max_entries
+    if overflow <= 0:
+        return
+    oldest = r.zrange(_INDEX_KEY, 0, overflow - 1)
+    for i in range(0, len(oldest), _BATCH):
+        batch = oldest[i:i + _BATCH]
+        pipe = r.pipeline()
+        pipe.zrem(_INDEX_KEY, *batch)
+        pipe.delete(*(_entry_key(key) for key in batch))
+        pipe.execute()
+
+
+def store(rows: dict[str, dict[str, Any]], settings: Settings) -> None:
+    if settings.feature_cache_ttl_seconds <= 0 or not rows:
+        return
+    try:
+        r = sync_client()
+        now = time.time()
+        items = list(rows.items())
+        for i in range(0, len(items), _BATCH):
+            pipe = r.pipeline()
+            for key, row in items[i:i + _BATCH]:
+                pipe.set(_entry_key(key), json.dumps(row, default=str), ex=settings.feature_cache_ttl_seconds)
+            pipe.zadd(_INDEX_KEY, {key: now for key, _ in items[i:i + _BATCH]})
+            pipe.execute()
+        _evict(r, settings, now)
+    except Exception:
+        logger.exception("feature cache store failed")
@@ -0,0 +1,65 @@
+import asyncio
+import json
+import logging
+import shutil
+from collections.abc import Callable
+from typing import Any
+
+from src.config import Settings
+from src.io import files
+from src.redis import client, sync_client
+
+logger = logging.getLogger(__name__)
+
+# Features of a running async job that are already analysed: each checkpointed chunk, shard
+# and the cached rows are written as a page of result features, and listed in arrival order
+# in Redis, so clients can read them while the job runs. Removed when the job ends, when
+# the result takes over.
+_MARGIN_SECONDS = 3600
+
+
+def _key(token: str) -> str:
+    return f"partial:{token}"
+
+
+def add_sync(token: str, name: str, build: Callable[[], list[dict]], settings: Settings) -> int | None:
+    # Stores the features returned by `build` and returns how many are available so far, or
+    # None when the part already exists (a redelivered task).
+    path = files.partial_dir(token, settings) / f"{name}.json"
+    if path.exists():
+        return None
+    features = build()
+    files.atomic_write_json(path, features)
+    pipe = sync_client().pipeline()
+    pipe.rpush(_key(token), json.dumps([name, len(features)]))
+    pipe.expire(_key(token), settings.analysis_timeout_async_seconds + _MARGIN_SECONDS)
+    pipe.lrange(_key(token), 0, -1)
+    _, _, parts = pipe.execute()
+    return sum(json.loads(part)[1] for part in parts)
+
+
+def clear_sync(token: str, settings: Settings | None = None) -> None:
+    try:
+        sync_client().delete(_key(token))
+    except Exception:
+        logger.exception("could not clear the partial results of job %s", token)
+    shutil.rmtree(files.partial_dir(token, settings), ignore_errors=True)
+
+
+async def page(token: str, offset: int, limit: int, settings: Settings) -> tuple[list[dict[str, Any]], int]:
+    # Features [offset, offset + limit) of the ones available, and how many are available.
+    parts = [json.loads(part) for part in await client().lrange(_key(token), 0, -1)]
+    features: list[dict[str, Any]] = []
+    start = 0
+    for name, count in parts:
+        if len(features) < limit and start + count > offset:
+            path = files.partial_dir(token, settings) / f"{name}.json"
+            try:
+                part = await asyncio.to_thread(files.read_json, path)
+            except FileNotFoundError:
+                # the job ended meanwhile
+                part = []
+            skip = max(offset - start, 0)
+            features.extend(part[skip:skip + limit - len(features)])
+        start += count
+    return features, start
@@ -0,0 +1,112 @@
+import logging
+import os
+import threading
+import time
+from typing import Any
+
+from src.config import get_settings
+from src.redis import publish_many_sync, sync_client
+from src.submit import inflight
+
+logger = logging.getLogger(__name__)
+
+# Progress events of the analyses in a worker process are merged per job and published by a
+# background thread, so whisp logging does not wait on Redis. Within a flush interval the
+# last value of each field wins and messages are appended, up to _MAX_PENDING_MESSAGES (the
+# oldest are dropped). Terminal events are not coalesced: callers flush() the job first and
+# then publish them directly.
+_MAX_PENDING_MESSAGES = 200
+# received vs published events, summed over all workers
+_COUNTERS_KEY = "progress_events"
+
+_pending: dict[str, dict[str, Any]] = {}
+_received = 0
+_pending_lock = threading.Lock()
+# held while sending, so a flush() returns only after earlier events of the job went out
+_send_lock = threading.Lock()
+_wake = threading.Event()
+_thread: threading.Thread | None = None
+_pid: int | None = None
+
+
+def _merge(into: dict[str, Any], data: dict[str, Any]) -> None:
+    into.update((k, v) for k, v in data.items() if k != "messages")
+    if data.get("messages"):
+        messages = into.setdefault("messages", [])
+        messages.extend(data["messages"])
+        del messages[:-_MAX_PENDING_MESSAGES]
+
+
+def _send(batch: dict[str, dict[str, Any]], received: int) -> None:
+    # progress also goes to the jobs attached to the run (see src.submit.inflight)
+    events = [
+        (member, data)
+        for token, data in batch.items()
+        for member in inflight.members_sync(token) or [token]
+    ]
+    publish_many_sync(events)
+    try:
+        pipe = sync_client().pipeline(transaction=False)
+        pipe.hincrby(_COUNTERS_KEY, "received", received)
+        pipe.hincrby(_COUNTERS_KEY, "published", len(events))
+        pipe.execute()
+    except Exception:
+        logger.warning("could not record progress event counts", exc_info=True)
+
+
+def _take(*tokens: str) -> tuple[dict[str, dict[str, Any]], int]:
+    global _received
+    with _pending_lock:
+        if tokens:
+            batch = {t: _pending.pop(t) for t in tokens if t in _pending}
+        else:
+            batch = dict(_pending)
+            _pending.clear()
+        received, _received = _received, 0
+    return batch, received
+
+
+def flush(*tokens: str) -> None:
+    # Publishes what is pending for these jobs (every job when none are given) now.
+    with _send_lock:
+        batch, received = _take(*tokens)
+        if batch or received:
+            _send(batch, received)
+
+
+def _run(interval: float) -> None:
+    while True:
+        _wake.wait()
+        _wake.clear()
+        try:
+            flush()
+        except Exception:
+            logger.exception("progress publisher failed")
+        # events arriving meanwhile wait for the next round
+        time.sleep(interval)
+
+
+def _ensure_thread(interval: float) -> None:
+    global _thread, _pid
+    # a forked pool process does not inherit the thread
+    if _thread is not None and _pid == os.getpid():
+        return
+    with _pending_lock:
+        if _thread is not None and _pid == os.getpid():
+            return
+        _pid = os.getpid()
+        _thread = threading.Thread(target=_run, args=(interval,), name="progress-publisher", daemon=True)
+        _thread.start()
+
+
+def publish(token: str, data: dict[str, Any]) -> None:
+    global _received
+    interval = get_settings().progress_publish_interval_ms / 1000
+    with _pending_lock:
+        _merge(_pending.setdefault(token, {}), data)
+        _received += 1
+    if interval <= 0:
+        flush(token)
+        return
+    _ensure_thread(interval)
+    _wake.set()
@@ -0,0 +1,100 @@
+import logging
+import math
+
+from src.config import Settings
+from src.redis import client, sync_client
+
+logger = logging.getLogger(__name__)
+
+# Join state of a job split into shard tasks. Celery runs without a result backend, so
+# instead of a chord the shard that completes the set (tracked in Redis) merges the results.
+
+
+def _key(token: str) -> str:
+    return f"shards:{token}"
+
+
+def _done_key(token: str) -> str:
+    return f"shards:{token}:done"
+
+
+def _progress_key(token: str) -> str:
+    return f"shards:{token}:progress"
+
+
+def _merge_key(token: str) -> str:
+    return f"shards:{token}:merged"
+
+
+def task_id(token: str, shard: int) -> str:
+    return f"analysis-{token}-shard-{shard}"
+
+
+def plan(pending: int, settings: Settings) -> list[tuple[int, int]]:
+    # (start, stop) ranges over the pending features; a single range means no sharding.
+    if settings.analysis_shard_features <= 0 or pending <= settings.analysis_shard_features:
+        return [(0, pending)]
+    count = min(settings.analysis_max_shards, math.ceil(pending / settings.analysis_shard_features))
+    size = math.ceil(pending / count)
+    return [(start, min(start + size, pending)) for start in range(0, pending, size)]
+
+
+def start(token: str, count: int, ttl: int) -> None:
+    r = sync_client()
+    pipe = r.pipeline()
+    pipe.delete(_done_key(token), _progress_key(token), _merge_key(token))
+    pipe.set(_key(token), count, ex=ttl)
+    pipe.hset(_progress_key(token), mapping={str(i): 0 for i in range(count)})
+    for key in (_done_key(token), _progress_key(token)):
+        pipe.expire(key, ttl)
+    pipe.execute()
+
+
+def progress(token: str, shard: int, percent: int) -> int:
+    # Records the percent of one shard and returns the percent of the whole set.
+    try:
+        r = sync_client()
+        pipe = r.pipeline()
+        pipe.hset(_progress_key(token), str(shard), percent)
+        pipe.hvals(_progress_key(token))
+        _, values = pipe.execute()
+        return sum(int(v) for v in values) // max(len(values), 1)
+    except Exception:
+        logger.exception("shard progress update failed")
+        return percent
+
+
+def finish(token: str, shard: int) -> bool:
+    # True for exactly one caller: the shard that completes the set.
+    r = sync_client()
+    pipe = r.pipeline(transaction=True)
+    pipe.sadd(_done_key(token), shard)
+    pipe.scard(_done_key(token))
+    pipe.get(_key(token))
+    _, done, count = pipe.execute()
+    if count is None or done < int(count):
+        return False
+    return bool(r.set(_merge_key(token), shard, nx=True, ex=3600))
+
+
+def clear(token: str) -> None:
+    sync_client().delete(_key(token), _done_key(token), _progress_key(token), _merge_key(token))
+
+
+async def shard_count(token: str) -> int:
+    try:
+        return int(await client().get(_key(token)) or 0)
+    except Exception:
+        logger.exception("shard lookup failed")
+        return 0
+
+
+async def unfinished(token: str) -> list[int]:
+    # shards of the set that have not finished yet
+    try:
+        count = int(await client().get(_key(token)) or 0)
+        done = {int(i) for i in await client().smembers(_done_key(token))}
+        return [i for i in range(count) if i not in done]
+    except Exception:
+        logger.exception("shard lookup failed")
+        return []
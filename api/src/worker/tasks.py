@@ -1,20 +1,39 @@
+import hashlib
+import json
 import logging
+import os
 import re
-from contextlib import redirect_stdout
+import shutil
+import signal
+import sys
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from dataclasses import dataclass
+from pathlib import Path
+from types import FrameType
 from typing import Any
 
 import numpy as np
 import pandas as pd
+from celery import group
+from celery.exceptions import Ignore, SoftTimeLimitExceeded, TimeLimitExceeded
 
 from src.codes import SystemCode
-from src.config import get_settings
+from src.config import Settings, get_settings
 from src.app_logging import resolve_level
-from src.redis import get_sync, publish_sync
+from src.db import jobs as db_jobs
+from src.db.pool import run_sync
+from src.redis import publish_sync
 from src.job_progress import JobProgress, timestamped
-from src.io import files
+from src.io import files, result_table
+from src.submit import queue_index, result_cache
 from src.submit.schemas import AnalysisOptions, AnalysisTaskContext
 from src.worker.celery_app import app
-from src.worker.analysis_task import AnalysisTask
+from src.worker import batching, cancellation, feature_cache, partial_results, progress_publisher, shards
+from src.worker.analysis_task import AnalysisTask, resolve_followers
+from src.worker.cancellation import AnalysisCancelled, StopAnalysis
 
 logger = logging.getLogger(__name__)
 logging.getLogger("whisp").propagate = False
@@ -22,43 +41,102 @@ logging.getLogger("whisp").propagate = False
 _SKIP_MESSAGE_PREFIX = "Mode:"
 _SKIP_MESSAGE_CONTAINS = "Concurrent processing + formatting + validation complete"
 _PROGRESS_RE = re.compile(r"Progress: [\d,]+/[\d,]+ batches \((\d+)%\)")
+_PLOT_ID = "plotId"
+_SHARD_STATE_MARGIN_SECONDS = 600
+_BATCH_KILL_MARGIN_SECONDS = 30
+
+
+def _publish(token: str, data: dict) -> None:
+    # coalesced with the other progress of the job; terminal events are published directly
+    progress_publisher.publish(token, data)
 
 
 class _ProgressHandler(logging.Handler):
-    def __init__(self, token: str, messages: list[str], feature_count: int | None = None, async_mode: bool | None = None):
+    # Publishes each whisp message, and the percent when it changes, as an event of the job.
+    def __init__(self, token: str, overall: Callable[[int], int] | None = None, cancellable: bool = True):
         super().__init__(level=resolve_level(get_settings().log_level))
         self.token = token
-        self._messages = messages
         self._last_percent = 0
-        self._feature_count = feature_count
-        self._async_mode = async_mode
+        # maps the percent of this run to the percent of the job (shards)
+        self._overall = overall
+        self._cancellable = cancellable
+        self.cancelled = False
+        # (index, count) of the chunk being analysed in a checkpointed run
+        self.chunk = (0, 1)
 
     def emit(self, record: logging.LogRecord):
         message = record.getMessage().strip()
         if message.startswith(_SKIP_MESSAGE_PREFIX) or _SKIP_MESSAGE_CONTAINS in message:
             return
 
-        self._messages.append(timestamped(message))
-
+        percent = None
         pm = _PROGRESS_RE.search(message)
         if pm:
-            self._last_percent = int(pm.group(1))
+            # progress lines come between whisp batches, where a cancelled job stops
+            if self._cancellable and cancellation.requested_sync(self.token):
+                self.cancelled = True
+                _cancel_queued_batches()
+                raise StopAnalysis()
+            percent = (self.chunk[0] * 100 + int(pm.group(1))) // self.chunk[1]
+            if self._overall is not None:
+                percent = self._overall(percent)
+            if percent == self._last_percent:
+                percent = None
+            else:
+                self._last_percent = percent
 
-        publish_sync(
+        _publish(
             self.token,
             JobProgress.of(
                 SystemCode.ANALYSIS_PROCESSING,
-                percent=self._last_percent,
-                feature_count=self._feature_count,
-                async_mode=self._async_mode,
-                messages=self._messages,
+                percent=percent,
+                messages=[timestamped(message)],
             ).to_redis(),
         )
 
 
-def _run_whisp_blocking(token: str, opts: AnalysisOptions, feature_count: int | None = None) -> None:
-    import openforis_whisp as whisp
+def _cancel_queued_batches(frame: FrameType | None = None) -> None:
+    # whisp waits for all its batches when leaving its thread pool, even on an exception: the
+    # batches not yet started are dropped from the pool of the whisp call on the stack.
+    frame = frame or sys._getframe(1)
+    while frame is not None:
+        if frame.f_globals.get("__name__", "").startswith("openforis_whisp"):
+            executor = frame.f_locals.get("executor")
+            if isinstance(executor, ThreadPoolExecutor):
+                executor.shutdown(wait=False, cancel_futures=True)
+                return
+        frame = frame.f_back
+
+
+@contextmanager
+def _whisp_progress(*handlers: _ProgressHandler) -> Iterator[None]:
+    whisp_logger = logging.getLogger("whisp")
+    removed = [h for h in whisp_logger.handlers if isinstance(h, logging.StreamHandler)]
+    for h in removed:
+        whisp_logger.removeHandler(h)
+    for handler in handlers:
+        whisp_logger.addHandler(handler)
+    try:
+        with redirect_stdout(None):
+            yield
+    except (Exception, StopAnalysis) as exc:
+        # once cancelled, whatever whisp ends with (e.g. the error of a batch it stopped) is
+        # the cancellation
+        if any(handler.cancelled for handler in handlers):
+            raise AnalysisCancelled() from exc
+        raise
+    else:
+        # raised from a whisp thread, the cancellation may not have reached this one
+        if any(handler.cancelled for handler in handlers):
+            raise AnalysisCancelled()
+    finally:
+        for handler in handlers:
+            whisp_logger.removeHandler(handler)
+        for h in removed:
+            whisp_logger.addHandler(h)
 
+
+def _df_kwargs(opts: AnalysisOptions) -> dict[str, Any]:
     df_kwargs: dict[str, Any] = {
         "mode": "concurrent" if opts.async_mode else "sequential",
     }
@@ -70,53 +148,521 @@ def _run_whisp_blocking(token: str, opts: AnalysisOptions, feature_count: int |
         df_kwargs["unit_type"] = opts.unit_type
     if opts.geometry_audit_trail:
         df_kwargs["geometry_audit_trail"] = True
+    return df_kwargs
+
 
-    state = get_sync(token) or {}
-    messages = [*(state.get("messages") or []), timestamped("Starting analysis")]
-    publish_sync(
+def _start_messages(token: str, opts: AnalysisOptions, feature_count: int | None, *lines: str) -> None:
+    _publish(
         token,
         JobProgress.of(
             SystemCode.ANALYSIS_PROCESSING,
             percent=0,
             feature_count=feature_count,
             async_mode=opts.async_mode,
-            messages=messages,
+            messages=[timestamped(line) for line in lines],
         ).to_redis(),
     )
 
-    handler = _ProgressHandler(token, messages, feature_count=feature_count, async_mode=opts.async_mode)
-    whisp_logger = logging.getLogger("whisp")
-    removed = [h for h in whisp_logger.handlers if isinstance(h, logging.StreamHandler)]
-    for h in removed:
-        whisp_logger.removeHandler(h)
-    whisp_logger.addHandler(handler)
+
+@dataclass
+class _Lookup:
+    # Input features with their feature cache keys and cached stats rows.
+    features: list[dict]
+    keys: list[str]
+    cached: list[dict | None]
+
+    @property
+    def pending(self) -> list[int]:
+        return [i for i, row in enumerate(self.cached) if row is None]
+
+    def cached_frame(self) -> pd.DataFrame | None:
+        rows = [{_PLOT_ID: str(i + 1), **row} for i, row in enumerate(self.cached) if row is not None]
+        return pd.DataFrame.from_records(rows).infer_objects() if rows else None
+
+
+def _lookup(token: str, opts: AnalysisOptions, settings: Settings) -> _Lookup:
+    features = files.read_json(files.input_path(token, settings)).get("features") or []
+    keys = feature_cache.feature_keys(features, opts, settings)
+    return _Lookup(features, keys, feature_cache.lookup(keys, settings))
+
+
+def _analyse(path: Path, positions: list[int], keys: list[str], df_kwargs: dict[str, Any], settings: Settings) -> pd.DataFrame:
+    # Formatted stats of the features in `path`, which are the input features at `positions`
+    # with feature cache `keys`.
+    import openforis_whisp as whisp
+
+    fresh = whisp.whisp_formatted_stats_geojson_to_df(str(path), **df_kwargs)
+    # whisp numbers the features it was given from 1, map them back to input positions
+    local = [int(pid) - 1 for pid in fresh[_PLOT_ID]]
+    fresh[_PLOT_ID] = [str(positions[j] + 1) for j in local]
+    feature_cache.store(
+        {keys[j]: {k: v for k, v in row.items() if k != _PLOT_ID} for j, row in zip(local, fresh.to_dict("records"))},
+        settings,
+    )
+    return fresh
+
+
+def _checkpointed(count: int, settings: Settings) -> bool:
+    return 0 < settings.analysis_checkpoint_features < count
+
+
+def _add_partial(token: str, name: str, frame: pd.DataFrame, opts: AnalysisOptions, settings: Settings) -> None:
+    # Best effort: the result of the job does not depend on it.
     try:
-        with redirect_stdout(None):
-            input_file = str(files.input_path(token))
-            stats_df = whisp.whisp_formatted_stats_geojson_to_df(input_file, **df_kwargs)
+        available = partial_results.add_sync(
+            token, name, lambda: _feature_collection(_risk_frame(frame.copy(), opts))["features"], settings
+        )
+    except Exception:
+        logger.exception("could not store partial results %s", name)
+        return
+    if available is not None:
+        _publish(token, JobProgress.of(SystemCode.ANALYSIS_PROCESSING, partial_features=available).to_redis())
+
+
+def _analyse_checkpointed(
+    token: str,
+    scope: str,
+    features: list[dict],
+    positions: list[int],
+    keys: list[str],
+    opts: AnalysisOptions,
+    settings: Settings,
+) -> pd.DataFrame:
+    # Like _analyse, for `features` (the input features at `positions`), in chunks. The stats of
+    # each finished chunk are kept under the job's checkpoint directory with a manifest, so a
+    # redelivered task (worker crash, eviction, deploy) only analyses the remaining chunks.
+    # Each chunk is also made available as partial results.
+    df_kwargs = _df_kwargs(opts)
+    size = settings.analysis_checkpoint_features
+    directory = files.checkpoint_dir(token, settings) / scope
+    manifest_path = directory / "manifest.json"
+    signature = hashlib.sha256(json.dumps([size, positions, keys]).encode()).hexdigest()
+    manifest = files.read_json(manifest_path) if manifest_path.exists() else {}
+    if manifest.get("signature") != signature:
+        shutil.rmtree(directory, ignore_errors=True)
+        manifest = {"signature": signature, "done": []}
+    chunks = [(start, min(start + size, len(positions))) for start in range(0, len(positions), size)]
+    done = {i for i in manifest["done"] if (directory / f"chunk-{i}.pkl").exists()}
+    if done:
+        _publish(
+            token,
+            JobProgress.of(
+                SystemCode.ANALYSIS_PROCESSING,
+                messages=[timestamped(f"Resuming: {len(done)} of {len(chunks)} chunks already analysed")],
+            ).to_redis(),
+        )
+
+    handlers = [h for h in logging.getLogger("whisp").handlers if isinstance(h, _ProgressHandler)]
+    overhead = 0.0
+    frames = []
+    for i, (start, stop) in enumerate(chunks):
+        stats_path = directory / f"chunk-{i}.pkl"
+        if i in done:
+            started = time.perf_counter()
+            frame = pd.read_pickle(stats_path)
+            overhead += time.perf_counter() - started
+            _add_partial(token, f"{scope}-{i}", frame, opts, settings)
+            frames.append(frame)
+            continue
+        for handler in handlers:
+            handler.chunk = (i, len(chunks))
+        chunk_path = directory / f"chunk-{i}.json"
+        files.atomic_write_json(chunk_path, {"type": "FeatureCollection", "features": features[start:stop]})
+        frame = _analyse(chunk_path, positions[start:stop], keys[start:stop], df_kwargs, settings)
+        chunk_path.unlink(missing_ok=True)
+
+        started = time.perf_counter()
+        tmp = stats_path.with_suffix(".tmp")
+        frame.to_pickle(tmp)
+        os.replace(tmp, stats_path)
+        manifest["done"].append(i)
+        files.atomic_write_json(manifest_path, manifest)
+        overhead += time.perf_counter() - started
+        _add_partial(token, f"{scope}-{i}", frame, opts, settings)
+        frames.append(frame)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    try:
+        run_sync(
+            db_jobs.add_analysis_metrics,
+            token,
+            {
+                "checkpoint" if scope == "run" else f"checkpoint_{scope}": {
+                    "chunks": len(chunks),
+                    "resumed_chunks": len(done),
+                    "overhead_seconds": round(overhead, 3),
+                }
+            },
+        )
+    except Exception:
+        logger.exception("could not record checkpoint metrics")
+    return pd.concat(frames, ignore_index=True)
+
+
+def _merge(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    stats_df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    order = stats_df[_PLOT_ID].astype(int).argsort(kind="stable")
+    return stats_df.iloc[order].reset_index(drop=True)
+
+
+def _whisp_risk(stats_df: pd.DataFrame, opts: AnalysisOptions) -> pd.DataFrame:
+    import openforis_whisp as whisp
+
+    return whisp.whisp_risk(
+        stats_df,
+        explicit_unit_type=opts.unit_type,
+        national_codes=opts.national_codes,
+    )
+
+
+def _risk_frame(stats_df: pd.DataFrame, opts: AnalysisOptions) -> pd.DataFrame:
+    return _json_safe(_whisp_risk(stats_df, opts))
+
 
-            risk_df = whisp.whisp_risk(
-                stats_df,
-                explicit_unit_type=opts.unit_type,
-                national_codes=opts.national_codes,
+def _json_safe(risk_df: pd.DataFrame) -> pd.DataFrame:
+    for col in risk_df.columns:
+        if pd.api.types.is_numeric_dtype(risk_df[col]):
+            risk_df[col] = risk_df[col].replace([np.nan, np.inf, -np.inf], None)
+        elif risk_df[col].dtype == "object":
+            risk_df[col] = risk_df[col].fillna("")
+    return risk_df
+
+
+def _write_geojson(token: str, risk_df: pd.DataFrame) -> None:
+    import openforis_whisp as whisp
+
+    result_file = str(files.result_path(token))
+    whisp.convert_df_to_geojson(risk_df, result_file)
+
+
+def _feature_collection(risk_df: pd.DataFrame) -> dict:
+    # in-memory equivalent of whisp.convert_df_to_geojson
+    features = []
+    for row in risk_df.to_dict("records"):
+        geometry = row.pop("geo")
+        features.append({
+            "type": "Feature",
+            "geometry": json.loads(geometry.replace("'", '"')) if isinstance(geometry, str) else geometry,
+            "properties": {k: None if np.ndim(v) == 0 and pd.isna(v) else v for k, v in row.items()},
+        })
+    return json.loads(json.dumps({"type": "FeatureCollection", "features": features}, default=_json_default))
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _write_result(token: str, stats_df: pd.DataFrame, opts: AnalysisOptions) -> None:
+    _write_risk(token, _whisp_risk(stats_df, opts))
+
+
+def _has_geometry(geo: Any) -> bool:
+    # what whisp.convert_df_to_geojson needs to write a row instead of skipping it
+    if not isinstance(geo, str):
+        return False
+    try:
+        json.loads(geo.replace("'", '"'))
+    except ValueError:
+        return False
+    return True
+
+
+def _write_risk(token: str, risk_df: pd.DataFrame) -> None:
+    # both copies hold the rows the GeoJSON can hold, so their counts and pages agree
+    kept = risk_df["geo"].map(_has_geometry)
+    if not kept.all():
+        logger.warning("leaving %d rows without a usable geometry out of the result", int((~kept).sum()))
+        risk_df = risk_df[kept].reset_index(drop=True)
+    # the columnar copy first: the GeoJSON marks the result as written
+    result_table.write(result_table.from_frame(risk_df), files.result_table_path(token))
+    _write_geojson(token, _json_safe(risk_df))
+
+
+def _stats(
+    lookup: _Lookup,
+    opts: AnalysisOptions,
+    pending_path: Path,
+    input_file: Path | None = None,
+    checkpoint: str | None = None,
+) -> pd.DataFrame:
+    # Stats of every feature of `lookup`: cached rows plus one whisp call for the others,
+    # read from `input_file` when none is cached and from `pending_path` otherwise. With the
+    # token of the job as `checkpoint`, many pending features are analysed in checkpointed chunks.
+    settings = get_settings()
+    pending = lookup.pending
+    cached = lookup.cached_frame()
+    frames = []
+    if checkpoint is not None and _checkpointed(len(pending), settings):
+        if cached is not None:
+            _add_partial(checkpoint, "cached", cached, opts, settings)
+        frames.append(
+            _analyse_checkpointed(
+                checkpoint,
+                "run",
+                [lookup.features[i] for i in pending],
+                pending,
+                [lookup.keys[i] for i in pending],
+                opts,
+                settings,
             )
+        )
+    elif pending or not lookup.features:
+        path = input_file if input_file is not None and len(pending) == len(lookup.features) else pending_path
+        if path != input_file:
+            files.atomic_write_json(path, {"type": "FeatureCollection", "features": [lookup.features[i] for i in pending]})
+        try:
+            keys = [lookup.keys[i] for i in pending]
+            frames.append(_analyse(path, pending, keys, _df_kwargs(opts), settings))
+        finally:
+            if path != input_file:
+                path.unlink(missing_ok=True)
+    if cached is not None:
+        frames.append(cached)
+    return _merge(frames)
 
-            for col in risk_df.columns:
-                if pd.api.types.is_numeric_dtype(risk_df[col]):
-                    risk_df[col] = risk_df[col].replace([np.nan, np.inf, -np.inf], None)
-                elif risk_df[col].dtype == "object":
-                    risk_df[col] = risk_df[col].fillna("")
 
-            result_file = str(files.result_path(token))
-            whisp.convert_df_to_geojson(risk_df, result_file)
-    finally:
-        whisp_logger.removeHandler(handler)
-        for h in removed:
-            whisp_logger.addHandler(h)
+def _run_whisp_blocking(
+    token: str, opts: AnalysisOptions, feature_count: int | None = None, lookup: _Lookup | None = None
+) -> None:
+    # Features already analysed with the same options are read from the feature cache;
+    # only the others are sent to whisp.
+    settings = get_settings()
+    lookup = lookup or _lookup(token, opts, settings)
+    pending = lookup.pending
+    lines = ["Starting analysis"]
+    if len(pending) < len(lookup.features):
+        lines.append(f"Reusing cached statistics for {len(lookup.features) - len(pending)} of {len(lookup.features)} features")
+    _start_messages(token, opts, feature_count, *lines)
+
+    handler = _ProgressHandler(token)
+    with _whisp_progress(handler):
+        stats_df = _stats(
+            lookup,
+            opts,
+            files.pending_input_path(token, settings),
+            input_file=files.input_path(token, settings),
+            checkpoint=token if opts.async_mode else None,
+        )
+        _write_result(token, stats_df, opts)
+
+
+def analyse_direct(token: str, opts_dict: dict) -> dict:
+    # Runs a tiny sync job in a process of the API direct lane (src.submit.direct_lane) and
+    # returns its result instead of writing it.
+    opts = AnalysisOptions(**opts_dict)
+    settings = get_settings()
+    lookup = _lookup(token, opts, settings)
+    with _whisp_progress():
+        stats_df = _stats(
+            lookup, opts, files.pending_input_path(token, settings), input_file=files.input_path(token, settings)
+        )
+        return _feature_collection(_risk_frame(stats_df, opts))
+
+
+def _dispatch_shards(
+    ctx: AnalysisTaskContext, context: dict, opts_dict: dict, lookup: _Lookup, ranges: list[tuple[int, int]]
+) -> None:
+    # Splits the pending features of a large job into shard tasks on the async queue; the
+    # shard that completes the set merges the results (see run_analysis_shard).
+    settings = get_settings()
+    token = ctx.token
+    pending = lookup.pending
+    cached = lookup.cached_frame()
+    if cached is not None:
+        cached.to_pickle(files.shard_stats_path(token, "cached", settings))
+        _add_partial(token, "cached", cached, AnalysisOptions(**opts_dict), settings)
+
+    # each shard stops at the deadline of the set (see _shard_deadline); its time limit only
+    # bounds a shard that does not
+    deadline = time.time() + ctx.timeout
+    shards.start(token, len(ranges), ctx.timeout + _SHARD_STATE_MARGIN_SECONDS)
+    signatures = []
+    for shard, (start, stop) in enumerate(ranges):
+        positions = pending[start:stop]
+        files.atomic_write_json(
+            files.shard_input_path(token, shard, settings),
+            {"type": "FeatureCollection", "features": [lookup.features[i] for i in positions]},
+        )
+        signatures.append(
+            run_analysis_shard.signature(
+                args=({**context, "deadline": deadline, "shard_count": len(ranges)}, opts_dict, shard, positions),
+                queue="async",
+                task_id=shards.task_id(token, shard),
+                time_limit=ctx.timeout,
+            )
+        )
+
+    lines = [f"Split into {len(ranges)} shards of up to {max(b - a for a, b in ranges)} features"]
+    if len(pending) < len(lookup.features):
+        lines.append(f"Reusing cached statistics for {len(lookup.features) - len(pending)} of {len(lookup.features)} features")
+    _start_messages(token, AnalysisOptions(**opts_dict), ctx.feature_count, *lines)
+    group(signatures).apply_async()
+    logger.info("dispatched %d shards", len(ranges))
 
 
 @app.task(base=AnalysisTask, bind=True, name="src.worker.tasks.run_analysis")
 def run_analysis(self: AnalysisTask, context: dict, opts_dict: dict) -> None:
     ctx = AnalysisTaskContext.parse(context)
     opts = AnalysisOptions(**opts_dict)
-    _run_whisp_blocking(ctx.token, opts, feature_count=ctx.feature_count)
+    settings = get_settings()
+    lookup = _lookup(ctx.token, opts, settings)
+    if opts.async_mode:
+        ranges = shards.plan(len(lookup.pending), settings)
+        if len(ranges) > 1:
+            _dispatch_shards(ctx, context, opts_dict, lookup, ranges)
+            # the job stays processing until its last shard finishes
+            raise Ignore()
+    _run_whisp_blocking(ctx.token, opts, feature_count=ctx.feature_count, lookup=lookup)
+    if ctx.cache_key:
+        result_cache.store(ctx.cache_key, ctx.token, settings)
+
+
+@contextmanager
+def _shard_deadline(ctx: AnalysisTaskContext) -> Iterator[None]:
+    # The timeout applies to the whole shard set, not to each shard: however long a shard
+    # waited in the queue, it stops at the deadline of the set, as a cancelled one does.
+    if ctx.deadline is None:
+        yield
+        return
+    remaining = ctx.deadline - time.time()
+    if remaining <= 0:
+        raise TimeLimitExceeded(ctx.timeout)
+    expired = False
+
+    def expire(signum: int, frame: FrameType | None) -> None:
+        nonlocal expired
+        expired = True
+        _cancel_queued_batches(frame)
+        raise StopAnalysis()
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, remaining)
+    try:
+        yield
+    except AnalysisCancelled:
+        raise
+    except (Exception, StopAnalysis) as exc:
+        if expired:
+            raise TimeLimitExceeded(ctx.timeout) from exc
+        raise
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+@app.task(base=AnalysisTask, bind=True, name="src.worker.tasks.run_analysis_shard")
+def run_analysis_shard(self: AnalysisTask, context: dict, opts_dict: dict, shard: int, positions: list[int]) -> None:
+    ctx = AnalysisTaskContext.parse(context)
+    opts = AnalysisOptions(**opts_dict)
+    settings = get_settings()
+    with _shard_deadline(ctx):
+        _run_shard(ctx, opts, shard, positions, settings)
+
+
+def _run_shard(
+    ctx: AnalysisTaskContext, opts: AnalysisOptions, shard: int, positions: list[int], settings: Settings
+) -> None:
+    token = ctx.token
+    path = files.shard_input_path(token, shard, settings)
+    features = files.read_json(path).get("features") or []
+    keys = feature_cache.feature_keys(features, opts, settings)
+    handler = _ProgressHandler(token, overall=lambda percent: shards.progress(token, shard, percent))
+    with _whisp_progress(handler):
+        if _checkpointed(len(positions), settings):
+            fresh = _analyse_checkpointed(token, f"shard-{shard}", features, positions, keys, opts, settings)
+        else:
+            fresh = _analyse(path, positions, keys, _df_kwargs(opts), settings)
+            _add_partial(token, f"shard-{shard}", fresh, opts, settings)
+    fresh.to_pickle(files.shard_stats_path(token, shard, settings))
+    path.unlink(missing_ok=True)
+
+    if not shards.finish(token, shard):
+        raise Ignore()
+
+    # last shard of the set: merge every shard with the cached rows
+    parts = [files.shard_stats_path(token, i, settings) for i in range(ctx.shard_count or 1)]
+    parts.append(files.shard_stats_path(token, "cached", settings))
+    frames = [pd.read_pickle(part) for part in parts if part.exists()]
+    with _whisp_progress(handler):
+        _write_result(token, _merge(frames), opts)
+    for part in parts:
+        part.unlink(missing_ok=True)
+    shards.clear(token)
+    if ctx.cache_key:
+        result_cache.store(ctx.cache_key, token, settings)
+
+
+def _run_batch(batch: list[AnalysisTaskContext], opts: AnalysisOptions, settings: Settings) -> None:
+    # The features of every job go to whisp together; the plotId of a row tells which job
+    # it belongs to, so the result is split back at the offsets of each job.
+    features: list[dict] = []
+    spans: list[tuple[int, int]] = []
+    for ctx in batch:
+        own = files.read_json(files.input_path(ctx.token, settings)).get("features") or []
+        spans.append((len(features), len(own)))
+        features.extend(own)
+    keys = feature_cache.feature_keys(features, opts, settings)
+    lookup = _Lookup(features, keys, feature_cache.lookup(keys, settings))
+
+    line = f"Starting analysis in a batch of {len(batch)} jobs"
+    for ctx in batch:
+        _start_messages(ctx.token, opts, ctx.feature_count, line)
+    # a cancelled member does not stop the jobs batched with it
+    handlers = [_ProgressHandler(ctx.token, cancellable=False) for ctx in batch]
+    with _whisp_progress(*handlers):
+        risk_df = _whisp_risk(_stats(lookup, opts, files.pending_input_path(batch[0].token, settings)), opts)
+        plot_ids = risk_df[_PLOT_ID].astype(int)
+        for ctx, (start, count) in zip(batch, spans):
+            rows = (plot_ids > start) & (plot_ids <= start + count)
+            part = risk_df[rows].reset_index(drop=True)
+            part[_PLOT_ID] = (plot_ids[rows] - start).astype(str).to_list()
+            _write_risk(ctx.token, part)
+    for ctx in batch:
+        if ctx.cache_key:
+            result_cache.store(ctx.cache_key, ctx.token, settings)
+
+
+@app.task(
+    bind=True,
+    name="src.worker.tasks.run_analysis_batch",
+    soft_time_limit=get_settings().analysis_timeout_sync_seconds,
+    time_limit=get_settings().analysis_timeout_sync_seconds + _BATCH_KILL_MARGIN_SECONDS,
+)
+def run_analysis_batch(self, signature: str) -> None:
+    settings = get_settings()
+    jobs, more = batching.take(signature, settings)
+    if more and batching.reschedule(signature, settings):
+        run_analysis_batch.apply_async(args=[signature], queue="sync")
+    if not jobs:
+        return
+
+    contexts = [AnalysisTaskContext.parse(job["context"]) for job in jobs]
+    opts = AnalysisOptions(**jobs[0]["opts"])
+    queue_index.remove_sync(*(ctx.token for ctx in contexts))
+    started = set(run_sync(db_jobs.start_jobs, [ctx.token for ctx in contexts]))
+    # a cancelled job still runs while attached jobs wait for its result
+    batch = [ctx for ctx in contexts if ctx.token in started or run_sync(db_jobs.list_followers, ctx.token)]
+    for ctx in batch:
+        run_sync(db_jobs.start_followers, ctx.token)
+    if not batch:
+        return
+    logger.info("starting batch of %d jobs", len(batch))
+
+    status, error_message = SystemCode.ANALYSIS_COMPLETED, None
+    try:
+        _run_batch(batch, opts, settings)
+    except SoftTimeLimitExceeded:
+        status = SystemCode.ANALYSIS_TIMEOUT
+        error_message = SystemCode.ANALYSIS_TIMEOUT.format(settings.analysis_timeout_sync_seconds)
+        logger.warning("batch timed out: %s", error_message)
+    except Exception as exc:
+        logger.exception("batch analysis failed")
+        status, error_message = SystemCode.ANALYSIS_ERROR, str(exc)
+
+    progress_publisher.flush(*(ctx.token for ctx in batch))
+    for token in run_sync(db_jobs.finish_jobs, [ctx.token for ctx in batch], status, error_message):
+        publish_sync(token, JobProgress.of(status, error_message=error_message).to_redis())
+    for ctx in batch:
+        resolve_followers(ctx, False, status, error_message)
@@ -1,8 +1,11 @@
 import { apiFetch } from '@/lib/server/api-client';
 
-export async function GET(_req: Request, { params }: { params: Promise<{ token: string }> }) {
+export async function GET(req: Request, { params }: { params: Promise<{ token: string }> }) {
   const { token } = await params;
-  const res = await apiFetch(`/status/${token}/stream`);
+  const lastEventId = req.headers.get('Last-Event-ID');
+  const res = await apiFetch(`/status/${token}/stream`, {
+    headers: lastEventId ? { 'Last-Event-ID': lastEventId } : undefined,
+  });
 
   if (!res.ok || !res.body) {
     return new Response(res.statusText, { status: res.status });
@@ -63,12 +63,14 @@ class AnalysisJobsService extends BaseCrudService<AnalysisJob, typeof analysisJo
              COUNT(*) FILTER (WHERE status = $5)                                            AS error_count,
              COUNT(*) FILTER (WHERE status = $6)                                            AS timeout_count,
              AVG(EXTRACT(EPOCH FROM (completed_at - started_at)) * 1000)
-               FILTER (WHERE status = $4 AND completed_at IS NOT NULL AND started_at IS NOT NULL) AS avg_run_ms,
+               FILTER (WHERE status = $4 AND completed_at IS NOT NULL AND started_at IS NOT NULL
+                       AND result_source IS NULL)                                            AS avg_run_ms,
              PERCENTILE_CONT(0.5) WITHIN GROUP (
                ORDER BY EXTRACT(EPOCH FROM (completed_at - started_at)) * 1000
-             ) FILTER (WHERE status = $4 AND completed_at IS NOT NULL AND started_at IS NOT NULL) AS p50_run_ms,
+             ) FILTER (WHERE status = $4 AND completed_at IS NOT NULL AND started_at IS NOT NULL
+                         AND result_source IS NULL)                                          AS p50_run_ms,
              AVG(EXTRACT(EPOCH FROM (started_at - created_at)) * 1000)
-               FILTER (WHERE started_at IS NOT NULL AND status <> $2)                       AS avg_queue_ms
+               FILTER (WHERE started_at IS NOT NULL AND status <> $2 AND result_source IS NULL) AS avg_queue_ms
            FROM user_jobs`,
           [userId, ...STATUS_ORDER]
         ),
@@ -20,4 +20,6 @@ export const analysisJobMapping = {
   endpoint:              { name: 'endpoint'                    },
   openforisWhispVersion: { name: 'openforis_whisp_version'    },
   earthengineApiVersion: { name: 'earthengine_api_version'    },
+  resultSource:          { name: 'result_source'               },
+  sourceJobId:           { name: 'source_job_id'               },
 } satisfies Partial<ColumnMapping<AnalysisJob>>;
@@ -14,6 +14,24 @@ export interface JobStatus {
 
 const TERMINAL = new Set(['analysis_completed', 'analysis_error', 'analysis_timeout', 'analysis_cancelled'])
 
+// Stream events after the first only carry what changed, and their messages are new ones.
+function mergeProgress(prev: JobStatus | null, next: JobStatus): JobStatus {
+  if (next.final || !prev?.data || !next.data) return next
+  const messages = [
+    ...((prev.data.processStatusMessages as string[] | undefined) ?? []),
+    ...((next.data.processStatusMessages as string[] | undefined) ?? []),
+  ]
+  return { ...next, data: { ...prev.data, ...next.data, processStatusMessages: messages } }
+}
+
+function eventData(chunk: string): string {
+  return chunk
+    .split('\n')
+    .filter((line) => line.startsWith('data:'))
+    .map((line) => line.slice(5).trim())
+    .join('\n')
+}
+
 export function useJobStatus({
   token,
   onCompleted,
@@ -59,12 +77,10 @@ export function useJobStatus({
           while ((idx = buffer.indexOf('\n\n')) !== -1) {
             const chunk = buffer.slice(0, idx)
             buffer = buffer.slice(idx + 2)
-            const line = chunk.trim()
-            if (!line.startsWith('data:')) continue
-            const json = line.slice(5).trim()
+            const json = eventData(chunk)
             if (!json) continue
             const data: JobStatus = JSON.parse(json)
-            setResponse(data)
+            setResponse((prev) => mergeProgress(prev, data))
             if (data.code === 'analysis_completed') {
               handleCompleted(data.data)
               controller.abort()
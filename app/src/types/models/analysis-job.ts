@@ -22,5 +22,7 @@ export interface AnalysisJob extends BaseModel {
   endpoint?: string;
   openforisWhispVersion?: string;
   earthengineApiVersion?: string;
+  resultSource?: 'cache' | 'coalesced';
+  sourceJobId?: string;
 }
 
@@ -0,0 +1,5 @@
+-- result_source is NULL for jobs analysed by a worker; 'cache' when the result was
+-- copied from the earlier job in source_job_id.
+ALTER TABLE analysis_jobs
+  ADD COLUMN IF NOT EXISTS result_source TEXT,
+  ADD COLUMN IF NOT EXISTS source_job_id UUID;
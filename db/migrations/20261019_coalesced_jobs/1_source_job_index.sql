@@ -0,0 +1,5 @@
+-- 'coalesced' jobs were attached to the still running job in source_job_id and get its
+-- outcome when it finishes, which looks them up by source_job_id.
+CREATE INDEX IF NOT EXISTS idx_analysis_jobs_source_job_id
+  ON analysis_jobs(source_job_id)
+  WHERE source_job_id IS NOT NULL;
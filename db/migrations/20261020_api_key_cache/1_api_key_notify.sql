@@ -0,0 +1,83 @@
+-- The API caches find_api_key results per process. Changes to a key or to the limits it
+-- resolves to are announced on the 'api_key_changes' channel: the payload is the SHA-256 of
+-- the API key (hex), never the key itself, as any role can listen on the channel; '*' when
+-- every cached key is affected.
+
+DROP FUNCTION IF EXISTS find_api_key(TEXT);
+
+CREATE OR REPLACE FUNCTION find_api_key(p_api_key TEXT)
+RETURNS TABLE (
+  id INT,
+  user_id INT,
+  user_email TEXT,
+  rate_limit_window_ms INT,
+  rate_limit_max_requests INT,
+  max_concurrent_analyses INT,
+  expires_at TIMESTAMPTZ
+) AS $$
+SELECT
+  ak.id,
+  ak.user_id,
+  u.email AS user_email,
+  COALESCE(ur.rate_limit_window_ms, rg.rate_limit_window_ms) AS rate_limit_window_ms,
+  COALESCE(ur.rate_limit_max_requests, rg.rate_limit_max_requests) AS rate_limit_max_requests,
+  COALESCE(ur.max_concurrent_analyses, rg.max_concurrent_analyses) AS max_concurrent_analyses,
+  ak.expires_at
+FROM api_keys ak
+INNER JOIN users u ON u.id = ak.user_id
+LEFT JOIN user_rate_limits ur ON ur.user_id = ak.user_id
+LEFT JOIN rate_limits_global rg ON rg.id = 1
+WHERE ak.api_key = p_api_key
+  AND ak.revoked = false
+  AND ak.expires_at > now();
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION api_key_digest(p_api_key TEXT) RETURNS TEXT AS $$
+SELECT encode(sha256(convert_to(p_api_key, 'UTF8')), 'hex');
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION notify_api_key_change() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP <> 'INSERT' THEN
+    PERFORM pg_notify('api_key_changes', api_key_digest(OLD.api_key));
+  END IF;
+  -- a new key clears a cached "invalid key" answer
+  IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.api_key IS DISTINCT FROM OLD.api_key) THEN
+    PERFORM pg_notify('api_key_changes', api_key_digest(NEW.api_key));
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_user_rate_limit_change() RETURNS trigger AS $$
+BEGIN
+  -- OLD is null on INSERT and NEW on DELETE
+  PERFORM pg_notify('api_key_changes', api_key_digest(ak.api_key))
+  FROM api_keys ak
+  WHERE ak.user_id IN (OLD.user_id, NEW.user_id)
+    AND ak.revoked = false;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_global_rate_limit_change() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('api_key_changes', '*');
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS api_keys_notify_change ON api_keys;
+CREATE TRIGGER api_keys_notify_change
+  AFTER INSERT OR UPDATE OR DELETE ON api_keys
+  FOR EACH ROW EXECUTE FUNCTION notify_api_key_change();
+
+DROP TRIGGER IF EXISTS user_rate_limits_notify_change ON user_rate_limits;
+CREATE TRIGGER user_rate_limits_notify_change
+  AFTER INSERT OR UPDATE OR DELETE ON user_rate_limits
+  FOR EACH ROW EXECUTE FUNCTION notify_user_rate_limit_change();
+
+DROP TRIGGER IF EXISTS rate_limits_global_notify_change ON rate_limits_global;
+CREATE TRIGGER rate_limits_global_notify_change
+  AFTER INSERT OR UPDATE OR DELETE ON rate_limits_global
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_global_rate_limit_change();
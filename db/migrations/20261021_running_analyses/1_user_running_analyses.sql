@@ -0,0 +1,120 @@
+-- Running (queued or processing) analyses per user, kept by a trigger on analysis_jobs so
+-- that admission against max_concurrent_analyses reads and locks one row instead of
+-- counting jobs. Coalesced jobs do not hold a worker slot and are not counted.
+CREATE TABLE IF NOT EXISTS user_running_analyses (
+  user_id INT PRIMARY KEY,
+  running INT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION count_running_analyses() RETURNS trigger AS $$
+DECLARE
+  _old_running BOOLEAN := FALSE;
+  _new_running BOOLEAN := FALSE;
+BEGIN
+  IF TG_OP <> 'INSERT' THEN
+    _old_running := COALESCE(
+      OLD.user_id IS NOT NULL
+        AND OLD.status IN ('analysis_queued', 'analysis_processing')
+        AND OLD.result_source IS DISTINCT FROM 'coalesced',
+      FALSE
+    );
+  END IF;
+  IF TG_OP <> 'DELETE' THEN
+    _new_running := COALESCE(
+      NEW.user_id IS NOT NULL
+        AND NEW.status IN ('analysis_queued', 'analysis_processing')
+        AND NEW.result_source IS DISTINCT FROM 'coalesced',
+      FALSE
+    );
+  END IF;
+
+  IF _old_running AND _new_running AND OLD.user_id = NEW.user_id THEN
+    RETURN NULL;
+  END IF;
+  IF _old_running THEN
+    UPDATE user_running_analyses SET running = GREATEST(running - 1, 0) WHERE user_id = OLD.user_id;
+  END IF;
+  IF _new_running THEN
+    INSERT INTO user_running_analyses (user_id, running) VALUES (NEW.user_id, 1)
+    ON CONFLICT (user_id) DO UPDATE SET running = user_running_analyses.running + 1;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS analysis_jobs_count_running ON analysis_jobs;
+CREATE TRIGGER analysis_jobs_count_running
+  AFTER INSERT OR DELETE OR UPDATE OF status, user_id, result_source ON analysis_jobs
+  FOR EACH ROW EXECUTE FUNCTION count_running_analyses();
+
+INSERT INTO user_running_analyses (user_id, running)
+SELECT user_id, COUNT(*)::int
+FROM analysis_jobs
+WHERE user_id IS NOT NULL
+  AND status IN ('analysis_queued', 'analysis_processing')
+  AND result_source IS DISTINCT FROM 'coalesced'
+GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE SET running = EXCLUDED.running;
+
+-- The reaper also corrects counters that drifted from analysis_jobs. Each one is recounted
+-- while its row is locked, so a concurrent admission is either fully counted or waits.
+CREATE OR REPLACE FUNCTION release_stuck_analysis_jobs(
+  _processing_margin_minutes INT DEFAULT 5,
+  _queue_max_age_minutes INT DEFAULT 1440
+)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  _processing_released INT := 0;
+  _queued_released INT := 0;
+  _user_id INT;
+BEGIN
+  UPDATE analysis_jobs
+  SET status = 'analysis_error',
+      completed_at = NOW(),
+      error_message = 'Job automatically marked as failed - exceeded maximum allowed runtime'
+  WHERE status = 'analysis_processing'
+    AND started_at IS NOT NULL
+    AND timeout_seconds IS NOT NULL
+    AND started_at + (timeout_seconds + (_processing_margin_minutes * 60)) * INTERVAL '1 second' < NOW();
+  GET DIAGNOSTICS _processing_released = ROW_COUNT;
+
+  UPDATE analysis_jobs
+  SET status = 'analysis_error',
+      completed_at = NOW(),
+      error_message = 'Job automatically marked as failed - exceeded maximum time in queue'
+  WHERE status = 'analysis_queued'
+    AND created_at + (_queue_max_age_minutes * INTERVAL '1 minute') < NOW();
+  GET DIAGNOSTICS _queued_released = ROW_COUNT;
+
+  FOR _user_id IN
+    SELECT COALESCE(c.user_id, a.user_id)
+    FROM user_running_analyses c
+    FULL JOIN (
+      SELECT user_id, COUNT(*)::int AS running
+      FROM analysis_jobs
+      WHERE user_id IS NOT NULL
+        AND status IN ('analysis_queued', 'analysis_processing')
+        AND result_source IS DISTINCT FROM 'coalesced'
+      GROUP BY user_id
+    ) a ON a.user_id = c.user_id
+    WHERE COALESCE(c.running, 0) <> COALESCE(a.running, 0)
+  LOOP
+    INSERT INTO user_running_analyses (user_id, running) VALUES (_user_id, 0)
+    ON CONFLICT (user_id) DO NOTHING;
+    PERFORM 1 FROM user_running_analyses WHERE user_id = _user_id FOR UPDATE;
+    UPDATE user_running_analyses
+    SET running = (
+      SELECT COUNT(*)::int
+      FROM analysis_jobs
+      WHERE user_id = _user_id
+        AND status IN ('analysis_queued', 'analysis_processing')
+        AND result_source IS DISTINCT FROM 'coalesced'
+    )
+    WHERE user_id = _user_id;
+  END LOOP;
+
+  RETURN _processing_released + _queued_released;
+END;
+$$;
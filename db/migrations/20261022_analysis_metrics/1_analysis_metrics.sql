@@ -0,0 +1,2 @@
+ALTER TABLE analysis_jobs
+  ADD COLUMN IF NOT EXISTS analysis_metrics JSONB;